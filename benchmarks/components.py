@@ -0,0 +1,212 @@
+"""
+Microbenchmarks of the layers of lsql: lexer, parser, planner and evaluator. They don't touch
+the filesystem: rows are synthetic.
+
+With --check results are compared with the baseline and the exit code is 1 if any component
+became slower by more than --max-slowdown percent.
+
+Usage: python -m benchmarks.components [--save-baseline | --check] [--components tokenize_small]
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple, OrderedDict
+from timeit import default_timer
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+
+from benchmarks.planning import or_chunks
+from lsql import ast
+from lsql import parser
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'components_baseline.json')
+
+DEFAULT_MAX_SLOWDOWN = 20  # percent
+
+NUM_ROWS = 10000
+
+SMALL_QUERY = "select name, size where ext = 'py' and size > 10kb order by mtime desc limit 10"
+LARGE_QUERY = ''.join(or_chunks(30000))
+
+# setup() returns the function to benchmark, `number` is how many times it's called per run
+Component = namedtuple('Component', ['name', 'setup', 'number'])
+
+
+class SyntheticRow(object):
+    """Row with the same interface as Stat, but with precomputed values."""
+
+    def __init__(self, values):
+        self._context = ast.Context(values)
+
+    def get_context(self):
+        return self._context
+
+
+def make_rows(num_rows=NUM_ROWS, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(num_rows):
+        ext = rng.choice(['py', 'txt', 'md', 'json', ''])
+        name = 'file{:d}.{}'.format(i, ext) if ext else 'file{:d}'.format(i)
+        rows.append(SyntheticRow({
+            'name': name,
+            'path': 'dir{:d}/{}'.format(i % 100, name),
+            'extension': ext,
+            'ext': ext,
+            'size': rng.randint(0, 1 << 20),
+            'mtime': 1500000000 + rng.randint(0, 10 ** 7),
+            'owner': rng.choice(['root', 'alice', 'bob']),
+            'depth': rng.randint(0, 5),
+        }))
+    return rows
+
+
+def _get_context():
+    return ast.CombinedContext(ast.ExecutionContext(ast.ExecutionState()), ast.BUILTIN_CONTEXT)
+
+
+def setup_tokenize(query):
+    return lambda: list(parser.tokenize(query))
+
+
+def setup_parse(query):
+    tokens = list(parser.tokenize(query))
+    return lambda: parser.parse(tokens)
+
+
+def setup_create():
+    # the same clauses the parser builds for SMALL_QUERY
+    query_node = parser.parse(list(parser.tokenize(SMALL_QUERY)))
+
+    def create():
+        return ast.QueryNode.create(
+            select_node=ast.SelectNode.create([ast.NameNode.create('name'), ast.NameNode.create('size')]),
+            from_node=None,
+            where_node=query_node.where_node,
+            group_node=None,
+            having_node=None,
+            order_node=query_node.order_node,
+            limit_node=query_node.limit_node,
+            offset_node=None,
+        )
+    return create
+
+
+def setup_evaluate():
+    where_node = parser.parse(list(parser.tokenize(
+        "select name where (ext = 'py' or name like 'file1%') and size between 1kb and 500kb"))).where_node
+    rows = make_rows()
+    context = _get_context()
+
+    def evaluate():
+        return sum(1 for row in rows if where_node.get_value(ast.CombinedContext(row.get_context(), context)))
+    return evaluate
+
+
+def setup_sort():
+    order_nodes = parser.parse(list(parser.tokenize('select name order by owner, size desc'))).order_node.children
+    rows = make_rows()
+    context = _get_context()
+    values = [[node.get_value(ast.CombinedContext(row.get_context(), context)) for node in order_nodes]
+              for row in rows]
+
+    def sort():
+        return sorted(ast.OrderByKey(row, order_nodes) for row in values)
+    return sort
+
+
+def setup_aggregate():
+    query_node = parser.parse(list(parser.tokenize(
+        'select owner, count(*), sum(size), max(mtime) group by owner')))
+    rows = make_rows()
+    return lambda: query_node._group(rows, _get_context())
+
+
+COMPONENTS = [
+    Component('tokenize_small', lambda: setup_tokenize(SMALL_QUERY), 2000),
+    Component('tokenize_large', lambda: setup_tokenize(LARGE_QUERY), 3),
+    Component('parse_small', lambda: setup_parse(SMALL_QUERY), 2000),
+    Component('parse_large', lambda: setup_parse(LARGE_QUERY), 3),
+    Component('create_query', setup_create, 2000),
+    Component('evaluate_where', setup_evaluate, 5),
+    Component('sort_order_by_key', setup_sort, 5),
+    Component('aggregate', setup_aggregate, 5),
+]
+COMPONENTS_BY_NAME = OrderedDict((component.name, component) for component in COMPONENTS)
+
+
+def measure(component, repeat):
+    """
+    :return: best time of one call in seconds
+    """
+    fn = component.setup()
+    best = float('inf')
+    # like timeit: garbage collection makes timings noisy
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = default_timer()
+            for _ in range(component.number):
+                fn()
+            best = min(best, default_timer() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best / component.number
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fileobj:
+        return json.load(fileobj)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--components', type=lambda value: value.split(','), default=list(COMPONENTS_BY_NAME))
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--baseline', default=BASELINE_PATH)
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument('--save-baseline', action='store_true')
+    group.add_argument('--check', action='store_true',
+                       help='fail if a component is slower than the baseline by more than --max-slowdown')
+    arg_parser.add_argument('--max-slowdown', type=float, default=DEFAULT_MAX_SLOWDOWN, help='percent')
+    args = arg_parser.parse_args()
+    unknown = set(args.components) - set(COMPONENTS_BY_NAME)
+    if unknown:
+        arg_parser.error('unknown components: {}'.format(', '.join(sorted(unknown))))
+
+    baseline = load_baseline(args.baseline)
+    slower = []
+    print('{:<18} {:>14} {:>14} {:>9}'.format('component', 'us per call', 'baseline us', 'change'))
+    for name in args.components:
+        seconds = measure(COMPONENTS_BY_NAME[name], args.repeat)
+        base_seconds = baseline.get(name)
+        change = ''
+        if base_seconds:
+            percent = (seconds / base_seconds - 1) * 100
+            change = '{:+.1f}%'.format(percent)
+            if percent > args.max_slowdown:
+                slower.append(name)
+        print('{:<18} {:>14.2f} {:>14} {:>9}'.format(
+            name, seconds * 1e6, '{:.2f}'.format(base_seconds * 1e6) if base_seconds else '-', change))
+        sys.stdout.flush()
+        baseline[name] = seconds
+    if args.save_baseline:
+        with open(args.baseline, 'w') as fileobj:
+            json.dump(baseline, fileobj, indent=2, separators=(',', ': '), sort_keys=True)
+            fileobj.write('\n')
+        print('Saved baseline to {}'.format(args.baseline))
+    if args.check and slower:
+        print('Slower than the baseline by more than {:.0f}%: {}'.format(args.max_slowdown, ', '.join(slower)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Memory benchmark: peak memory of queries whose rows all match WHERE and wait for the sort or grouping.
+
+The filesystem is synthetic: one directory with --rows files that exist only in memory, so 10M rows
+don't need 10M files on disk.
+
+Usage: python -m benchmarks.memory [--rows 10000000] [--queries sort_paths] [--max-bytes-per-row 500]
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+import argparse
+import json
+import os
+import stat
+import subprocess
+import sys
+
+DEFAULT_ROWS = 10 * 1000 * 1000
+
+ROOT = '/synthetic'
+
+QUERIES = OrderedDict([
+    ('sort_paths', 'select path, size order by size desc limit 10'),
+    ('sort_names', "select name order by mtime, name limit 10"),
+    ('group_ext', 'select ext, count(*), sum(size) group by ext'),
+])
+
+EXTENSIONS = ['py', 'txt', 'md', 'log', 'json']
+
+
+class SyntheticNames(object):
+    """Names of the files of the synthetic directory, they're generated on the fly."""
+
+    def __init__(self, num_names):
+        self._num_names = num_names
+
+    def __len__(self):
+        return self._num_names
+
+    def __iter__(self):
+        for i in range(self._num_names):
+            yield 'file{:09d}.{}'.format(i, EXTENSIONS[i % len(EXTENSIONS)])
+
+
+def install_synthetic_filesystem(num_rows):
+    """Replace filesystem calls of lsql.ast with the synthetic directory."""
+    from lsql import ast
+
+    def listdir(path):
+        return SyntheticNames(num_rows) if path == ROOT else []
+
+    def lstat(path):
+        index = int(os.path.basename(path)[4:13])
+        # deterministic, but not sorted
+        size = index * 7919 % 1000003
+        return os.stat_result((stat.S_IFREG | 0o644, index, 1, 1, 0, 0, size, 1500000000, 1500000000 + size, 1500000000))
+
+    ast._listdir = listdir
+    ast._lstat = lstat
+    ast._isdir = lambda path: path == ROOT
+    ast._isfile = lambda path: path != ROOT
+    ast._islink = lambda path: False
+    ast._ismount = lambda path: False
+
+
+def run_case(query_name, num_rows):
+    from lsql import prepared
+    from lsql import stats
+
+    install_synthetic_filesystem(num_rows)
+    query = prepared.prepare(QUERIES[query_name])
+    before = stats.get_peak_rss()
+    table = query.execute(ROOT.encode('utf-8'))
+    peak = stats.get_peak_rss()
+    return OrderedDict([
+        ('rows', num_rows),
+        ('result_rows', len(table)),
+        ('baseline_rss_bytes', before),
+        ('peak_rss_bytes', peak),
+    ])
+
+
+def run_isolated(query_name, num_rows):
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.memory', '--run-case', query_name, '--rows', str(num_rows),
+    ])
+    return json.loads(output, object_pairs_hook=OrderedDict)
+
+
+def _parse_queries(value):
+    names = value.split(',')
+    unknown = set(names) - set(QUERIES)
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown: {}'.format(', '.join(sorted(unknown))))
+    return names
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--rows', type=int, default=DEFAULT_ROWS)
+    arg_parser.add_argument('--queries', type=_parse_queries, default=list(QUERIES))
+    arg_parser.add_argument('--max-bytes-per-row', type=float,
+                            help='fail if a query takes more memory per row')
+    arg_parser.add_argument('--run-case', metavar='QUERY', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.rows)))
+        return 0
+
+    num_failed = 0
+    print('{:<12} {:>10} {:>10} {:>14}  {}'.format('query', 'rows', 'peak MB', 'bytes per row', 'status'))
+    for query_name in args.queries:
+        result = run_isolated(query_name, args.rows)
+        if result['peak_rss_bytes'] is None:
+            print('{:<12} peak memory is not available on this platform'.format(query_name))
+            continue
+        bytes_per_row = (result['peak_rss_bytes'] - result['baseline_rss_bytes']) / args.rows
+        failed = args.max_bytes_per_row is not None and bytes_per_row > args.max_bytes_per_row
+        num_failed += failed
+        print('{:<12} {:>10d} {:>10.1f} {:>14.1f}  {}'.format(
+            query_name, args.rows, result['peak_rss_bytes'] / (1 << 20), bytes_per_row,
+            'too much memory' if failed else 'ok'))
+        sys.stdout.flush()
+    return 1 if num_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+Planning benchmark: how long does it take to tokenize, parse and plan machine-generated
+queries with huge lists of OR'ed conditions and IN items.
+
+Usage: python -m benchmarks.planning [--max-nodes 100000]
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import time
+
+from lsql import parser
+
+SIZES = [1000, 3000, 10000, 30000, 100000]
+
+
+def or_chunks(num_nodes):
+    # each `size = N` condition is 3 nodes
+    num_conditions = max(num_nodes // 3, 1)
+    chunks = ['select name where size = 0']
+    chunks.extend(' or size = {:d}'.format(i) for i in range(1, num_conditions))
+    return chunks
+
+
+def in_chunks(num_nodes):
+    chunks = ['select name where name in (0']
+    chunks.extend(", 'name{:d}'".format(i) for i in range(1, num_nodes))
+    chunks.append(')')
+    return chunks
+
+
+def time_lexing(query, repeat):
+    best = float('inf')
+    tokens = None
+    for _ in range(repeat):
+        start = time.time()
+        tokens = list(parser.tokenize(query))
+        best = min(best, time.time() - start)
+    return best, tokens
+
+
+def time_planning(tokens, repeat):
+    best = float('inf')
+    query_node = None
+    for _ in range(repeat):
+        start = time.time()
+        query_node = parser.parse(tokens)
+        best = min(best, time.time() - start)
+    return best, query_node
+
+
+def count_nodes(node):
+    return sum(1 for _ in node.iter_subtree())
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--max-nodes', type=int, default=max(SIZES))
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    args = arg_parser.parse_args()
+
+    print('{:<6} {:>10} {:>10} {:>12} {:>12} {:>14}'.format(
+        'query', 'kilobytes', 'nodes', 'lex seconds', 'plan seconds', 'us per node'))
+    for name, make_chunks in [('or', or_chunks), ('in', in_chunks)]:
+        for size in SIZES:
+            if size > args.max_nodes:
+                break
+            query = ''.join(make_chunks(size))
+            lex_seconds, tokens = time_lexing(query, args.repeat)
+            plan_seconds, query_node = time_planning(tokens, args.repeat)
+            num_nodes = count_nodes(query_node)
+            print('{:<6} {:>10.1f} {:>10d} {:>12.4f} {:>12.4f} {:>14.2f}'.format(
+                name, len(query) / 1024, num_nodes, lex_seconds, plan_seconds,
+                (lex_seconds + plan_seconds) / num_nodes * 1e6))
+
+
+if __name__ == '__main__':
+    main()
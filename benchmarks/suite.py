@@ -0,0 +1,174 @@
+"""
+Query benchmarks: fixed matrix of queries against synthetic trees of different shapes.
+
+For every (tree, query) it records wall time (best of --repeat runs), peak memory of the process
+that runs it and the number of syscalls. Results are compared against the baseline: syscall counts
+are deterministic and must not grow, time and memory are allowed to be --tolerance worse.
+
+Usage: python -m benchmarks.suite [--save-baseline] [--shapes wide,deep] [--queries name_filter]
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from timeit import default_timer
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import trees
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+QUERIES = OrderedDict([
+    ('name_filter', "select path where name like '%.py'"),
+    ('stat_filter', 'select path where size > 2kb and mtime > 0'),
+    ('text_like', "select path where text like '%needle%'"),
+    ('order_limit', 'select path, size order by size desc limit 10'),
+    ('group_owner', 'select owner, count(*), sum(size) group by owner'),
+    ('dir_sizes', "select path, size where type = 'dir'"),
+])
+
+DEFAULT_TOLERANCE = 0.25
+
+
+def run_case(root, query_name, repeat):
+    """
+    Run the query in the current process.
+
+    :return: dictionary with results
+    """
+    from lsql import prepared
+    from lsql import stats
+
+    query = prepared.prepare(QUERIES[query_name])
+    best = float('inf')
+    for _ in range(repeat):
+        start = default_timer()
+        table = query.execute(root)
+        best = min(best, default_timer() - start)
+    # syscalls are counted in a separate run: counting isn't free
+    query_stats = query.execute(root, collect_stats=True).stats
+    return OrderedDict([
+        ('seconds', best),
+        ('peak_rss_bytes', stats.get_peak_rss()),
+        ('rows', len(table)),
+        ('syscalls', OrderedDict(sorted(query_stats.syscalls.viewitems()))),
+    ])
+
+
+def run_isolated(root, query_name, repeat):
+    """
+    Run the case in a new process, so the peak memory of one case doesn't affect others.
+    """
+    output = subprocess.check_output([
+        sys.executable, '-m', 'benchmarks.suite',
+        '--run-case', root, query_name, '--repeat', str(repeat),
+    ])
+    return json.loads(output, object_pairs_hook=OrderedDict)
+
+
+def compare(result, baseline, tolerance):
+    """
+    :return: list of descriptions of regressions
+    """
+    problems = []
+    if result['rows'] != baseline['rows']:
+        problems.append('rows {:d} != {:d}'.format(result['rows'], baseline['rows']))
+    # fewer syscalls is an improvement, save the new baseline to keep it
+    more_syscalls = OrderedDict(
+        (name, count) for name, count in result['syscalls'].items()
+        if count > baseline['syscalls'].get(name, 0)
+    )
+    if more_syscalls:
+        problems.append('syscalls {} > {}'.format(
+            _format_syscalls(more_syscalls),
+            _format_syscalls({name: baseline['syscalls'].get(name, 0) for name in more_syscalls})))
+    for key in ['seconds', 'peak_rss_bytes']:
+        if result[key] is not None and baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            problems.append('{} {:.1f}x of baseline'.format(key, result[key] / baseline[key]))
+    return problems
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fileobj:
+        return json.load(fileobj)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as fileobj:
+        json.dump(results, fileobj, indent=2, separators=(',', ': '), sort_keys=True)
+        fileobj.write('\n')
+
+
+def _format_syscalls(syscalls):
+    return ' '.join('{}={:d}'.format(name, count) for name, count in sorted(syscalls.items()))
+
+
+def _parse_list(value, choices):
+    names = value.split(',')
+    unknown = set(names) - set(choices)
+    if unknown:
+        raise argparse.ArgumentTypeError('unknown: {}'.format(', '.join(sorted(unknown))))
+    return names
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('--shapes', type=lambda value: _parse_list(value, trees.SHAPES_BY_NAME),
+                            default=[shape.__name__ for shape in trees.SHAPES])
+    arg_parser.add_argument('--queries', type=lambda value: _parse_list(value, QUERIES), default=list(QUERIES))
+    arg_parser.add_argument('--scale', type=int, default=1)
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--baseline', default=BASELINE_PATH)
+    arg_parser.add_argument('--save-baseline', action='store_true',
+                            help='save results as the new baseline instead of comparing with it')
+    arg_parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help='allowed relative regression of time and memory')
+    arg_parser.add_argument('--run-case', nargs=2, metavar=('ROOT', 'QUERY'), help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run_case:
+        root, query_name = args.run_case
+        print(json.dumps(run_case(root, query_name, args.repeat)))
+        return 0
+
+    baseline = load_baseline(args.baseline)
+    results = OrderedDict()
+    num_regressions = 0
+    print('{:<12} {:<12} {:>8} {:>10} {:>10}  {}'.format('tree', 'query', 'rows', 'seconds', 'peak MB', 'status'))
+    for shape_name in args.shapes:
+        tree = trees.generate(shape_name, args.scale)
+        root = tempfile.mkdtemp(prefix='lsql-benchmark-{}-'.format(shape_name))
+        try:
+            trees.build(tree, root)
+            for query_name in args.queries:
+                key = '{}/{}/{}'.format(shape_name, args.scale, query_name)
+                result = results[key] = run_isolated(root, query_name, args.repeat)
+                if key in baseline:
+                    problems = compare(result, baseline[key], args.tolerance)
+                    status = '; '.join(problems) or 'ok'
+                    num_regressions += bool(problems)
+                else:
+                    status = 'no baseline'
+                print('{:<12} {:<12} {:>8d} {:>10.4f} {:>10.1f}  {}'.format(
+                    shape_name, query_name, result['rows'], result['seconds'],
+                    (result['peak_rss_bytes'] or 0) / (1 << 20), status))
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(root)
+    if args.save_baseline:
+        baseline.update(results)
+        save_baseline(args.baseline, baseline)
+        print('Saved baseline to {}'.format(args.baseline))
+        return 0
+    return 1 if num_regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
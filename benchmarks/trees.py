@@ -0,0 +1,140 @@
+"""
+Deterministic generator of synthetic directory trees for benchmarks.
+
+The same shape, scale and seed always produce the same tree: names, sizes, contents and
+modification times.
+
+Usage: python -m benchmarks.trees wide /tmp/wide [--scale 2]
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple
+import argparse
+import os
+import random
+
+SEED = 1729
+
+# all files have this mtime, so time-based queries are reproducible
+MTIME = 1500000000
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'lorem', 'ipsum', 'dolor', 'amet', 'select', 'where']
+NEEDLE = 'needle'
+EXTENSIONS = ['.txt', '.py', '.md', '.log', '.json', '']
+
+# `files` is a list of (relative path, size)
+Tree = namedtuple('Tree', ['shape', 'dirs', 'files'])
+
+
+def wide(rng, scale):
+    """Many directories with many files, one level deep."""
+    files = []
+    for i in range(50 * scale):
+        for j in range(40):
+            files.append((os.path.join('dir{:04d}'.format(i), _file_name(rng, j)), rng.randint(0, 4096)))
+    return files
+
+
+def deep(rng, scale):
+    """Long chain of nested directories with a few files on every level."""
+    files = []
+    path = ''
+    for i in range(100 * scale):
+        path = os.path.join(path, 'level{:03d}'.format(i))
+        for j in range(5):
+            files.append((os.path.join(path, _file_name(rng, j)), rng.randint(0, 4096)))
+    return files
+
+
+def skewed(rng, scale):
+    """One huge directory and a lot of tiny ones."""
+    files = []
+    for j in range(1500 * scale):
+        files.append((os.path.join('big', _file_name(rng, j)), rng.randint(0, 4096)))
+    for i in range(100 * scale):
+        files.append((os.path.join('small', 'dir{:04d}'.format(i), _file_name(rng, 0)), rng.randint(0, 4096)))
+    return files
+
+
+def small_files(rng, scale):
+    """Lots of tiny files, their `text` is cheap to read, but there are many of them."""
+    files = []
+    for i in range(20 * scale):
+        for j in range(100):
+            files.append((os.path.join('dir{:04d}'.format(i), _file_name(rng, j)), rng.randint(0, 512)))
+    return files
+
+
+def huge_files(rng, scale):
+    """A few big files: reading `text` dominates."""
+    return [('huge{:d}.log'.format(i), (1 << 22) + rng.randint(0, 1 << 20)) for i in range(4 * scale)]
+
+
+SHAPES = [wide, deep, skewed, small_files, huge_files]
+SHAPES_BY_NAME = {shape.__name__: shape for shape in SHAPES}
+
+
+def generate(shape_name, scale=1, seed=SEED):
+    """
+    :return: Tree, description of the tree without creating it.
+    """
+    rng = random.Random(seed)
+    files = SHAPES_BY_NAME[shape_name](rng, scale)
+    dirs = sorted({os.path.dirname(path) for path, _ in files} - {''})
+    return Tree(shape=shape_name, dirs=dirs, files=files)
+
+
+def build(tree, root, seed=SEED):
+    """
+    Create files and directories of the `tree` under the `root` directory.
+    """
+    rng = random.Random(seed)
+    # content is sliced from one random block, so generating big files is fast
+    block = _make_text(rng, 1 << 16)
+    for directory in tree.dirs:
+        path = os.path.join(root, directory)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    for rel_path, size in tree.files:
+        path = os.path.join(root, rel_path)
+        offset = rng.randint(0, len(block) - 1)
+        with open(path, 'wb') as fileobj:
+            remaining = size
+            while remaining > 0:
+                chunk = block[offset:offset + remaining]
+                fileobj.write(chunk)
+                remaining -= len(chunk)
+                offset = 0
+        os.utime(path, (MTIME, MTIME))
+    for directory in reversed(tree.dirs):
+        os.utime(os.path.join(root, directory), (MTIME, MTIME))
+
+
+def _file_name(rng, index):
+    return 'file{:05d}{}'.format(index, rng.choice(EXTENSIONS))
+
+
+def _make_text(rng, size):
+    words = []
+    length = 0
+    while length < size:
+        # the needle is rare, so LIKE '%needle%' has to read most of the text
+        word = NEEDLE if rng.random() < 0.0005 else rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return '\n'.join(' '.join(words[i:i + 12]) for i in range(0, len(words), 12)).encode('ascii')
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument('shape', choices=sorted(SHAPES_BY_NAME))
+    arg_parser.add_argument('root')
+    arg_parser.add_argument('--scale', type=int, default=1)
+    args = arg_parser.parse_args()
+    tree = generate(args.shape, args.scale)
+    build(tree, args.root)
+    print('{}: {:d} directories, {:d} files'.format(args.root, len(tree.dirs), len(tree.files)))
+
+
+if __name__ == '__main__':
+    main()
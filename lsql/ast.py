@@ -1,17 +1,23 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+from array import array
 from collections import defaultdict, namedtuple, OrderedDict, Sized
 from datetime import datetime
-from functools import total_ordering, wraps
+from functools import partial, total_ordering
 from grp import getgrgid
-from itertools import chain
+from itertools import chain, imap, izip
 from pwd import getpwuid
 from stat import S_IXUSR
+from timeit import default_timer
+import codecs
 import errno
 import numbers
 import operator
 import os
+import re
 
+from lsql import stats
+from lsql import tracing
 from lsql.errors import LsqlError
 
 _MISSING = object()
@@ -48,7 +54,12 @@ class Namespace(object):
 
 
 class Context(Namespace):
-    pass
+    # ExecutionState of the running query, contexts created during execution have it
+    execution = None
+
+    def get_stat(self):
+        """:return: Stat of the current row of the files table or None"""
+        return None
 
 
 class EmptyContext(Context):
@@ -69,6 +80,8 @@ class CombinedContext(Context):
     def __init__(self, *contexts):
         for context in contexts:
             assert isinstance(context, Context)
+            if self.execution is None:
+                self.execution = context.execution
         self._contexts = contexts
 
     def __getitem__(self, key):
@@ -87,10 +100,64 @@ class CombinedContext(Context):
         else:
             return True
 
+    def get_stat(self):
+        for context in self._contexts:
+            stat = context.get_stat()
+            if stat is not None:
+                return stat
+        return None
+
     def __repr__(self):
         return 'CombinedContext(contexts={!r})'.format(self._contexts)
 
 
+class ExecutionContext(EmptyContext):
+    """Context that only carries the ExecutionState."""
+
+    def __init__(self, execution):
+        self.execution = execution
+
+    def __repr__(self):
+        return 'ExecutionContext(execution={!r})'.format(self.execution)
+
+
+class ExecutionState(object):
+    """
+    Mutable state of a single query execution. Plan nodes are never modified during execution,
+    so one plan can be executed concurrently (or recursively) with different ExecutionStates.
+    State of a node is keyed by id() of the node, nodes are alive as long as their plan.
+    """
+
+    def __init__(self, stats=None, batch_size=None):
+        """
+        :param stats: QueryStats, if per-stage stats should be collected (e.g EXPLAIN ANALYZE)
+        :param batch_size: if it's not None, then conditions and aggregates are evaluated
+        for batches of this many rows (see lsql.batch)
+        """
+        self.stats = stats
+        self.batch_size = batch_size
+        self._aggregates = {}  # id(AggFunctionNode) -> Aggregate
+        self._subquery_values = {}  # id(SubqueryNode) -> ValueSet
+
+    def get_aggregate(self, agg_node):
+        key = id(agg_node)
+        aggregate = self._aggregates.get(key)
+        if aggregate is None:
+            aggregate = self._aggregates[key] = agg_node.aggregate_class()
+        return aggregate
+
+    def clear_aggregates(self, agg_nodes):
+        for agg_node in agg_nodes:
+            self._aggregates.pop(id(agg_node), None)
+
+    def get_subquery_values(self, subquery_node):
+        """:return: materialized result of the subquery or None if it wasn't executed yet."""
+        return self._subquery_values.get(id(subquery_node))
+
+    def set_subquery_values(self, subquery_node, values):
+        self._subquery_values[id(subquery_node)] = values
+
+
 # TODO: think about better Expr & Visitor representation
 class NodeVisitor(object):
     def visit(self, node):
@@ -103,7 +170,7 @@ class AggFunctionsVisitor(NodeVisitor):
 
     def visit(self, node):
         if isinstance(node, FunctionNode):
-            if node.function_name in AGGREGATES:
+            if FUNCTIONS.is_aggregate(node.function_name):
                 self.agg_function_nodes.append(node)
 
     @property
@@ -126,7 +193,7 @@ def has_agg_functions_nodes(node):
 
 
 # TODO: use get_nodes_of_type, but accurately, because in has_agg_function_nodes we don't search
-# TODO: ... class, we check AGGREGATES
+# TODO: ... class, we check FUNCTIONS.is_aggregate
 def get_agg_function_nodes(node):
     visitor = AggFunctionsVisitor()
     node.walk(visitor)
@@ -139,14 +206,6 @@ def get_nodes_of_type(node, node_class):
     return visitor.nodes
 
 
-def has_ancestor_of_type(node, ancestor_node_class):
-    while node.parent is not None:
-        if isinstance(node.parent, ancestor_node_class):
-            return True
-        node = node.parent
-    return False
-
-
 class NodeTransformer(NodeVisitor):
     def visit(self, node):
         """
@@ -165,7 +224,7 @@ class AggFunctionsTransformer(NodeTransformer):
     # TODO: refactor it. Maybe move logic to Node.transform?
     def visit(self, node):
         if isinstance(node, FunctionNode):
-            if node.function_name in AGGREGATES:
+            if FUNCTIONS.is_aggregate(node.function_name):
                 return AggFunctionNode.create(
                     function_name=node.function_name, arg_nodes=node.children, location=node.location)
         return node
@@ -197,17 +256,114 @@ class FilesTableContext(Context):
     def __contains__(self, key):
         return self.prepare_key(key) in self._stat.ATTRS
 
+    def get_stat(self):
+        return self._stat
+
     def __repr__(self):
         return 'FilesTableContext(stat={!r})'.format(self._stat)
 
 
+class ProjectedRow(object):
+    """
+    Row of the files table that keeps only the columns needed after WHERE. It's much smaller
+    than Stat, so rows that wait for sorting or grouping take less memory.
+    """
+    __slots__ = ('_values', '_positions')
+
+    def __init__(self, values, positions):
+        """
+        :param values: tuple of the values of the columns
+        :param positions: dictionary column name -> position in `values`, it's shared by all rows
+        """
+        self._values = values
+        self._positions = positions
+
+    def get_context(self):
+        return ProjectedRowContext(self._values, self._positions)
+
+
+class DeferredRow(ProjectedRow):
+    """
+    ProjectedRow that keeps the Stat it's made of, so the expensive columns (see Stat.DEFERRED_ATTRS)
+    can be evaluated later, only if the row survives sorting and LIMIT.
+    """
+    __slots__ = ('_source',)
+
+    def __init__(self, values, positions, source):
+        """
+        :type source: Stat
+        """
+        super(DeferredRow, self).__init__(values, positions)
+        self._source = source
+
+    def get_context(self):
+        return CombinedContext(ProjectedRowContext(self._values, self._positions), self._source.get_context())
+
+
+class ProjectedRowContext(Context):
+    def __init__(self, values, positions):
+        self._values = values
+        self._positions = positions
+
+    def __getitem__(self, key):
+        key = self.prepare_key(key)
+        return self._values[self._positions[Stat.ATTR_ALIASES.get(key, key)]]
+
+    def __contains__(self, key):
+        key = self.prepare_key(key)
+        return Stat.ATTR_ALIASES.get(key, key) in self._positions
+
+    def __repr__(self):
+        return 'ProjectedRowContext(values={!r})'.format(self._values)
+
+
+class RowProjector(object):
+    """
+    Converts Stat to ProjectedRow with the given columns.
+    """
+
+    def __init__(self, name_nodes, keep_source=False):
+        """
+        :param name_nodes: list of NameNode, one for every column. Values are evaluated by the nodes
+        of the query, so profiler sees them.
+        :param keep_source: make DeferredRow, other columns of the Stat can be evaluated later
+        """
+        self._name_nodes = name_nodes
+        self._keep_source = keep_source
+        self._positions = {}
+        for i, node in enumerate(name_nodes):
+            name = Namespace.prepare_key(node.name)
+            self._positions[Stat.ATTR_ALIASES.get(name, name)] = i
+
+    def __call__(self, row, row_context):
+        """
+        :param row_context: context of the row, it's used to evaluate the columns
+        """
+        if not isinstance(row, Stat):
+            return row
+        values = tuple([node.get_value(row_context) for node in self._name_nodes])
+        if self._keep_source:
+            return DeferredRow(values, self._positions, row)
+        return ProjectedRow(values, self._positions)
+
+
 class TaggedStr(str):
-    def __new__(cls, string, tags):
-        return super(TaggedStr, cls).__new__(cls, string)
+    """
+    Byte string with tags of the file (e.g 'dir', 'exec'). Tags are an attribute of the class:
+    there's a subclass for every set of tags, so instances don't need __dict__.
+    """
+    __slots__ = ()
+
+    tags = frozenset()
+    _classes = {}  # frozenset of tags -> subclass
 
-    def __init__(self, string, tags):
-        super(TaggedStr, self).__init__(string)
-        self.tags = tags
+    def __new__(cls, string, tags):
+        tags = frozenset(tags)
+        tagged_class = TaggedStr._classes.get(tags)
+        if tagged_class is None:
+            tagged_class = TaggedStr._classes[tags] = type(
+                str('TaggedStr'), (TaggedStr,), {'__slots__': (), 'tags': tags})
+        return super(TaggedStr, cls).__new__(tagged_class, string)
 
 
 @total_ordering
@@ -252,11 +408,229 @@ def get_dir_size(path):
     size = 0
     walker = DirectoryWalker(path)
     for path, _ in walker.walk():
-        if os.path.isfile(path):
-            size += os.lstat(path).st_size
+        if _isfile(path):
+            size += _lstat(path).st_size
     return size
 
 
+# Wrappers of the filesystem calls, they're counted in the active QueryStats (see EXPLAIN ANALYZE)
+
+def _listdir(path, on_listed=None):
+    """
+    :param on_listed: function (path, number of entries), it's called before the tracer gets the listing
+    """
+    stats.count('listdir')
+    tracer = tracing.get_tracer()
+    if tracer is None and on_listed is None:
+        return os.listdir(path)
+    start = default_timer()
+    names = os.listdir(path)
+    seconds = default_timer() - start
+    if on_listed is not None:
+        on_listed(path, len(names))
+    if tracer is not None:
+        tracer.directory_listed(path, len(names), seconds)
+    return names
+
+
+def _lstat(path):
+    stats.count('lstat')
+    return os.lstat(path)
+
+
+def _isdir(path):
+    stats.count('stat')
+    return os.path.isdir(path)
+
+
+def _isfile(path):
+    stats.count('stat')
+    return os.path.isfile(path)
+
+
+def _islink(path):
+    stats.count('lstat')
+    return os.path.islink(path)
+
+
+def _ismount(path):
+    # lstat of the path and of its parent
+    stats.count('lstat', 2)
+    return os.path.ismount(path)
+
+
+def _read_file(path):
+    with FileContent(path) as content:
+        return content.read()
+
+
+def report_file_read(path, num_bytes):
+    """Count bytes read from the file in the stats and report them to the tracer."""
+    stats.count_read(num_bytes)
+    tracer = tracing.get_tracer()
+    if tracer is not None:
+        tracer.file_read(path, num_bytes)
+
+
+# content of smaller files is read at once, bigger files are read by chunks of this size
+CONTENT_CHUNK_SIZE = 1 << 16
+
+
+class FileContent(object):
+    """
+    File opened for reading its content (e.g `text` column). Reads are counted in the stats and
+    reported to the tracer when the file is closed.
+    """
+
+    def __init__(self, path):
+        stats.count('open')
+        self.path = path
+        self._fileobj = open(path, 'rb')
+        self._num_read = 0
+
+    @property
+    def size(self):
+        return os.fstat(self._fileobj.fileno()).st_size
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._num_read += len(data)
+        return data
+
+    def read_tail(self, size):
+        """:return: last `size` bytes of the file"""
+        self._fileobj.seek(max(0, self.size - size))
+        return self.read()
+
+    def iter_chunks(self, chunk_size=CONTENT_CHUNK_SIZE):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def count_lines(self, chunk_size=CONTENT_CHUNK_SIZE):
+        """:return: number of lines, the same as len(content.splitlines())"""
+        count = 0
+        last_char = b''
+        for chunk in self.iter_chunks(chunk_size):
+            # '\r\n' is one line break
+            count += chunk.count(b'\n') + chunk.count(b'\r') - chunk.count(b'\r\n')
+            if last_char == b'\r' and chunk[0] == b'\n':
+                count -= 1
+            last_char = chunk[-1]
+        if last_char and last_char not in b'\r\n':
+            count += 1  # the last line without line break
+        return count
+
+    def map(self):
+        """
+        :return: read-only mmap of the whole file, pages are read by the OS when they're accessed.
+        Empty files can't be mapped.
+        """
+        import mmap
+        size = self.size
+        # it's counted as read: pages are read as soon as they're matched
+        self._num_read += size
+        return mmap.mmap(self._fileobj.fileno(), size, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._fileobj.close()
+        report_file_read(self.path, self._num_read)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+_LINE_BREAK = re.compile(br'\r\n?|\n')
+
+
+@total_ordering
+class LazyLines(object):
+    """
+    Lines of the file (`lines` column), it's a sequence like text.splitlines(). Length is counted
+    without reading the file into memory. The text is read on the first access to the lines and
+    only offsets of the lines are kept, lines are sliced from the text when they're accessed.
+    """
+    __slots__ = ('_path', '_length', '_text', '_starts')
+
+    def __init__(self, path):
+        self._path = path
+        self._length = None
+        self._text = None
+        self._starts = None  # offset of every line and the length of the text
+
+    def __len__(self):
+        if self._length is None:
+            if self._starts is not None:
+                self._length = len(self._starts) - 1
+            else:
+                with FileContent(self._path) as content:
+                    self._length = content.count_lines()
+        return self._length
+
+    def _index(self):
+        if self._starts is None:
+            text = self._text = _read_file(self._path)
+            starts = array(str('l'), [0] if text else [])
+            for match in _LINE_BREAK.finditer(text):
+                if match.end() < len(text):
+                    starts.append(match.end())
+            starts.append(len(text))
+            self._starts = starts
+        return self._starts
+
+    def _get_line(self, i):
+        line = self._text[self._starts[i]:self._starts[i + 1]]
+        if line.endswith(b'\r\n'):
+            return line[:-2]
+        if line.endswith((b'\n', b'\r')):
+            return line[:-1]
+        return line
+
+    def __getitem__(self, index):
+        num_lines = len(self._index()) - 1
+        if isinstance(index, slice):
+            return [self._get_line(i) for i in xrange(*index.indices(num_lines))]
+        if index < 0:
+            index += num_lines
+        if not 0 <= index < num_lines:
+            raise IndexError('line index out of range')
+        return self._get_line(index)
+
+    def __iter__(self):
+        for i in xrange(len(self._index()) - 1):
+            yield self._get_line(i)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyLines):
+            other = list(other)
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        if isinstance(other, LazyLines):
+            other = list(other)
+        return list(self) < other
+
+    # it's a sequence like list
+    __hash__ = None
+
+    def __unicode__(self):
+        return unicode(list(self))
+
+    def __str__(self):
+        return str(list(self))
+
+    def __repr__(self):
+        return 'LazyLines(path={!r})'.format(self._path)
+
+
 class Timestamp(int):
     def __str__(self):
         # TODO: not utc?
@@ -278,7 +652,7 @@ class Stat(object):
         'path', 'fulldir', 'dir', 'name', 'extension', 'ext', 'no_ext',
         'mode', 'group', 'atime', 'mtime', 'ctime', 'birthtime',
         'depth', 'type', 'device', 'hardlinks', 'inode',
-        'text', 'lines', 'is_executable', 'is_exec'
+        'text', 'lines', 'line_count', 'md5', 'sha1', 'sha256', 'is_executable', 'is_exec'
     ])
 
     ATTR_ALIASES = {
@@ -288,10 +662,37 @@ class Stat(object):
 
     MAIN_ATTRS = ['mode', 'owner', 'size', 'mtime', 'path']
 
-    def __init__(self, path, depth):
-        self._path = path
+    # columns that make syscalls or read files (size of a directory walks it), if they are only
+    # selected they're evaluated after LIMIT
+    DEFERRED_ATTRS = frozenset(['size', 'owner', 'group', 'text', 'lines', 'line_count', 'md5', 'sha1', 'sha256'])
+
+    # content hashes, they're always deferred: big files are hashed in parallel after the filter
+    HASH_ATTRS = frozenset(['md5', 'sha1', 'sha256'])
+
+    # there can be millions of rows
+    __slots__ = ('_directory', '_name', 'depth', '__stat')
+
+    def __init__(self, directory, name, depth):
+        """
+        :type directory: Directory
+        :param name: name of the file in the directory
+        """
+        self._directory = directory
+        self._name = name
         self.depth = depth
-        self.__stat = os.lstat(path)
+        self.__stat = _lstat(self._path)
+
+    @classmethod
+    def from_path(cls, path, depth):
+        dir_path, name = os.path.split(path)
+        return cls(Directory.from_path(dir_path), name, depth)
+
+    @property
+    def _path(self):
+        # full paths aren't stored, rows of the directory share its Directory
+        if not self._directory.path:
+            return self._name
+        return os.path.join(self._directory.path, self._name)
 
     @property
     def path(self):
@@ -299,10 +700,7 @@ class Stat(object):
 
     @property
     def fullpath(self):
-        return TaggedStr(
-            os.path.normpath(os.path.join(os.getcwd(), self._path)),
-            self.get_tags(),
-        )
+        return TaggedStr(os.path.join(self._directory.fullpath, self._name), self.get_tags())
 
     @property
     def size(self):
@@ -312,19 +710,15 @@ class Stat(object):
 
     @property
     def owner(self):
-        return getpwuid(self.__stat.st_uid).pw_name
+        return self._directory.scan.names.get_owner(self.__stat.st_uid)
 
     @property
     def fulldir(self):
-        return os.path.dirname(self.fullpath)
+        return self._directory.fullpath
 
     @property
     def dir(self):
-        return os.path.dirname(self._path)
-
-    @property
-    def _name(self):
-        return os.path.basename(self._path)
+        return self._directory.path
 
     @property
     def name(self):
@@ -332,7 +726,7 @@ class Stat(object):
 
     @property
     def extension(self):
-        extension = os.path.splitext(self._path)[1]
+        extension = os.path.splitext(self._name)[1]
         return extension[1:]  # skip dot
 
     @property
@@ -345,7 +739,7 @@ class Stat(object):
 
     @property
     def group(self):
-        return getgrgid(self.__stat.st_gid).gr_name
+        return self._directory.scan.names.get_group(self.__stat.st_gid)
 
     @property
     def atime(self):
@@ -367,13 +761,13 @@ class Stat(object):
 
     @property
     def type(self):
-        if os.path.islink(self._path):
+        if _islink(self._path):
             return 'link'
-        elif os.path.isdir(self._path):
+        elif _isdir(self._path):
             return 'dir'
-        elif os.path.isfile(self._path):
+        elif _isfile(self._path):
             return 'file'
-        elif os.path.ismount(self._path):
+        elif _ismount(self._path):
             return 'mount'
         else:
             return 'unknown'
@@ -394,15 +788,57 @@ class Stat(object):
     def text(self):
         if self.type == 'dir':
             return NULL
-        with open(self._path, 'rb') as fileobj:
-            return fileobj.read()
+        return _read_file(self._path)
 
     @property
     def lines(self):
-        text = self.text
-        if text is NULL:
+        if self.type == 'dir':
+            return NULL
+        return LazyLines(self._path)
+
+    @property
+    def line_count(self):
+        if self.type == 'dir':
+            return NULL
+        with FileContent(self._path) as content:
+            return content.count_lines()
+
+    @property
+    def md5(self):
+        return self._get_hash('md5')
+
+    @property
+    def sha1(self):
+        return self._get_hash('sha1')
+
+    @property
+    def sha256(self):
+        return self._get_hash('sha256')
+
+    def _get_hash(self, algorithm):
+        if self.type != 'file':
+            return NULL
+        return self._directory.scan.hashes.get(self, algorithm)
+
+    def prefetch_hashes(self, stats_, algorithms):
+        """
+        Hash big files of the list in parallel, see lsql.hashes.ContentHashes.prefetch().
+
+        :param stats_: list of Stat of the same scan as this one
+        """
+        self._directory.scan.hashes.prefetch([stat for stat in stats_ if stat.type == 'file'], algorithms)
+
+    def match_text(self, matcher):
+        """
+        The same as matcher(self.text), but the file isn't kept in memory (see PatternMatcher.match_file).
+        """
+        if self.type == 'dir':
             return NULL
-        return text.splitlines()
+        return matcher.match_file(self._path)
+
+    def get_lstat(self):
+        """:return: result of os.lstat() of the path"""
+        return self.__stat
 
     def __getitem__(self, item):
         name = Stat.ATTR_ALIASES.get(item, item)
@@ -415,10 +851,11 @@ class Stat(object):
         return bool(self.__stat.st_mode & S_IXUSR)
 
     def get_tags(self):
-        tags = set()
-        if self.is_executable:
-            tags.add('exec')
-        tags.add(self.type)
+        """:return: frozenset of tags, it's shared by all paths with the same tags."""
+        key = (self.is_executable, self.type)
+        tags = _TAGS_CACHE.get(key)
+        if tags is None:
+            tags = _TAGS_CACHE[key] = frozenset(['exec', key[1]] if key[0] else [key[1]])
         return tags
 
     @classmethod
@@ -446,6 +883,10 @@ class Stat(object):
             'inode': unicode,
             'text': unicode,
             'lines': Sized,
+            'line_count': int,
+            'md5': unicode,
+            'sha1': unicode,
+            'sha256': unicode,
             'is_executable': bool,
             'ext': unicode,
             'is_exec': unicode,
@@ -455,26 +896,243 @@ class Stat(object):
         return FilesTableContext(self)
 
 
+# (is_executable, type) -> tags, there are just a few combinations
+_TAGS_CACHE = {}
+
+
+class Directory(object):
+    """
+    Directory of the files table rows. All rows of the directory share one Directory, so
+    `dir` and `fulldir` are the same string objects for them: they take memory once and
+    their hashes (e.g for GROUP BY dir) are computed once.
+    """
+    __slots__ = ('path', 'fullpath', 'scan')
+
+    def __init__(self, path, fullpath, scan):
+        """
+        :param path: path relative to the current directory, '' for the current directory itself
+        :param fullpath: normalized absolute path
+        :type scan: ScanState
+        """
+        self.path = path
+        self.fullpath = fullpath
+        self.scan = scan
+
+    @classmethod
+    def from_path(cls, path, cwd=None, scan=None):
+        if cwd is None:
+            cwd = os.getcwd()
+        if scan is None:
+            scan = ScanState()
+        return cls(path, os.path.normpath(os.path.join(cwd, path)), scan)
+
+    def __repr__(self):
+        return 'Directory(path={!r}, fullpath={!r})'.format(self.path, self.fullpath)
+
+
+class OwnerNames(object):
+    """
+    Names of the users and groups by their ids. Files of a tree usually have a few owners, so
+    getpwuid() and getgrgid() are called once per id instead of once per row. There's one per scan
+    of the files table: names aren't kept between queries.
+    """
+
+    def __init__(self):
+        self._users = {}
+        self._groups = {}
+
+    def get_owner(self, uid):
+        try:
+            return self._users[uid]
+        except KeyError:
+            stats.count('getpwuid')
+            name = self._users[uid] = getpwuid(uid).pw_name
+            return name
+
+    def get_group(self, gid):
+        try:
+            return self._groups[gid]
+        except KeyError:
+            stats.count('getgrgid')
+            name = self._groups[gid] = getgrgid(gid).gr_name
+            return name
+
+
+class ScanState(object):
+    """
+    Caches shared by the rows of one scan of the files table.
+    """
+
+    def __init__(self):
+        self.names = OwnerNames()
+        self._hashes = None
+
+    @property
+    def hashes(self):
+        """:rtype: lsql.hashes.ContentHashes"""
+        if self._hashes is None:
+            from lsql import hashes
+            self._hashes = hashes.ContentHashes(hashes.get_default_cache())
+        return self._hashes
+
+    def close(self):
+        """
+        Close the hash cache. It's reopened if hashes are needed again (e.g deferred columns
+        are evaluated after the scan is over).
+        """
+        if self._hashes is not None:
+            self._hashes.close()
+
+
+class FilesScan(object):
+    """
+    Rows of the files table: Stat of every entry under the `root` directory. They're produced lazily
+    while the scan is iterated.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._on_listed = None
+
+    def trace(self, tracer, query_node):
+        """
+        Report the scan and its listings to the `tracer` as the scan of `query_node`.
+        """
+        tracer.scan_started(query_node, self.root)
+        self._on_listed = partial(tracer.directory_scanned, query_node)
+
+    def __iter__(self):
+        walker = DirectoryWalker(self.root, on_listed=self._on_listed)
+        cwd = os.getcwd()
+        scan = ScanState()
+        dir_path = current = None
+        try:
+            for path, name, depth in walker.iter_entries():
+                # entries of the directory go in a row with the same `path` object
+                if path is not dir_path:
+                    dir_path = path
+                    rel_path = os.path.relpath(path, cwd)
+                    current = Directory.from_path('' if rel_path == os.curdir else rel_path, cwd, scan)
+                yield Stat(current, name, depth)
+        finally:
+            scan.close()
+
+
 def _files_table_function(directory):
-    walker = DirectoryWalker(directory)
-    for path, depth in walker.walk():
-        path = os.path.relpath(path, os.getcwd())
-        yield Stat(path, depth)
+    return FilesScan(directory)
 
 
 _files_table_function.return_type = Stat.get_type()
 
 
-def sql_function(function, signature):
-    @wraps(function)
-    def wrapper(*args):
-        for arg in args:
-            if arg is NULL:
-                return NULL
-        return function(*args)
+class Function(object):
+    """
+    Description of the SQL function: implementation, signature and properties.
+
+    Functions are resolved once (when the FunctionNode is created), so lookups, arity checks and
+    NULL handling decisions aren't repeated for every row.
+    """
+
+    def __init__(self, name, implementation, arg_types, return_type, propagates_null=True,
+                 is_pure=True, bind_constant=None):
+        """
+        :param name: unicode name of the function, e.g 'length' or '+'
+        :param implementation: python callable, it's called with exactly len(arg_types) arguments
+        :param arg_types: list of argument types
+        :param return_type: type of the result
+        :param propagates_null: if True, then function returns NULL if any of its arguments is NULL
+        and `implementation` is not called at all.
+        :param is_pure: if True, then function always returns the same result for the same arguments
+        and has no side effects.
+        :param bind_constant: optional callable. If the last argument of the binary function is
+        a constant, then bind_constant(constant) is called once at plan time, and its result is
+        called with the first argument instead of `implementation`.
+        """
+        self.name = name
+        self.implementation = implementation
+        self.arg_types = tuple(arg_types)
+        self.return_type = return_type
+        self.propagates_null = propagates_null
+        self.is_pure = is_pure
+        self.bind_constant = bind_constant
+
+    @property
+    def arity(self):
+        return len(self.arg_types)
+
+    def __call__(self, *args):
+        if self.propagates_null:
+            for arg in args:
+                if arg is NULL:
+                    return NULL
+        return self.implementation(*args)
+
+    def __repr__(self):
+        return 'Function(name={!r}, arity={:d})'.format(self.name, self.arity)
+
+
+class FunctionRegistry(object):
+    """
+    Case-insensitive collection of functions and aggregates available in queries.
+    """
+
+    def __init__(self, functions=(), aggregates=None):
+        """
+        :param functions: iterable of Function
+        :param aggregates: dictionary unicode -> Aggregate subclass
+        """
+        self._functions = {}
+        self._aggregates = {}
+        for function in functions:
+            self.register(function)
+        for name, aggregate_class in (aggregates or {}).viewitems():
+            self.register_aggregate(name, aggregate_class)
+
+    def register(self, function):
+        """
+        :type function: Function
+        """
+        self._functions[self.prepare_name(function.name)] = function
+
+    def register_aggregate(self, name, aggregate_class):
+        self._aggregates[self.prepare_name(name)] = aggregate_class
+
+    def resolve(self, name, num_args):
+        """
+        Find function (or aggregate) `name` and check that it can be called with `num_args`
+        arguments.
+
+        :rtype: Function|type
+        :raise UnknownFunctionError: if there's no such function
+        :raise WrongNumberOfArgumentsError: if function can't be called with `num_args` arguments
+        """
+        key = self.prepare_name(name)
+        if key in self._functions:
+            function = self._functions[key]
+            expected_num_args = function.arity
+        elif key in self._aggregates:
+            function = self._aggregates[key]
+            expected_num_args = 1
+        else:
+            raise UnknownFunctionError(name)
+        if num_args != expected_num_args:
+            raise WrongNumberOfArgumentsError(name, expected_num_args, num_args)
+        return function
+
+    def is_aggregate(self, name):
+        return self.prepare_name(name) in self._aggregates
 
-    wrapper.return_type = signature[-1]
-    return wrapper
+    def __getitem__(self, name):
+        return self._functions[self.prepare_name(name)]
+
+    def __contains__(self, name):
+        key = self.prepare_name(name)
+        return key in self._functions or key in self._aggregates
+
+    @staticmethod
+    def prepare_name(name):
+        assert isinstance(name, unicode)
+        return name.lower()
 
 
 class AnyIterable(object):
@@ -502,6 +1160,19 @@ class Aggregate(object):
     def add(self, *args, **kwargs):
         raise NotImplementedError
 
+    def add_batch(self, values):
+        """Add values of the batch of rows: list that can contain NULLs."""
+        for value in values:
+            self.add(value)
+
+    def add_array(self, array, wrap=None):
+        """
+        Add values of the batch of rows: numeric numpy array, it has no NULLs.
+
+        :param wrap: type of the values that was lost in the array, e.g Timestamp
+        """
+        self.add_batch(array.tolist() if wrap is None else map(wrap, array.tolist()))
+
     @property
     def value(self):
         raise NotImplementedError
@@ -518,6 +1189,12 @@ class CountAggregate(Aggregate):
         if value is not NULL:
             self._count += 1
 
+    def add_batch(self, values):
+        self._count += sum(1 for value in values if value is not NULL)
+
+    def add_array(self, array, wrap=None):
+        self._count += len(array)
+
     @property
     def value(self):
         return self._count
@@ -534,6 +1211,13 @@ class SumAggregate(Aggregate):
         if value is not NULL:
             self._sum += value
 
+    def add_batch(self, values):
+        self._sum += sum(value for value in values if value is not NULL)
+
+    def add_array(self, array, wrap=None):
+        # .item() converts numpy scalar to the python number
+        self._sum += array.sum().item()
+
     @property
     def value(self):
         return self._sum
@@ -553,6 +1237,11 @@ class MaxAggregate(Aggregate):
             else:
                 self._max = max(self._max, value)
 
+    def add_array(self, array, wrap=None):
+        if len(array):
+            value = array.max().item()
+            self.add(value if wrap is None else wrap(value))
+
     @property
     def value(self):
         return self._max
@@ -573,6 +1262,11 @@ class MinAggregate(Aggregate):
             else:
                 self._min = min(self._min, value)
 
+    def add_array(self, array, wrap=None):
+        if len(array):
+            value = array.min().item()
+            self.add(value if wrap is None else wrap(value))
+
     @property
     def value(self):
         return self._min
@@ -591,6 +1285,10 @@ class AvgAggregate(Aggregate):
             self._sum += value
             self._count += 1
 
+    def add_array(self, array, wrap=None):
+        self._sum += array.sum().item()
+        self._count += len(array)
+
     @property
     def value(self):
         # TODO: fix this check
@@ -614,57 +1312,358 @@ def in_(x, y):
     return x in y
 
 
-# TODO(aershov182): probably we don't need to prefix private names with underscore
-# TODO: builtin-function don't belong into context, there should be separate namespace for functions
-FUNCTIONS = Context({
-    'files': _files_table_function,
-    '||': sql_function(operator.add, [unicode, unicode, unicode]),
-    '+': sql_function(operator.add, [numbers.Number, numbers.Number, numbers.Number]),
-    '-': sql_function(operator.sub, [numbers.Number, numbers.Number, numbers.Number]),
-    '*': sql_function(operator.mul, [numbers.Number, numbers.Number, numbers.Number]),
-    '/': sql_function(operator.div, [numbers.Number, numbers.Number, numbers.Number]),
-    'negate': sql_function(operator.neg, [numbers.Number, numbers.Number]),
-    '>': sql_function(operator.gt, [numbers.Number, numbers.Number, numbers.Number]),
-    '>=': sql_function(operator.ge, [numbers.Number, numbers.Number, numbers.Number]),
-    '<': sql_function(operator.lt, [numbers.Number, numbers.Number, numbers.Number]),
-    '<=': sql_function(operator.le, [numbers.Number, numbers.Number, numbers.Number]),
-    '=': sql_function(operator.eq, [numbers.Number, numbers.Number, numbers.Number]),
-    '<>': sql_function(operator.ne, [numbers.Number, numbers.Number, numbers.Number]),
-    '^': sql_function(operator.pow, [numbers.Number, numbers.Number, numbers.Number]),
-    '%': sql_function(operator.mod, [numbers.Number, numbers.Number, numbers.Number]),
-    'length': sql_function(len, [Sized, int]),
-    'in': sql_function(in_, [object, AnyIterable])
-})
+class ValueSet(object):
+    """
+    Hashed set of values for the fast `x IN (...)` checks.
+    """
 
-BUILTIN_CONTEXT = BASE_CONTEXT
+    def __init__(self, values):
+        values = list(values)
+        for value in list(values):
+            # non-ascii literals should match byte strings from the file system too
+            if isinstance(value, unicode):
+                values.append(value.encode('utf-8'))
+        try:
+            self._values = frozenset(values)
+        except TypeError:  # unhashable values, e.g `lines` column in subquery
+            self._values = values
 
+    def __contains__(self, value):
+        try:
+            return value in self._values
+        except TypeError:  # unhashable value
+            return any(value == x for x in self._values)
 
-class DirectoryWalker(object):
-    def __init__(self, path):
+    def __call__(self, value):
+        return value in self
+
+    def __len__(self):
+        return len(self._values)
+
+    def get_values(self):
+        return self._values
+
+    def __eq__(self, other):
+        return isinstance(other, ValueSet) and self._values == other._values
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        if isinstance(self._values, frozenset):
+            return hash(self._values)
+        return hash(len(self._values))
+
+    def __repr__(self):
+        return 'ValueSet(values={!r})'.format(self._values)
+
+
+class PatternMatcher(object):
+    """
+    Compiled pattern of LIKE, ILIKE, RLIKE or RILIKE operator.
+    Matcher is called with the string (or list of strings, e.g `lines` column) and returns bool.
+    """
+
+    def __init__(self, pattern, case_insensitive):
+        self.pattern = pattern
+        self.case_insensitive = case_insensitive
+
+    def __call__(self, value):
+        if isinstance(value, (list, LazyLines)):
+            return any(self(item) for item in value)
+        if not isinstance(value, (bytes, unicode)):
+            value = unicode(value)
+        if self.case_insensitive:
+            value = _fold_case(value)
+        return self.match(value)
+
+    def match(self, string):
+        raise NotImplementedError
+
+    def match_file(self, path):
+        """
+        Match the content of the file. Small files are read at once, big ones are matched by
+        `_match_large` without reading them into memory.
+        """
+        with FileContent(path) as content:
+            if content.size <= CONTENT_CHUNK_SIZE:
+                return self(content.read())
+            return self._match_large(content)
+
+    def _match_large(self, content):
+        """
+        :type content: FileContent
+        """
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        if not isinstance(other, self.__class__):
+            return False
+        return (self.pattern, self.case_insensitive) == (other.pattern, other.case_insensitive)
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __hash__(self):
+        return hash((self.__class__, self.pattern, self.case_insensitive))
+
+    def __repr__(self):
+        return '{}(pattern={!r}, case_insensitive={!r})'.format(
+            self.__class__.__name__, self.pattern, self.case_insensitive)
+
+
+class SubstringMatcher(PatternMatcher):
+    """
+    Matcher for LIKE patterns that can be checked without regexes: 'foo', 'foo%', '%foo', '%foo%'.
+    """
+
+    def __init__(self, pattern, case_insensitive, method, needle):
+        """
+        :param method: one of 'equals', 'startswith', 'endswith', 'contains'
+        :param needle: unicode string without wildcards
+        """
+        super(SubstringMatcher, self).__init__(pattern, case_insensitive)
+        self.method = method
+        if case_insensitive:
+            needle = needle.lower()
+        self._unicode_needle = needle
+        self._bytes_needle = needle.encode('utf-8')
+        self._check = _SUBSTRING_CHECKS[method]
+
+    def match(self, string):
+        if isinstance(string, bytes):
+            return self._check(string, self._bytes_needle)
+        return self._check(string, self._unicode_needle)
+
+    def _match_large(self, content):
+        needle = self._bytes_needle
+        # case folding can change the size in UTF-8, e.g KELVIN SIGN is 3 bytes and 'k' is 1 byte
+        max_size = len(needle) * _MAX_FOLDED_SIZE_RATIO if self.case_insensitive else len(needle)
+        if self.method == 'startswith':
+            return self(content.read(max_size))
+        if self.method == 'endswith':
+            return self(content.read_tail(max_size))
+        if self.method == 'equals':
+            return content.size <= max_size and self(content.read())
+        if self.case_insensitive:
+            needle = self._unicode_needle
+            decoder = codecs.getincrementaldecoder('utf-8')('replace')
+            chunks = (decoder.decode(chunk).lower() for chunk in content.iter_chunks())
+            tail = ''
+        else:
+            chunks = content.iter_chunks()
+            tail = b''
+        # the needle can be split between chunks, so the end of the previous chunk is kept
+        tail_size = len(needle) - 1
+        for chunk in chunks:
+            chunk = tail + chunk
+            if needle in chunk:
+                return True
+            tail = chunk[len(chunk) - tail_size:] if tail_size else chunk[:0]
+        return False
+
+
+# maximum ratio of the size of a character in UTF-8 to the size of its lowercase
+_MAX_FOLDED_SIZE_RATIO = 3
+
+
+def _fold_case(string):
+    """
+    :return: lowercase unicode string. bytes.lower() changes only ASCII letters, so byte strings
+    are decoded first, invalid UTF-8 is replaced with U+FFFD.
+    """
+    if isinstance(string, bytes):
+        string = string.decode('utf-8', 'replace')
+    return string.lower()
+
+
+_SUBSTRING_CHECKS = {
+    'equals': operator.eq,
+    'startswith': lambda string, needle: string.startswith(needle),
+    'endswith': lambda string, needle: string.endswith(needle),
+    'contains': lambda string, needle: needle in string,
+}
+
+
+class RegexMatcher(PatternMatcher):
+    def __init__(self, pattern, case_insensitive, regex_pattern):
+        """
+        :param regex_pattern: unicode regular expression that should match the whole string
+        """
+        super(RegexMatcher, self).__init__(pattern, case_insensitive)
+        self.regex_pattern = regex_pattern
+        # we need re.DOTALL because string can contain newlines (e.g in `text` column)
+        flags = re.DOTALL
+        if case_insensitive:
+            flags |= re.IGNORECASE
+        full_pattern = r'(?:{})\Z'.format(regex_pattern)
+        try:
+            self._unicode_regex = re.compile(full_pattern, flags | re.UNICODE)
+            self._bytes_regex = re.compile(full_pattern.encode('utf-8'), flags)
+        except re.error as exc:
+            raise InvalidPatternError(pattern, unicode(exc))
+
+    def match(self, string):
+        if isinstance(string, bytes):
+            return self._bytes_regex.match(string) is not None
+        return self._unicode_regex.match(string) is not None
+
+    def _match_large(self, content):
+        # the regex should match the whole content, it's matched against the mapped file
+        mapped = content.map()
+        try:
+            if self.case_insensitive:
+                # bytes regex with re.IGNORECASE folds only ASCII letters
+                return self(mapped[:])
+            return self._bytes_regex.match(mapped) is not None
+        finally:
+            mapped.close()
+
+
+def compile_like(pattern, case_insensitive=False):
+    """
+    Compile LIKE pattern: % matches any number of characters, _ matches exactly one character.
+
+    :rtype: PatternMatcher
+    """
+    pattern = _to_unicode(pattern)
+    if '_' not in pattern:
+        parts = pattern.split('%')
+        if len(parts) == 1:
+            return SubstringMatcher(pattern, case_insensitive, 'equals', pattern)
+        if len(parts) == 2 and not parts[1]:
+            return SubstringMatcher(pattern, case_insensitive, 'startswith', parts[0])
+        if len(parts) == 2 and not parts[0]:
+            return SubstringMatcher(pattern, case_insensitive, 'endswith', parts[1])
+        if len(parts) == 3 and not parts[0] and not parts[2]:
+            return SubstringMatcher(pattern, case_insensitive, 'contains', parts[1])
+    regex_parts = []
+    for char in pattern:
+        if char == '%':
+            regex_parts.append('.*')
+        elif char == '_':
+            regex_parts.append('.')
+        else:
+            regex_parts.append(re.escape(char))
+    return RegexMatcher(pattern, case_insensitive, ''.join(regex_parts))
+
+
+def compile_rlike(pattern, case_insensitive=False):
+    """
+    Compile RLIKE pattern: regular expression that should match the whole string.
+
+    :rtype: PatternMatcher
+    """
+    pattern = _to_unicode(pattern)
+    return RegexMatcher(pattern, case_insensitive, pattern)
+
+
+def _to_unicode(string):
+    if isinstance(string, bytes):
+        # TODO: don't hardcode utf-8, figure out encodings
+        return string.decode('utf-8', 'replace')
+    return unicode(string)
+
+
+# (function_name, pattern) -> PatternMatcher, used when pattern is not known at plan time
+_MATCHERS_CACHE = {}
+_MATCHERS_CACHE_SIZE = 1024
+
+
+def _pattern_function(name, compile_pattern):
+    def implementation(value, pattern):
+        key = (name, pattern)
+        matcher = _MATCHERS_CACHE.get(key)
+        if matcher is None:
+            if len(_MATCHERS_CACHE) >= _MATCHERS_CACHE_SIZE:
+                _MATCHERS_CACHE.clear()
+            matcher = _MATCHERS_CACHE[key] = compile_pattern(pattern)
+        return matcher(value)
+
+    return Function(name, implementation, [unicode, unicode], bool, bind_constant=compile_pattern)
+
+
+def _binary_number_function(name, implementation, return_type=numbers.Number):
+    return Function(name, implementation, [numbers.Number, numbers.Number], return_type)
+
+
+def _comparison_function(name, implementation):
+    return Function(name, implementation, [object, object], bool)
+
+
+FUNCTIONS = FunctionRegistry(
+    functions=[
+        Function('files', _files_table_function, [unicode], _files_table_function.return_type,
+                 propagates_null=False, is_pure=False),
+        Function('||', operator.add, [unicode, unicode], unicode),
+        _binary_number_function('+', operator.add),
+        _binary_number_function('-', operator.sub),
+        _binary_number_function('*', operator.mul),
+        _binary_number_function('/', operator.div),
+        _binary_number_function('^', operator.pow),
+        _binary_number_function('%', operator.mod),
+        Function('negate', operator.neg, [numbers.Number], numbers.Number),
+        _comparison_function('>', operator.gt),
+        _comparison_function('>=', operator.ge),
+        _comparison_function('<', operator.lt),
+        _comparison_function('<=', operator.le),
+        _comparison_function('=', operator.eq),
+        _comparison_function('<>', operator.ne),
+        Function('length', len, [Sized], int),
+        Function('in', in_, [object, AnyIterable], bool, bind_constant=ValueSet),
+        _pattern_function('like', compile_like),
+        _pattern_function('ilike', partial(compile_like, case_insensitive=True)),
+        _pattern_function('rlike', compile_rlike),
+        _pattern_function('rilike', partial(compile_rlike, case_insensitive=True)),
+    ],
+    aggregates=AGGREGATES,
+)
+
+BUILTIN_CONTEXT = BASE_CONTEXT
+
+
+class DirectoryWalker(object):
+    def __init__(self, path, on_listed=None):
+        """
+        :param on_listed: function (path, number of entries) that gets every listing of the walk
+        """
         self.path = path
+        self.on_listed = on_listed
         self.forbidden_paths = []
 
-    def walk(self, path=None, depth=0):
+    def walk(self):
+        """:return: iterator over (path, depth) of all entries"""
+        for path, name, depth in self.iter_entries():
+            yield os.path.join(path, name), depth
+
+    def iter_entries(self, path=None, depth=0):
+        """
+        :return: iterator over (directory path, name, depth) of all entries, entries of one directory
+        have the same directory path object.
+        """
         if path is None:
             path = self.path
         try:
-            names = os.listdir(path)
+            names = _listdir(path, self.on_listed)
         except OSError as exc:
             if exc.errno == errno.ENOENT:
                 raise DirectoryDoesNotExistError(path)
-            elif exc.errno == errno.EPERM:
+            elif exc.errno in (errno.EACCES, errno.EPERM):
                 self.forbidden_paths.append(path)
+                stats.add_forbidden_path(path)
+                return
             else:
                 raise
+        stats.count_entries(len(names))
         dirs = []
         for name in names:
             full_path = os.path.join(path, name)
-            if os.path.isdir(full_path):
+            if _isdir(full_path):
                 dirs.append(full_path)
-            yield full_path, depth
+            yield path, name, depth
         for d in dirs:
-            if not os.path.islink(d):
-                for x in self.walk(d, depth + 1):
+            if not _islink(d):
+                for x in self.iter_entries(d, depth + 1):
                     yield x
 
 
@@ -683,16 +1682,82 @@ class DirectoryDoesNotExistError(LsqlEvalError):
         self.path = path
 
 
+class UnknownFunctionError(LsqlEvalError):
+    def __init__(self, function_name):
+        self.function_name = function_name
+
+    def __str__(self):
+        return 'unknown function: {}'.format(self.function_name)
+
+
+class InvalidPatternError(LsqlEvalError):
+    def __init__(self, pattern, reason):
+        self.pattern = pattern
+        self.reason = reason
+
+    def __str__(self):
+        return 'invalid pattern {!r}: {}'.format(self.pattern, self.reason)
+
+
+class IllegalSubqueryError(LsqlEvalError):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class MissingParameterError(LsqlEvalError):
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return 'no value for parameter :{}'.format(self.name)
+
+
+class InvalidBatchSizeError(LsqlEvalError):
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def __str__(self):
+        return 'batch size should be at least 1, got {!r}'.format(self.batch_size)
+
+
+class UnknownParameterError(LsqlEvalError):
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return 'query has no parameter :{}'.format(self.name)
+
+
+class WrongNumberOfArgumentsError(LsqlEvalError):
+    def __init__(self, function_name, expected, actual):
+        self.function_name = function_name
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        return '{} expects {:d} argument(s), got {:d}'.format(
+            self.function_name, self.expected, self.actual)
+
+
 Location = namedtuple('Location', ['text', 'start', 'end'])
 
 
 # TODO: Node object should contain a reference to its location in the string (and the string itself)
 # TODO: think about a good solution to e.g dualism of children and some other properties (e.g FunctionNode.arg_exprs)
-class Node(namedtuple('Node', ['data', 'children', 'location', 'parent'])):
-    def __new__(cls, data=None, children=None, location=None, parent=None):
+class Node(object):
+    __slots__ = ('data', 'children', 'location', 'parent')
+
+    def __init__(self, data=None, children=None, location=None, parent=None):
         if children is None:
             children = []
-        return super(Node, cls).__new__(cls, data=data, children=children, location=location, parent=parent)
+        self.data = data
+        self.children = children
+        self.location = location
+        # parent links are set once for the whole tree by link_parents()
+        self.parent = parent
 
     @classmethod
     def create(cls, children=None, location=None, parent=None):
@@ -703,15 +1768,57 @@ class Node(namedtuple('Node', ['data', 'children', 'location', 'parent'])):
         raise NotImplementedError
 
     def walk(self, visitor):
-        for child in self.children:
-            child = child._replace(parent=self)
-            child.walk(visitor)
-        visitor.visit(self)
+        """
+        Visit all nodes of the subtree: children are visited before their parent.
+        """
+        # iterative, because machine-generated queries can produce very deep trees
+        stack = [(self, False)]
+        while stack:
+            node, children_visited = stack.pop()
+            if children_visited:
+                visitor.visit(node)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
+
+    def iter_subtree(self, prune=()):
+        """
+        Iterate over all nodes of the subtree, parents go before their children.
+
+        :param prune: tuple of node classes, descendants of these nodes are skipped.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            if not isinstance(node, prune):
+                stack.extend(reversed(node.children))
+
+    def link_parents(self):
+        """
+        Set `parent` attribute of every node in the subtree.
+        """
+        for node in self.iter_subtree():
+            for child in node.children:
+                child.parent = node
 
     def transform(self, transformer):
         transformed_children = [child.transform(transformer) for child in self.children]
         return transformer.visit(self)._replace(children=transformed_children)
 
+    def _replace(self, **fields):
+        """
+        :return: copy of the node with some of the fields replaced.
+        """
+        values = {
+            'data': self.data,
+            'children': self.children,
+            'location': self.location,
+            'parent': self.parent,
+        }
+        values.update(fields)
+        return self.__class__(**values)
+
     def get_value(self, context):
         raise NotImplementedError
 
@@ -728,6 +1835,9 @@ class Node(namedtuple('Node', ['data', 'children', 'location', 'parent'])):
     def __ne__(self, other):
         return not (self == other)
 
+    # nodes are mutable (see link_parents) and compared by value, so they're unhashable
+    __hash__ = None
+
     def __repr__(self):
         # we can't show parent because of infinite recursion
         return '{}(data={!r}, children={!r}, location={!r})'.format(
@@ -735,6 +1845,8 @@ class Node(namedtuple('Node', ['data', 'children', 'location', 'parent'])):
 
 
 class NullNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, parent=None, children=None, location=None):
         return cls(data=None, children=children, location=location, parent=parent)
@@ -744,6 +1856,8 @@ class NullNode(Node):
 
 
 class OrderByPartNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, node, direction, location=None, parent=None):
         return cls(data=direction, children=[node], location=location, parent=parent)
@@ -763,11 +1877,15 @@ class OrderByPartNode(Node):
         return self.node.get_type(scope)
 
     def __hash__(self):
-        return hash((self.children, self.direction))
+        # children are unhashable (see Node.__hash__), equal parts have children of the same classes
+        return hash((tuple(type(child) for child in self.children), self.direction))
 
 
 @total_ordering
 class OrderByKey(object):
+    # there's a key for every sorted row
+    __slots__ = ('row', 'nodes')
+
     def __init__(self, row, nodes):
         assert len(row) == len(list(nodes))
         self.row = row
@@ -794,6 +1912,8 @@ class OrderByKey(object):
 
 # TODO: use namedtuple for children (and in other *Node classes too)
 class BetweenNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, value_node, first_node, last_node, location=None, parent=None):
         return cls(children=[value_node, first_node, last_node], location=location,
@@ -820,15 +1940,18 @@ class BetweenNode(Node):
 
 
 class QueryNode(Node):
-    # TODO: add slots to every Node subclass
     __slots__ = ()
 
+    # stages of the query execution in the order of execution, `project` and `group` are
+    # mutually exclusive
+    STAGES = ('scan', 'filter', 'group', 'project', 'sort', 'limit')
+
     @classmethod
     def create(cls, select_node, from_node, where_node, group_node, having_node, order_node,
                limit_node, offset_node, location=None, parent=None):
         if from_node is None:
             from_node = NameNode.create('cwd')
-        if isinstance(from_node, (NameNode, ValueNode)):
+        if isinstance(from_node, (NameNode, ValueNode, ParamNode)):
             from_node = FunctionNode.create('files', [from_node], location=from_node.location)
         from_type = from_node.get_type(BUILTIN_CONTEXT)
         if isinstance(select_node, SelectStarNode):
@@ -871,12 +1994,82 @@ class QueryNode(Node):
         select_node = select_node.transform(transformer)
         having_node = having_node.transform(transformer)
         order_node = order_node.transform(transformer)
-        return cls(
-            children=[select_node, from_node, where_node, group_node, having_node, order_node,
-                      limit_node, offset_node],
+        if not isinstance(group_node, FakeGroupNode):
+            _check_group_by(group_node, [select_node, having_node, order_node], from_type)
+        query_node = cls.from_children(
+            [select_node, from_node, where_node, group_node, having_node, order_node,
+             limit_node, offset_node],
             location=location,
             parent=parent,
         )
+        query_node.link_parents()
+        return query_node
+
+    @classmethod
+    def from_children(cls, children, location=None, parent=None):
+        """
+        Create query node from the already planned and checked children (e.g deserialized ones).
+        """
+        query_node = cls(children=children, location=location, parent=parent)
+        query_node.data = query_node._analyze()
+        return query_node
+
+    def _analyze(self):
+        # subqueries are analyzed by their own QueryNode
+        own_nodes = list(self.iter_subtree(prune=(SubqueryNode,)))
+        projected_name_nodes, deferred_name_nodes, content_match_nodes = self._get_projected_name_nodes()
+        return QueryAnalysis(
+            agg_function_nodes=[node for node in own_nodes if isinstance(node, AggFunctionNode)],
+            subquery_nodes=[node for node in own_nodes if isinstance(node, SubqueryNode)],
+            projected_name_nodes=projected_name_nodes,
+            deferred_name_nodes=deferred_name_nodes,
+            content_match_nodes=content_match_nodes,
+        )
+
+    def _get_projected_name_nodes(self):
+        """
+        :return: (projected, deferred, content_match). Projected and deferred are lists of NameNode,
+        one for every column of the files table that is used after WHERE. Deferred columns are
+        expensive and used only by SELECT of the query without grouping, they can be evaluated after
+        LIMIT. content_match is the list of ContentMatchNode of such SELECT whose column isn't used
+        anywhere else, they stream the file instead.
+        """
+        name_nodes = OrderedDict()  # column -> NameNode
+        deferred = OrderedDict()
+        content_match = []  # (ContentMatchNode, column)
+        streamed = set()  # id of NameNode matched by content_match
+        clauses = [self.select_node, self.group_node, self.having_node, self.order_node]
+        for clause in clauses:
+            for node in clause.iter_subtree(prune=(SubqueryNode,)):
+                if (clause is self.select_node and isinstance(node, ContentMatchNode) and
+                        isinstance(self.group_node, FakeGroupNode)):
+                    # parents go before their children, the argument is skipped below
+                    streamed.add(id(node.children[0]))
+                    content_match.append((node, Namespace.prepare_key(node.children[0].name)))
+                elif id(node) in streamed:
+                    continue
+                elif isinstance(node, NameNode):
+                    name = Namespace.prepare_key(node.name)
+                    name = Stat.ATTR_ALIASES.get(name, name)
+                    if name not in Stat.ATTRS or name in name_nodes:
+                        continue
+                    if (clause is self.select_node and name in Stat.DEFERRED_ATTRS and
+                            isinstance(self.group_node, FakeGroupNode)):
+                        deferred.setdefault(name, node)
+                    else:
+                        # e.g the column is both selected and used by ORDER BY
+                        name_nodes[name] = deferred.pop(name, node)
+        # e.g `text like '%x%'` is selected together with `text`: it's evaluated from the column
+        content_match_nodes = [node for node, name in content_match
+                               if name not in name_nodes and name not in deferred]
+        return list(name_nodes.viewvalues()), list(deferred.viewvalues()), content_match_nodes
+
+    @property
+    def analysis(self):
+        """
+        :rtype: QueryAnalysis
+        """
+        return self.data
 
     @property
     def select_node(self):
@@ -911,108 +2104,329 @@ class QueryNode(Node):
         return self.children[7]
 
     def get_value(self, context):
-        rows = []
+        if context.execution is None:
+            context = CombinedContext(ExecutionContext(ExecutionState()), context)
+        query_stats = context.execution.stats
+        tracer = tracing.get_tracer()
+        row_type = self._get_row_type(context)
+
+        from_rows = self.from_node.get_value(context)
+        if tracer is not None and isinstance(from_rows, FilesScan):
+            from_rows.trace(tracer, self)
+        if query_stats is not None:
+            from_rows = query_stats.iterate(self.get_stage_stats(query_stats, 'scan'), from_rows)
+        filtered_rows = []
+        if tracer is not None:
+            from_rows = _traced_scan(tracer, self, from_rows, filtered_rows)
+        run_stage = partial(self._run_stage, query_stats, tracer)
+        defer = self.defers_columns(context)
+        try:
+            filtered_rows = run_stage('filter', self._filter, from_rows, context, filtered_rows, defer)
+            if isinstance(self.group_node, FakeGroupNode):
+                # SELECT expressions are evaluated only for the rows that survive LIMIT
+                rows = run_stage('sort', self._sort, filtered_rows, context)
+                rows = run_stage('limit', self._limit, rows, context)
+                rows = run_stage('project', self._project, rows, context)
+            else:
+                keyed_rows = run_stage('group', self._group, filtered_rows, context)
+                rows = run_stage('sort', _sort_keyed_rows, keyed_rows)
+                rows = run_stage('limit', self._limit, rows, context)
+        finally:
+            # the scan is over, but the rows could use its caches after that
+            _close_scans(filtered_rows)
+        return Table(row_type, rows)
+
+    def get_stage_stats(self, query_stats, name):
+        """
+        :type query_stats: lsql.stats.QueryStats
+        :param name: one of QueryNode.STAGES
+        :rtype: lsql.stats.StageStats
+        """
+        return query_stats.get_stage((id(self), name), name)
+
+    def _run_stage(self, query_stats, tracer, name, fn, *args):
+        if tracer is not None:
+            tracer.stage_started(self, name)
+        if query_stats is None:
+            rows = fn(*args)
+        else:
+            stage = self.get_stage_stats(query_stats, name)
+            rows = query_stats.run(stage, fn, *args)
+            stage.rows_out += len(rows)
+        if tracer is not None:
+            tracer.stage_finished(self, name, len(rows))
+        return rows
+
+    def _get_row_type(self, context):
         from_type = self.from_node.get_type(context)
-        if not isinstance(self.group_node, FakeGroupNode):
-            name_nodes = []
-            agg_nodes = []
-            for node in [self.select_node, self.having_node, self.order_node]:
-                name_nodes.extend(get_nodes_of_type(node, NameNode))
-                agg_nodes.extend(get_nodes_of_type(node, AggFunctionNode))
-            for name_node in name_nodes:
-                if (
-                    name_node not in self.group_node.children) and name_node.name in from_type and not has_ancestor_of_type(
-                    name_node, AggFunctionNode):
-                    if all((node not in self.group_node.children) for node in up_to_root(name_node)):
-                        raise IllegalGroupBy(name_node)
-            for agg_node in agg_nodes:
-                if has_ancestor_of_type(agg_node, AggFunctionNode):
-                    # TODO: add message
-                    raise IllegalGroupBy(agg_node)
         select_context = CombinedContext(Context(from_type.as_dict()), context)
         row_type = OrderedDict()
         for i, node in enumerate(self.select_node.children):
             # TODO: check it in regard to group by
             row_type[get_name(node, 'column_{:d}'.format(i))] = node.get_type(select_context)
+        return row_type
 
-        def key(row):
-            # TODO(aershov182): `ORDER BY` context should depend on select_node
-            result = [e.get_value(CombinedContext(row.get_context(), context))
-                      for e in self.order_node.children]
-            return OrderByKey(result, self.order_node.children)
-
-        filtered_rows = []
-
-        keys = []
-        for from_row in self.from_node.get_value(context):
+    def _filter(self, from_rows, context, filtered_rows, defer=False):
+        """
+        :param filtered_rows: list to append matching rows to, it's shared with the tracing of the scan.
+        :param defer: don't evaluate deferred columns, rows keep their Stat objects instead
+        """
+        # rows are projected as soon as they pass WHERE, so Stat objects aren't kept until the sort
+        name_nodes = self.analysis.projected_name_nodes
+        if name_nodes is None:
+            project = _keep_row
+        elif defer:
+            project = RowProjector(name_nodes, keep_source=True)
+        else:
+            project = RowProjector(name_nodes + self.analysis.deferred_name_nodes)
+        batch_size = context.execution.batch_size
+        if batch_size is not None:
+            from lsql import batch
+            evaluate = batch.compile_node(self.where_node)
+            for record_batch in batch.iter_batches(from_rows, batch_size):
+                for from_row in batch.filter_rows(evaluate, record_batch, context):
+                    filtered_rows.append(project(from_row, CombinedContext(from_row.get_context(), context)))
+            return filtered_rows
+        for from_row in from_rows:
             row_context = CombinedContext(
                 from_row.get_context(),
                 context
             )
             if self.where_node.get_value(row_context):
-                keys.append(key(from_row))
-                filtered_rows.append(from_row)
-
-        if not isinstance(self.group_node, FakeGroupNode):
-            keys = []
-            agg_function_nodes = get_agg_function_nodes(self)
-            grouped = defaultdict(list)  # group_key -> rows
-            # TODO: check that stuff in select_expr and having_expr are legal
-            for row in filtered_rows:
-                row_context = CombinedContext(
-                    row.get_context(),
-                    context
-                )
-                key = tuple(node.get_value(row_context) for node in self.group_node.children)
-                grouped[key].append(row)
-
-            for key, grouped_rows in grouped.viewitems():
-                for agg_node in agg_function_nodes:
-                    agg_node.clear_aggregate()
-                cur_row = [None] * len(self.select_node.children)
-                order_row = [None] * len(self.order_node.children)
-                cond = False
-                for row in grouped_rows:
-                    row_context = CombinedContext(
-                        row.get_context(),
-                        context
-                    )
-                    for i, node in enumerate(self.select_node.children):
-                        if node in self.group_node:
-                            idx = self.group_node.children.index(node)
-                            column = key[idx]
-                        else:
-                            column = node.get_value(row_context)
-                        cur_row[i] = column
-                    for i, node in enumerate(self.order_node.children):
-                        if node.node in self.group_node.children:
-                            idx = self.group_node.children.index(node.node)
-                            column = key[idx]
-                        else:
-                            column = node.get_value(row_context)
-                        order_row[i] = column
-                    cond = self.having_node.get_value(row_context)
-                if cond:
-                    rows.append(cur_row)
-                    keys.append(OrderByKey(order_row, self.order_node.children))
-        else:
-            for row in filtered_rows:
+                filtered_rows.append(project(from_row, row_context))
+        return filtered_rows
+
+    def _project(self, filtered_rows, context):
+        hash_names = [Namespace.prepare_key(node.name) for node in self.analysis.deferred_name_nodes
+                      if Namespace.prepare_key(node.name) in Stat.HASH_ATTRS]
+        if hash_names:
+            _prefetch_hashes(filtered_rows, hash_names)
+        rows = []
+        for row in filtered_rows:
+            row_context = CombinedContext(
+                row.get_context(),
+                context
+            )
+            cur_row = []
+            for node in self.select_node.children:
+                column = node.get_value(row_context)
+                cur_row.append(column)
+            rows.append(cur_row)
+        return rows
+
+    def _sort(self, filtered_rows, context):
+        if not self.order_node.children:
+            return filtered_rows
+        keys = []
+        for from_row in filtered_rows:
+            # TODO(aershov182): `ORDER BY` context should depend on select_node
+            row_context = CombinedContext(from_row.get_context(), context)
+            result = [e.get_value(row_context) for e in self.order_node.children]
+            keys.append(OrderByKey(result, self.order_node.children))
+        # rows themselves aren't comparable, equal rows keep the order of the scan
+        return [row for _, row in sorted(zip(keys, filtered_rows), key=operator.itemgetter(0))]
+
+    def _group(self, filtered_rows, context):
+        """
+        :return: list of (OrderByKey, row) for every group that satisfies HAVING condition.
+        """
+        execution = context.execution
+        if execution.batch_size is not None:
+            from lsql import batch
+            if batch.can_aggregate(self):
+                return batch.aggregate(self, filtered_rows, context, execution.batch_size)
+        keyed_rows = []
+        agg_function_nodes = self.analysis.agg_function_nodes
+        grouped = defaultdict(list)  # group_key -> rows
+        # TODO: check that stuff in select_expr and having_expr are legal
+        for row in filtered_rows:
+            row_context = CombinedContext(
+                row.get_context(),
+                context
+            )
+            key = tuple(node.get_value(row_context) for node in self.group_node.children)
+            grouped[key].append(row)
+
+        for key, grouped_rows in grouped.viewitems():
+            execution.clear_aggregates(agg_function_nodes)
+            cur_row = [None] * len(self.select_node.children)
+            order_row = [None] * len(self.order_node.children)
+            cond = False
+            for row in grouped_rows:
                 row_context = CombinedContext(
                     row.get_context(),
                     context
                 )
-                cur_row = []
-                for node in self.select_node.children:
-                    column = node.get_value(row_context)
-                    cur_row.append(column)
-                rows.append(cur_row)
+                for i, node in enumerate(self.select_node.children):
+                    if node in self.group_node.children:
+                        idx = self.group_node.children.index(node)
+                        column = key[idx]
+                    else:
+                        column = node.get_value(row_context)
+                    cur_row[i] = column
+                for i, node in enumerate(self.order_node.children):
+                    if node.node in self.group_node.children:
+                        idx = self.group_node.children.index(node.node)
+                        column = key[idx]
+                    else:
+                        column = node.get_value(row_context)
+                    order_row[i] = column
+                cond = self.having_node.get_value(row_context)
+            if cond:
+                keyed_rows.append((OrderByKey(order_row, self.order_node.children), cur_row))
+        return keyed_rows
+
+    def defers_columns(self, context=None):
+        """
+        :return: True if the deferred columns are evaluated after LIMIT: the query has LIMIT, selects
+        content hashes or matches the content (see ContentMatchNode). Without context only a constant
+        LIMIT is known.
+        """
+        if self.analysis.content_match_nodes:
+            return True
+        deferred = self.analysis.deferred_name_nodes
+        if not deferred:
+            return False
+        if any(Namespace.prepare_key(node.name) in Stat.HASH_ATTRS for node in deferred):
+            return True
+        if context is None:
+            return not (isinstance(self.limit_node, ValueNode) and self.limit_node.value == float('inf'))
+        return self.limit_node.get_value(context) != float('inf')
 
-        rows = [row for _, row in sorted(zip(keys, rows))]
+    def _limit(self, rows, context):
         rows = rows[self.offset_node.get_value(context):]
         value = self.limit_node.get_value(context)
         if value != float('inf'):
             rows = rows[:value]
-        return Table(row_type, rows)
+        return rows
+
+    def __eq__(self, other):
+        # analysis is derived from children, it doesn't matter in equality
+        return isinstance(other, QueryNode) and self.children == other.children
+
+
+# projected_name_nodes are the columns that rows keep after WHERE (see ProjectedRow),
+# None means that rows aren't projected. deferred_name_nodes are evaluated after LIMIT (see DeferredRow)
+# if QueryNode.defers_columns(), otherwise they're projected too. content_match_nodes need the Stat of
+# the row in SELECT, their columns aren't projected at all.
+QueryAnalysis = namedtuple('QueryAnalysis', [
+    'agg_function_nodes', 'subquery_nodes', 'projected_name_nodes', 'deferred_name_nodes',
+    'content_match_nodes'])
+
+
+def _keep_row(row, row_context):
+    return row
+
+
+def _prefetch_hashes(rows, algorithms):
+    """
+    Hash big files of the rows in parallel before the hash columns are evaluated row by row.
+    """
+    by_scan = OrderedDict()  # id(ScanState) -> list of Stat
+    for row in rows:
+        stat = row.get_context().get_stat()
+        if stat is not None:
+            by_scan.setdefault(id(stat._directory.scan), []).append(stat)
+    for stats_ in by_scan.viewvalues():
+        stats_[0].prefetch_hashes(stats_, algorithms)
+
+
+def _close_scans(rows):
+    """
+    Close the scans (see ScanState) of the rows that kept their Stat objects.
+    """
+    if not rows or not isinstance(rows[0], (Stat, DeferredRow)):
+        return
+    closed = set()  # id(ScanState)
+    for row in rows:
+        stat = row._source if isinstance(row, DeferredRow) else row
+        scan = stat._directory.scan
+        if id(scan) not in closed:
+            closed.add(id(scan))
+            scan.close()
+
+
+def _traced_scan(tracer, query_node, rows, filtered_rows):
+    """
+    Report rows produced by the scan and rows matched by the filter in batches.
+    """
+    batch_size = 0
+    num_reported_matches = 0
+    for row in rows:
+        yield row
+        batch_size += 1
+        if batch_size == tracing.SCAN_BATCH_SIZE:
+            tracer.rows_produced(query_node, 'scan', batch_size)
+            tracer.rows_produced(query_node, 'filter', len(filtered_rows) - num_reported_matches)
+            num_reported_matches = len(filtered_rows)
+            batch_size = 0
+    if batch_size:
+        tracer.rows_produced(query_node, 'scan', batch_size)
+        tracer.rows_produced(query_node, 'filter', len(filtered_rows) - num_reported_matches)
+
+
+def _sort_keyed_rows(keyed_rows):
+    return [row for _, row in sorted(keyed_rows)]
+
+
+def _check_group_by(group_node, nodes, from_type):
+    """
+    Check that columns in `nodes` are either inside of the GROUP BY expressions or
+    inside of the aggregate functions. Every node is visited once, so it's linear in the size of the
+    query.
+
+    :raise IllegalGroupBy: if check fails
+    """
+    keys = _StructuralKeys()
+    group_keys = {keys.get(node) for node in group_node.children}
+    # (node, inside_of_group_expression, inside_of_aggregate)
+    stack = [(node, False, False) for node in nodes]
+    while stack:
+        node, inside_group, inside_agg = stack.pop()
+        inside_group = inside_group or keys.get(node) in group_keys
+        if isinstance(node, AggFunctionNode):
+            if inside_agg:
+                # TODO: add message
+                raise IllegalGroupBy(node)
+            inside_agg = True
+        elif isinstance(node, NameNode):
+            if node.name in from_type and not inside_group and not inside_agg:
+                raise IllegalGroupBy(node)
+        elif isinstance(node, SubqueryNode):
+            # subquery has its own GROUP BY
+            continue
+        stack.extend((child, inside_group, inside_agg) for child in node.children)
+
+
+class _StructuralKeys(object):
+    """
+    Assigns equal integer keys to equal (in terms of Node.__eq__) subtrees.
+    Key of every subtree is computed only once, so comparing subtrees is O(1).
+    """
+
+    def __init__(self):
+        self._interned = {}  # (node class, data, child keys) -> key
+        self._keys = {}  # id(node) -> key
+
+    def get(self, root):
+        # iterative post-order traversal: keys of children are computed before the key of parent
+        stack = [(root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if id(node) in self._keys:
+                continue
+            if not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children)
+                continue
+            child_keys = tuple(self._keys[id(child)] for child in node.children)
+            try:
+                signature = (node.__class__, node.data, child_keys)
+                hash(signature)
+            except TypeError:  # unhashable data, it's equal only to itself
+                signature = (node.__class__, id(node), child_keys)
+            self._keys[id(node)] = self._interned.setdefault(signature, len(self._interned))
+        return self._keys[id(root)]
 
 
 def get_name(node, default):
@@ -1021,32 +2435,138 @@ def get_name(node, default):
     return default
 
 
-def up_to_root(node):
-    while node is not None:
-        yield node
-        node = node.parent
+class Table(object):
+    """
+    Result of the query. Values are stored by columns: integer, time and float columns
+    are typed arrays (8 bytes per value), other columns are lists.
+    """
 
+    DEFAULT_BATCH_SIZE = 4096
 
-class Table(object):
-    def __init__(self, row_type, rows):
+    def __init__(self, row_type, rows, stats=None):
+        """
+        :param row_type: OrderedDict name -> type of the column
+        :param rows: list of rows, row is a sequence of values
+        """
         self.row_type = row_type
-        self.rows = rows
+        self._num_rows = len(rows)
+        self._columns = [_make_column(column_type, [row[i] for row in rows])
+                         for i, column_type in enumerate(row_type.viewvalues())]
+        # QueryStats of the execution, if it was requested
+        self.stats = stats
+
+    def __len__(self):
+        return self._num_rows
 
     def __iter__(self):
         py_type = namedtuple('SomeRow', list(self.row_type.keys()))
-        for row in self.rows:
-            yield py_type._make(row)
+        return imap(py_type._make, self.iter_rows())
+
+    @property
+    def rows(self):
+        """List of rows as lists. It's a copy, iter_rows() is cheaper."""
+        return [list(row) for row in self.iter_rows()]
+
+    def iter_rows(self):
+        """:return: iterator over rows as tuples."""
+        if not self._columns:
+            return iter([()] * self._num_rows)
+        return izip(*[self.get_column(i) for i in range(len(self._columns))])
+
+    def get_column(self, key):
+        """
+        :param key: name or index of the column
+        :return: iterable of the values of the column
+        """
+        values, wrap = self._columns[self._get_index(key)]
+        if wrap is None:
+            return values
+        return imap(wrap, values)
+
+    def iter_batches(self, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :return: iterator over OrderedDicts name -> list of values of the column, every dictionary
+        has at most `batch_size` rows.
+        """
+        for start in range(0, self._num_rows, batch_size):
+            batch = OrderedDict()
+            for name, (values, wrap) in izip(self.row_type, self._columns):
+                values = values[start:start + batch_size]
+                batch[name] = list(values) if wrap is None else map(wrap, values)
+            yield batch
+
+    def to_numpy(self, structured=False):
+        """
+        :param structured: if True, return numpy structured array, otherwise OrderedDict name -> array
+        Arrays of the integer and float columns share memory with the table, times are datetime64[s],
+        other columns are arrays of objects. Structured array is a copy.
+        Requires numpy.
+        """
+        import numpy
+
+        arrays = OrderedDict()
+        for name, (values, wrap) in izip(self.row_type, self._columns):
+            if isinstance(values, array):
+                dtype = '{}{:d}'.format('f' if values.typecode == 'd' else 'i', values.itemsize)
+                arrays[name] = numpy.frombuffer(values, dtype=dtype) if values else numpy.array([], dtype=dtype)
+                if wrap is Timestamp:
+                    arrays[name] = arrays[name].view('datetime64[s]')
+            else:
+                arrays[name] = numpy.array(values, dtype=object)
+        if not structured:
+            return arrays
+        result = numpy.empty(self._num_rows, dtype=[(str(name), values.dtype) for name, values in arrays.viewitems()])
+        for name, values in arrays.viewitems():
+            result[str(name)] = values
+        return result
+
+    def _get_index(self, key):
+        if isinstance(key, numbers.Integral):
+            return key
+        return list(self.row_type).index(key)
+
+
+# exact types of values that can be stored in the typed arrays: type -> (typecode, wrap)
+_ARRAY_TYPES = {
+    int: ('l', None),
+    long: ('l', None),
+    Timestamp: ('l', Timestamp),
+    float: ('d', None),
+}
+
+
+def _make_column(column_type, values):
+    """
+    :return: (values, wrap): typed array or list and the function that converts array items to values
+    """
+    if not values:
+        if column_type is int:
+            return array(str('l')), None
+        return values, None
+    types = set(imap(type, values))
+    if types <= {int, long}:
+        types = {int}
+    if len(types) == 1:
+        typecode, wrap = _ARRAY_TYPES.get(types.pop(), (None, None))
+        if typecode is not None:
+            try:
+                return array(str(typecode), values), wrap
+            except OverflowError:
+                pass
+    return values, None
 
 
 class SelectNode(Node):
-    pass
+    __slots__ = ()
 
 
 class OrderNode(Node):
-    pass
+    __slots__ = ()
 
 
 class FromNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, from_node, location=None, parent=None):
         return cls(children=[from_node], location=location, parent=parent)
@@ -1057,17 +2577,21 @@ class FromNode(Node):
 
 
 class GroupNode(Node):
+    __slots__ = ()
+
     @property
     def groups(self):
         return self.children
 
 
 class FakeGroupNode(Node):
-    pass
+    __slots__ = ()
 
 
 # TODO: do we need this class
 class HavingNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, condition, location=None, parent=None):
         return cls(children=[condition], location=location, parent=None)
@@ -1078,6 +2602,8 @@ class HavingNode(Node):
 
 
 class NameNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, name, location=None, parent=None):
         return cls(data=name, location=location, parent=parent)
@@ -1096,13 +2622,56 @@ class NameNode(Node):
         return 'NameNode(name={!r})'.format(self.name)
 
 
+class ParamNode(Node):
+    """
+    Placeholder `:name` in a prepared query, its value is provided at execution time.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, name, location=None, parent=None):
+        return cls(data=name, location=location, parent=parent)
+
+    @property
+    def name(self):
+        return self.data
+
+    @property
+    def context_key(self):
+        # colon can't be a part of a column name, so parameters don't clash with columns
+        return get_param_key(self.name)
+
+    def get_type(self, scope):
+        try:
+            return type(scope[self.context_key])
+        except KeyError:
+            return object
+
+    def get_value(self, context):
+        try:
+            return context[self.context_key]
+        except KeyError:
+            raise MissingParameterError(self.name)
+
+    def __repr__(self):
+        return 'ParamNode(name={!r})'.format(self.name)
+
+
+def get_param_key(name):
+    return ':' + name
+
+
 class SelectStarNode(SelectNode):
+    __slots__ = ()
+
     @classmethod
     def create(cls, location=None, parent=None):
         return cls(location=location, parent=parent)
 
 
 class ValueNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, value, location=None, parent=None):
         return cls(data=value, location=None, parent=None)
@@ -1122,6 +2691,8 @@ class ValueNode(Node):
 
 
 class ArrayNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, nodes, location=None, parent=None):
         return cls(children=nodes, location=location, parent=parent)
@@ -1137,15 +2708,78 @@ class ArrayNode(Node):
         return [e.get_value(context) for e in self.nodes]
 
 
+FunctionData = namedtuple('FunctionData', ['function_name', 'function'])
+BoundFunctionData = namedtuple('BoundFunctionData', ['function_name', 'function', 'bound'])
+
+
+def get_constant_value(node):
+    """
+    :return: value of the `node` if it's known at plan time, _MISSING otherwise.
+    """
+    if isinstance(node, ValueNode):
+        return node.value
+    if isinstance(node, ArrayNode):
+        values = [get_constant_value(child) for child in node.children]
+        if _MISSING not in values:
+            return values
+    return _MISSING
+
+
+class SubqueryNode(Node):
+    """
+    Uncorrelated subquery in `x IN (SELECT ...)`. It's executed only once per query execution and
+    its result is materialized as a ValueSet.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, query_node, location=None, parent=None):
+        if len(query_node.select_node.children) != 1:
+            raise IllegalSubqueryError('subquery should return exactly one column')
+        return cls(children=[query_node], location=location, parent=parent)
+
+    @property
+    def query_node(self):
+        return self.children[0]
+
+    def get_type(self, scope):
+        return AnyIterable
+
+    def get_value(self, context):
+        execution = context.execution
+        values = execution.get_subquery_values(self)
+        if values is None:
+            table = self.query_node.get_value(context)
+            values = ValueSet(table.get_column(0))
+            execution.set_subquery_values(self, values)
+        return values
+
+
 class FunctionNode(Node):
+    __slots__ = ()
+
     @classmethod
     def create(cls, function_name, arg_nodes, location=None, parent=None):
-        return cls(data=function_name, children=arg_nodes, location=location,
-                   parent=parent)
+        function = FUNCTIONS.resolve(function_name, len(arg_nodes))
+        function_name = FUNCTIONS.prepare_name(function_name)
+        if cls is FunctionNode and isinstance(function, Function):
+            if function.bind_constant is not None and function.arity == 2:
+                constant = get_constant_value(arg_nodes[1])
+                if constant is not _MISSING and constant is not NULL:
+                    data = BoundFunctionData(function_name=function_name, function=function,
+                                             bound=function.bind_constant(constant))
+                    node_class = BoundFunctionNode
+                    if ContentMatchNode.can_match(data.bound, arg_nodes[0]):
+                        node_class = ContentMatchNode
+                    return node_class(data=data, children=arg_nodes, location=location, parent=parent)
+            # specialized classes don't pack arguments into a list for every call
+            cls = _FIXED_ARITY_FUNCTION_NODES.get(function.arity, cls)
+        data = FunctionData(function_name=function_name, function=function)
+        return cls(data=data, children=arg_nodes, location=location, parent=parent)
 
     @property
     def function_name(self):
-        return self.data
+        return self.data.function_name
 
     @property
     def arg_nodes(self):
@@ -1153,7 +2787,7 @@ class FunctionNode(Node):
 
     @property
     def function(self):
-        return FUNCTIONS[self.function_name]
+        return self.data.function
 
     def get_type(self, scope):
         return self.function.return_type
@@ -1168,14 +2802,92 @@ class FunctionNode(Node):
         )
 
 
-AggFunctionData = namedtuple('AggFunctionData', ['function_name', 'aggregate'])
+class UnaryFunctionNode(FunctionNode):
+    __slots__ = ()
+
+    def get_value(self, context):
+        function = self.data.function
+        arg = self.children[0].get_value(context)
+        if arg is NULL and function.propagates_null:
+            return NULL
+        return function.implementation(arg)
+
+
+class BinaryFunctionNode(FunctionNode):
+    __slots__ = ()
+
+    def get_value(self, context):
+        function = self.data.function
+        left_node, right_node = self.children
+        left = left_node.get_value(context)
+        right = right_node.get_value(context)
+        if (left is NULL or right is NULL) and function.propagates_null:
+            return NULL
+        return function.implementation(left, right)
+
+
+class BoundFunctionNode(FunctionNode):
+    """
+    Binary function with constant second argument, that was prepared once at plan time
+    (e.g compiled LIKE pattern).
+    """
+    __slots__ = ()
+
+    @property
+    def bound(self):
+        return self.data.bound
+
+    def get_value(self, context):
+        value = self.children[0].get_value(context)
+        if value is NULL and self.data.function.propagates_null:
+            return NULL
+        return self.data.bound(value)
+
+
+class ContentMatchNode(BoundFunctionNode):
+    """
+    LIKE, ILIKE, RLIKE or RILIKE of the `text` column of the files table (or `lines` with
+    '%substring%'). The file is matched while it's read, reading stops as soon as the result is known
+    and the content isn't kept in memory.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def can_match(cls, bound, arg_node):
+        if not isinstance(bound, PatternMatcher) or not isinstance(arg_node, NameNode):
+            return False
+        name = Namespace.prepare_key(arg_node.name)
+        if name == 'text':
+            return True
+        # a substring without line breaks is in one of the lines if and only if it's in the text
+        return (name == 'lines' and isinstance(bound, SubstringMatcher) and bound.method == 'contains' and
+                not any(char in bound.pattern for char in '\r\n'))
+
+    def get_value(self, context):
+        stat = context.get_stat()
+        if stat is None:
+            # e.g the row is projected, the column has been evaluated already
+            return super(ContentMatchNode, self).get_value(context)
+        return stat.match_text(self.data.bound)
+
+
+_FIXED_ARITY_FUNCTION_NODES = {
+    1: UnaryFunctionNode,
+    2: BinaryFunctionNode,
+}
+
+
+AggFunctionData = namedtuple('AggFunctionData', ['function_name', 'aggregate_class'])
 
 
 class AggFunctionNode(FunctionNode):
+    __slots__ = ()
+
     @classmethod
     def create(cls, function_name, arg_nodes, location=None, parent=None):
-        aggregate = AGGREGATES[function_name]()
-        data = AggFunctionData(function_name=function_name, aggregate=aggregate)
+        aggregate_class = FUNCTIONS.resolve(function_name, len(arg_nodes))
+        data = AggFunctionData(function_name=FUNCTIONS.prepare_name(function_name),
+                               aggregate_class=aggregate_class)
         return cls(data=data, children=arg_nodes, location=location, parent=parent)
 
     @property
@@ -1183,45 +2895,51 @@ class AggFunctionNode(FunctionNode):
         return self.data.function_name
 
     @property
-    def aggregate(self):
-        return self.data.aggregate
+    def aggregate_class(self):
+        return self.data.aggregate_class
 
     @property
     def function(self):
-        return self.aggregate
-
-    def clear_aggregate(self):
-        self.aggregate.clear()
+        return self.aggregate_class
 
     def get_value(self, context):
+        # aggregate is a state of the execution, not of the plan
+        aggregate = context.execution.get_aggregate(self)
         args = [arg_node.get_value(context) for arg_node in self.arg_nodes]
-        self.aggregate.add(*args)
-        return self.aggregate.value
+        aggregate.add(*args)
+        return aggregate.value
 
 
-class AndNode(Node):
-    def __new__(cls, *args, **kwargs):
-        return super(AndNode, cls).__new__(cls, *args, **kwargs)
+class BooleanNode(Node):
+    """
+    Base class for AND and OR. Chains like `a OR b OR c` are stored as a single node with many
+    children, so huge machine-generated conditions don't produce deep trees.
+    """
+    __slots__ = ()
 
     @classmethod
-    def create(cls, left_node, right_node, location=None, parent=None):
-        return cls(children=[left_node, right_node], location=location, parent=None)
+    def create(cls, nodes, location=None, parent=None):
+        return cls(children=nodes, location=location, parent=parent)
 
-    @property
-    def left_node(self):
-        return self.children[0]
+    def get_type(self, scope):
+        return bool
 
-    @property
-    def right_node(self):
-        return self.children[1]
+
+class AndNode(BooleanNode):
+    __slots__ = ()
 
     def get_value(self, context):
-        return all(arg_node.get_value(context)
-                   for arg_node in [self.left_node, self.right_node])
+        for node in self.children:
+            if not node.get_value(context):
+                return False
+        return True
+
 
+class OrNode(BooleanNode):
+    __slots__ = ()
 
-# TODO(aershov182): make a common class BinaryNode that'll be heir of AndNode and orNode
-class OrNode(AndNode):
     def get_value(self, context):
-        return any(arg_node.get_value(context)
-                   for arg_node in [self.left_node, self.right_node])
+        for node in self.children:
+            if node.get_value(context):
+                return True
+        return False
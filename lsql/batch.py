@@ -0,0 +1,439 @@
+"""
+Batch evaluation: conditions and aggregates are evaluated for a batch of rows at once.
+
+Values of a node for the batch are numpy arrays (numeric columns of the files table, when numpy
+is installed), lists or a Constant. Nodes without batch implementation are evaluated row by row,
+so every query can be run in batches, only the speed differs.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from itertools import islice, izip
+from stat import S_ISDIR
+import operator
+
+from lsql import ast
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_BATCH_SIZE = 4096
+
+# numpy arrays of these kinds (signed integers and floats) have the same semantics as python numbers
+_NUMERIC_KINDS = frozenset('if')
+
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+
+_TIME_COLUMNS = frozenset(['atime', 'mtime', 'ctime'])
+
+# column -> function that gets the value from the Stat without the column's extra syscalls
+_NUMERIC_COLUMNS = {
+    'atime': lambda row: row.get_lstat().st_atime,
+    'mtime': lambda row: row.get_lstat().st_mtime,
+    'ctime': lambda row: row.get_lstat().st_ctime,
+    'depth': lambda row: row.depth,
+    'hardlinks': lambda row: row.get_lstat().st_nlink,
+    'inode': lambda row: row.get_lstat().st_ino,
+    'device': lambda row: row.get_lstat().st_dev,
+    # lstat of a directory that isn't a link is a directory, so there's no need in Stat.type
+    'size': lambda row: row.size if S_ISDIR(row.get_lstat().st_mode) else row.get_lstat().st_size,
+}
+
+# functions that are evaluated with numpy when both arguments are numeric
+_NUMPY_FUNCTIONS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '=': operator.eq,
+    '<>': operator.ne,
+    '+': operator.add,
+    '-': operator.sub,
+}
+
+# integer addition and subtraction can overflow int64 too, they're evaluated with numpy only if
+# the result fits into int64 for the ranges of the arguments
+_INT64_RANGE_CHECKED = frozenset(['+', '-', 'negate'])
+
+# integer multiplication can overflow int64, python integers can't
+_NUMPY_FLOAT_FUNCTIONS = {
+    '*': operator.mul,
+}
+
+
+class Constant(object):
+    """Value that is the same for all rows of the batch."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return 'Constant(value={!r})'.format(self.value)
+
+
+class RecordBatch(object):
+    """
+    Rows of the files table with their columns, columns are extracted once per batch.
+    """
+
+    def __init__(self, rows):
+        """
+        :param rows: list of lsql.ast.Stat
+        """
+        self.rows = rows
+        self._columns = {}  # column name -> values
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get_column(self, name):
+        """
+        :param name: lowercase name of the column without aliases, e.g 'extension', not 'ext'
+        """
+        values = self._columns.get(name)
+        if values is None:
+            values = self._columns[name] = self._extract_column(name)
+        return values
+
+    def take(self, positions):
+        """
+        :param positions: list of positions of the rows
+        :return: RecordBatch with these rows
+        """
+        batch = RecordBatch([self.rows[i] for i in positions])
+        for name, values in self._columns.viewitems():
+            if _is_array(values):
+                batch._columns[name] = values[positions] if positions else values[:0]
+            else:
+                batch._columns[name] = [values[i] for i in positions]
+        return batch
+
+    def _extract_column(self, name):
+        get_value = _NUMERIC_COLUMNS.get(name)
+        if get_value is None:
+            return [row.get_context()[name] for row in self.rows]
+        # rows projected after WHERE (ProjectedRow) have the values already
+        values = [get_value(row) if isinstance(row, ast.Stat) else row.get_context()[name]
+                  for row in self.rows]
+        if numpy is not None:
+            array = numpy.array(values)
+            if name in _TIME_COLUMNS:
+                # like Timestamp(), it truncates fractions of the second
+                array = array.astype(numpy.int64)
+            if array.dtype.kind in _NUMERIC_KINDS:
+                return array
+        if name in _TIME_COLUMNS:
+            return [ast.Timestamp(value) for value in values]
+        return values
+
+
+def iter_batches(rows, batch_size):
+    """:return: iterator over RecordBatch of at most `batch_size` rows."""
+    rows = iter(rows)
+    while True:
+        batch_rows = list(islice(rows, batch_size))
+        if not batch_rows:
+            return
+        yield RecordBatch(batch_rows)
+
+
+def filter_rows(evaluate, batch, context):
+    """
+    :param evaluate: result of compile_node() of the condition
+    :return: list of the rows of the batch that satisfy the condition
+    """
+    positions = _get_true_positions(evaluate(batch, context), len(batch))
+    if len(positions) == len(batch):
+        return batch.rows
+    return [batch.rows[i] for i in positions]
+
+
+def compile_node(node):
+    """
+    :type node: lsql.ast.Node
+    :return: function (RecordBatch, context) -> values of the node for the rows of the batch
+    """
+    if isinstance(node, ast.NameNode):
+        name = ast.Namespace.prepare_key(node.name)
+        name = ast.Stat.ATTR_ALIASES.get(name, name)
+        if name in ast.Stat.ATTRS:
+            return lambda batch, context: batch.get_column(name)
+    if _is_constant(node):
+        return lambda batch, context: Constant(node.get_value(context))
+    if isinstance(node, ast.AndNode):
+        return _compile_and([compile_node(child) for child in node.children])
+    if isinstance(node, ast.OrNode):
+        return _compile_or([compile_node(child) for child in node.children])
+    if isinstance(node, ast.BetweenNode):
+        return _compile_between(*[compile_node(child) for child in node.children])
+    if isinstance(node, ast.ContentMatchNode):
+        # files are streamed one by one, there's nothing to vectorize
+        return _compile_row_by_row(node)
+    if isinstance(node, ast.BoundFunctionNode):
+        return _compile_bound_function(node.data.function, node.bound, compile_node(node.children[0]))
+    if isinstance(node, (ast.UnaryFunctionNode, ast.BinaryFunctionNode)):
+        arg_evaluators = [compile_node(child) for child in node.children]
+        return _compile_function(node.function_name, node.function, arg_evaluators)
+    return _compile_row_by_row(node)
+
+
+def aggregate(query_node, rows, context, batch_size):
+    """
+    Evaluate query without GROUP BY keys, whose selected columns are all aggregate functions.
+
+    :return: list of (OrderByKey, row) like QueryNode._group
+    """
+    agg_nodes = query_node.select_node.children
+    aggregates = [agg_node.aggregate_class() for agg_node in agg_nodes]
+    evaluators = [compile_node(agg_node.children[0]) for agg_node in agg_nodes]
+    num_rows = 0
+    for batch in iter_batches(rows, batch_size):
+        num_rows += len(batch)
+        for agg_node, agg, evaluate in izip(agg_nodes, aggregates, evaluators):
+            values = evaluate(batch, context)
+            if isinstance(values, Constant):
+                agg.add_batch([values.value] * len(batch))
+            elif _is_array(values) and values.dtype.kind in _NUMERIC_KINDS:
+                agg.add_array(values, wrap=_get_wrap(agg_node.children[0]))
+            else:
+                agg.add_batch(_to_list(values, len(batch)))
+    if not num_rows:
+        # the same as grouping: there are no groups without rows
+        return []
+    order_nodes = query_node.order_node.children
+    return [(ast.OrderByKey([None] * len(order_nodes), order_nodes), [agg.value for agg in aggregates])]
+
+
+def can_aggregate(query_node):
+    """:return: True if aggregate() can evaluate the grouping of the `query_node`."""
+    return (
+        not query_node.group_node.children
+        and isinstance(query_node.having_node, ast.ValueNode) and query_node.having_node.value is True
+        and all(isinstance(node, ast.AggFunctionNode) and issubclass(node.aggregate_class, ast.Aggregate)
+                for node in query_node.select_node.children)
+        and not any(ast.has_agg_functions_nodes(node.children[0]) for node in query_node.select_node.children)
+    )
+
+
+def _compile_and(evaluators):
+    def evaluate(batch, context):
+        positions = range(len(batch))
+        selected = batch
+        for evaluate_child in evaluators:
+            true_positions = _get_true_positions(evaluate_child(selected, context), len(selected))
+            if len(true_positions) == len(selected):
+                continue
+            # rows that are already false aren't evaluated, like in AndNode
+            positions = [positions[i] for i in true_positions]
+            if not positions:
+                break
+            selected = batch.take(positions)
+        return _make_mask(positions, len(batch))
+    return evaluate
+
+
+def _compile_or(evaluators):
+    def evaluate(batch, context):
+        matched = []
+        remaining = range(len(batch))
+        selected = batch
+        for evaluate_child in evaluators:
+            truth = _get_truth(evaluate_child(selected, context), len(selected))
+            matched.extend(position for position, value in izip(remaining, truth) if value)
+            remaining = [position for position, value in izip(remaining, truth) if not value]
+            if not remaining:
+                break
+            selected = batch.take(remaining)
+        return _make_mask(matched, len(batch))
+    return evaluate
+
+
+def _compile_between(evaluate_value, evaluate_first, evaluate_last):
+    def evaluate(batch, context):
+        value = evaluate_value(batch, context)
+        first = evaluate_first(batch, context)
+        last = evaluate_last(batch, context)
+        if _can_use_numpy(value, first, last):
+            return (_unwrap(first) <= _unwrap(value)) & (_unwrap(value) <= _unwrap(last))
+        size = len(batch)
+        return [
+            first_value <= value_value <= last_value
+            for value_value, first_value, last_value in izip(
+                _to_list(value, size), _to_list(first, size), _to_list(last, size))
+        ]
+    return evaluate
+
+
+def _compile_bound_function(function, bound, evaluate_arg):
+    def evaluate(batch, context):
+        return _apply_bound(function, bound, evaluate_arg(batch, context), len(batch))
+    return evaluate
+
+
+def _apply_bound(function, bound, values, size):
+    """
+    :param bound: bound argument of the function, e.g ValueSet of IN or matcher of LIKE
+    """
+    if isinstance(bound, ast.ValueSet) and _can_use_numpy(values):
+        numbers = _get_numbers(bound)
+        if numbers is not None:
+            return numpy.in1d(values, numbers)
+    propagates_null = function.propagates_null
+    return [
+        ast.NULL if value is ast.NULL and propagates_null else bound(value)
+        for value in _to_list(values, size)
+    ]
+
+
+def _compile_function(function_name, function, arg_evaluators):
+    numpy_function = _NUMPY_FUNCTIONS.get(function_name)
+    numpy_float_function = _NUMPY_FLOAT_FUNCTIONS.get(function_name)
+
+    def evaluate(batch, context):
+        args = [evaluate_arg(batch, context) for evaluate_arg in arg_evaluators]
+        if function_name == 'in' and isinstance(args[1], Constant) and isinstance(args[1].value, ast.ValueSet):
+            # e.g IN (SELECT ...), the set is known only at execution time
+            return _apply_bound(function, args[1].value, args[0], len(batch))
+        if len(args) == 2 and _can_use_numpy(*args):
+            if numpy_function is not None and _fits_int64(function_name, args):
+                return numpy_function(_unwrap(args[0]), _unwrap(args[1]))
+            if numpy_float_function is not None and any(_get_kind(arg) == 'f' for arg in args):
+                return numpy_float_function(_unwrap(args[0]), _unwrap(args[1]))
+        if function_name == 'negate' and _can_use_numpy(*args) and _fits_int64(function_name, args):
+            return -_unwrap(args[0])
+        size = len(batch)
+        return [function(*row_args) for row_args in izip(*[_to_list(arg, size) for arg in args])]
+    return evaluate
+
+
+def _compile_row_by_row(node):
+    def evaluate(batch, context):
+        return [node.get_value(ast.CombinedContext(row.get_context(), context)) for row in batch.rows]
+    return evaluate
+
+
+def _is_constant(node):
+    """:return: True if value of the node doesn't depend on the row."""
+    for child in node.iter_subtree(prune=(ast.SubqueryNode,)):
+        if isinstance(child, ast.AggFunctionNode):
+            return False
+        if isinstance(child, ast.NameNode):
+            name = ast.Namespace.prepare_key(child.name)
+            if ast.Stat.ATTR_ALIASES.get(name, name) in ast.Stat.ATTRS:
+                return False
+    return True
+
+
+def _get_wrap(node):
+    """:return: type of the column values that is lost in numpy arrays, e.g Timestamp."""
+    if isinstance(node, ast.NameNode):
+        name = ast.Namespace.prepare_key(node.name)
+        if name in _TIME_COLUMNS:
+            return ast.Timestamp
+    return None
+
+
+def _is_array(values):
+    return numpy is not None and isinstance(values, numpy.ndarray)
+
+
+def _get_kind(values):
+    if isinstance(values, Constant):
+        value = values.value
+        if type(value) is float:
+            return 'f'
+        if isinstance(value, (int, long)) and not isinstance(value, bool) and _INT64_MIN <= value <= _INT64_MAX:
+            return 'i'
+        return None
+    if _is_array(values) and values.dtype.kind in _NUMERIC_KINDS:
+        return values.dtype.kind
+    return None
+
+
+def _fits_int64(function_name, args):
+    """
+    :return: False if integer `function_name` of numeric args can overflow int64.
+    """
+    if function_name not in _INT64_RANGE_CHECKED or any(_get_kind(arg) == 'f' for arg in args):
+        return True
+    ranges = []
+    for arg in args:
+        if isinstance(arg, Constant):
+            ranges.append((arg.value, arg.value))
+        elif not len(arg):
+            return True
+        else:
+            ranges.append((int(arg.min()), int(arg.max())))
+    if function_name == 'negate':
+        (low, high), = ranges
+        low, high = -high, -low
+    elif function_name == '+':
+        low, high = ranges[0][0] + ranges[1][0], ranges[0][1] + ranges[1][1]
+    else:
+        low, high = ranges[0][0] - ranges[1][1], ranges[0][1] - ranges[1][0]
+    return _INT64_MIN <= low and high <= _INT64_MAX
+
+
+def _can_use_numpy(*args):
+    """:return: True if all arguments are numeric and at least one of them is an array."""
+    return (
+        any(_is_array(arg) for arg in args)
+        and all(_get_kind(arg) is not None for arg in args)
+    )
+
+
+def _unwrap(values):
+    if isinstance(values, Constant):
+        return values.value
+    return values
+
+
+def _to_list(values, size):
+    if isinstance(values, Constant):
+        return [values.value] * size
+    if _is_array(values):
+        return values.tolist()
+    return values
+
+
+def _get_truth(values, size):
+    """:return: iterable of truth values of the rows."""
+    if isinstance(values, Constant):
+        return [bool(values.value)] * size
+    return values
+
+
+def _get_true_positions(values, size):
+    if isinstance(values, Constant):
+        return range(size) if values.value else []
+    if _is_array(values):
+        return numpy.flatnonzero(values).tolist()
+    return [i for i, value in enumerate(values) if value]
+
+
+def _make_mask(positions, size):
+    if numpy is not None:
+        mask = numpy.zeros(size, dtype=bool)
+        mask[positions] = True
+        return mask
+    mask = [False] * size
+    for position in positions:
+        mask[position] = True
+    return mask
+
+
+def _get_numbers(value_set):
+    """:return: list of the numbers of the ValueSet or None if it has values that numpy can't compare."""
+    numbers = []
+    for value in value_set.get_values():
+        if isinstance(value, bool):
+            # True == 1 in python
+            value = int(value)
+        if _get_kind(Constant(value)) is not None:
+            numbers.append(value)
+        elif not isinstance(value, (bytes, unicode, ast.Null)):
+            return None
+    return numbers
@@ -0,0 +1,223 @@
+"""
+EXPLAIN and EXPLAIN ANALYZE: human-readable query plans with optional per-stage execution stats.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+from lsql import ast
+from lsql import stats
+
+INDENT = '  '
+
+_STAGE_TITLES = OrderedDict([
+    ('project', 'Project'),
+    ('limit', 'Limit'),
+    ('sort', 'Sort'),
+    ('group', 'Group'),
+    ('filter', 'Filter'),
+    ('scan', 'Scan'),
+])
+
+# functions that are shown as infix operators
+_INFIX_FUNCTIONS = frozenset(['||', '+', '-', '*', '/', '^', '%', '>', '>=', '<', '<=', '=', '<>',
+                              'in', 'like', 'ilike', 'rlike', 'rilike'])
+
+
+class ExplainNode(ast.Node):
+    """
+    `EXPLAIN [ANALYZE] query`. Its value is a table with the single column `plan`.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, query_node, analyze, location=None, parent=None):
+        return cls(data=analyze, children=[query_node], location=location, parent=parent)
+
+    @property
+    def analyze(self):
+        return self.data
+
+    @property
+    def query_node(self):
+        return self.children[0]
+
+    def get_type(self, scope):
+        return ast.Table
+
+    def get_value(self, context):
+        query_stats = None
+        footer = []
+        if self.analyze:
+            query_stats = stats.QueryStats()
+            execution_context = ast.ExecutionContext(ast.ExecutionState(stats=query_stats))
+            with query_stats.collecting():
+                table = self.query_node.get_value(ast.CombinedContext(execution_context, context))
+            footer.append('Total: rows={:d} time={} {}'.format(
+                len(table), format_seconds(query_stats.total_seconds),
+                format_syscalls(query_stats.syscalls)).rstrip())
+        lines = format_plan(self.query_node, query_stats) + footer
+        return ast.Table(OrderedDict([('plan', unicode)]), [[line] for line in lines])
+
+
+def format_plan(query_node, query_stats=None):
+    """
+    :type query_node: lsql.ast.QueryNode
+    :param query_stats: QueryStats of the query execution (for EXPLAIN ANALYZE)
+    :return: list of lines
+    """
+    lines = []
+    subquery_numbers = {}  # id(SubqueryNode) -> number
+    pending = [(None, query_node)]
+    while pending:
+        subquery_node, node = pending.pop(0)
+        if subquery_node is not None:
+            lines.append('SubPlan {:d}'.format(subquery_numbers[id(subquery_node)]))
+        for subquery in node.analysis.subquery_nodes:
+            subquery_numbers[id(subquery)] = len(subquery_numbers) + 1
+            pending.append((subquery, subquery.query_node))
+        formatter = _ExpressionFormatter(subquery_numbers)
+        indent = INDENT if subquery_node is not None else ''
+        stages = _describe_stages(node, formatter)
+        for i, (stage, description) in enumerate(stages):
+            line = '{}{}: {}'.format(indent, _STAGE_TITLES[stage], description)
+            if query_stats is not None:
+                # rows of the stage come from the stage below it
+                source = None
+                if i + 1 < len(stages):
+                    source = query_stats.find_stage((id(node), stages[i + 1][0]))
+                stage_stats = query_stats.find_stage((id(node), stage))
+                line = '{}  {}'.format(line, _format_stage_stats(stage_stats, source))
+            lines.append(line)
+            indent += INDENT
+    return lines
+
+
+def _describe_stages(query_node, formatter):
+    """
+    :return: list of (stage, description), from the last stage to the first one.
+    """
+    fmt = formatter.format
+    order = ', '.join(fmt(node) for node in query_node.order_node.children) or '(none)'
+    columns = ', '.join(fmt(node) for node in query_node.select_node.children)
+    limit = ('limit', 'offset={} limit={}'.format(fmt(query_node.offset_node), fmt(query_node.limit_node)))
+    if isinstance(query_node.group_node, ast.FakeGroupNode):
+        # SELECT is evaluated after LIMIT
+        deferred = query_node.analysis.deferred_name_nodes
+        if deferred and query_node.defers_columns():
+            columns = '{} [deferred: {}]'.format(columns, ', '.join(fmt(node) for node in deferred))
+        stages = [('project', columns), limit, ('sort', order)]
+    else:
+        keys = ', '.join(fmt(node) for node in query_node.group_node.children) or '(all rows)'
+        aggregates = ', '.join(fmt(node) for node in query_node.analysis.agg_function_nodes)
+        stages = [limit, ('sort', order), ('group', 'keys={} aggregates={} having={} columns={}'.format(
+            keys, aggregates or '(none)', fmt(query_node.having_node), columns))]
+    stages.append(('filter', fmt(query_node.where_node)))
+    stages.append(('scan', fmt(query_node.from_node)))
+    return stages
+
+
+def _format_stage_stats(stage, source):
+    """
+    :type stage: lsql.stats.StageStats
+    :param source: StageStats of the stage that produces rows for the `stage` (None for scan)
+    """
+    if stage is None:
+        return '(never executed)'
+    parts = []
+    if source is not None:
+        parts.append('rows_in={:d}'.format(source.rows_out))
+    parts.append('rows_out={:d}'.format(stage.rows_out))
+    parts.append('time={}'.format(format_seconds(stage.seconds)))
+    if stage.calls > 1 and stage.name != 'scan':
+        parts.append('loops={:d}'.format(stage.calls))
+    syscalls = format_syscalls(stage.syscalls)
+    if syscalls:
+        parts.append(syscalls)
+    return '({})'.format(' '.join(parts))
+
+
+def format_seconds(seconds):
+    return '{:.3f}ms'.format(seconds * 1000)
+
+
+def format_syscalls(syscalls):
+    return ' '.join('{}={:d}'.format(name, count) for name, count in syscalls.viewitems())
+
+
+class _ExpressionFormatter(object):
+    def __init__(self, subquery_numbers):
+        self._subquery_numbers = subquery_numbers
+
+    def format(self, node):
+        if isinstance(node, ast.ValueNode):
+            return _format_value(node.value)
+        if isinstance(node, ast.NameNode):
+            return node.name
+        if isinstance(node, ast.ParamNode):
+            return ':{}'.format(node.name)
+        if isinstance(node, ast.ArrayNode):
+            return '({})'.format(', '.join(self.format(child) for child in node.children))
+        if isinstance(node, ast.SubqueryNode):
+            return '(SubPlan {:d}, materialized once)'.format(self._subquery_numbers[id(node)])
+        if isinstance(node, ast.OrderByPartNode):
+            direction = 'ASC' if node.direction == ast.ASC else 'DESC'
+            return '{} {}'.format(self.format(node.node), direction)
+        if isinstance(node, ast.BetweenNode):
+            return '{} between {} and {}'.format(*[self.format(child) for child in node.children])
+        if isinstance(node, ast.BooleanNode):
+            operator = ' and ' if isinstance(node, ast.AndNode) else ' or '
+            return '({})'.format(operator.join(self.format(child) for child in node.children))
+        if isinstance(node, ast.AggFunctionNode):
+            return '{}({})'.format(node.function_name, ', '.join(self.format(child) for child in node.children))
+        if isinstance(node, ast.FunctionNode):
+            return self._format_function(node)
+        return node.__class__.__name__
+
+    def _format_function(self, node):
+        args = [self.format(child) for child in node.children]
+        name = node.function_name
+        if name == 'negate':
+            text = '-{}'.format(args[0])
+        elif name in _INFIX_FUNCTIONS and len(args) == 2:
+            text = '({} {} {})'.format(args[0], name, args[1])
+        else:
+            text = '{}({})'.format(name, ', '.join(args))
+        operator = _describe_operator(node)
+        if operator:
+            text = '{} [{}]'.format(text, operator)
+        return text
+
+
+def _describe_operator(node):
+    """
+    :return: description of the operator chosen at plan time or None.
+    """
+    if isinstance(node, ast.ContentMatchNode):
+        if isinstance(node.bound, ast.SubstringMatcher):
+            return '{}, streamed'.format(node.bound.method)
+        return 'regex, mapped'
+    if isinstance(node, ast.BoundFunctionNode):
+        bound = node.bound
+        if isinstance(bound, ast.ValueSet):
+            return 'hash set of {:d} values'.format(len(bound))
+        if isinstance(bound, ast.SubstringMatcher):
+            return bound.method
+        if isinstance(bound, ast.RegexMatcher):
+            return 'regex'
+        return 'bound'
+    if node.function_name in ('like', 'ilike', 'rlike', 'rilike'):
+        return 'pattern compiled per row'
+    if node.function_name == 'in' and not isinstance(node.children[1], ast.SubqueryNode):
+        return 'linear scan'
+    return None
+
+
+def _format_value(value):
+    if value is ast.NULL:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, unicode):
+        return "'{}'".format(value.replace("'", "''"))
+    return unicode(value)
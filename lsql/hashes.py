@@ -0,0 +1,223 @@
+"""
+Content hash columns (md5, sha1, sha256) with a persistent cache.
+
+Digests are cached by (device, inode, size, mtime) of the file, so files that didn't change since
+the previous run are never read again. Big files are hashed on worker threads: hashlib releases
+the GIL while it hashes.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import errno
+import hashlib
+import os
+import sqlite3
+
+from lsql import ast
+from lsql import stats
+
+ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+DEFAULT_CACHE_PATH = os.path.join('~', '.cache', 'lsql', 'hashes.sqlite')
+
+# files smaller than this are hashed when the column is evaluated, bigger ones on the worker threads
+THREAD_MIN_SIZE = 1 << 20
+NUM_WORKERS = 4
+
+READ_SIZE = 1 << 20
+
+
+class HashCache(object):
+    """
+    Digests of the files in the sqlite database. There's one row per (file, algorithm): digest of the
+    changed file replaces the old one. The cache is optional: if the database can't be opened or
+    written, digests just aren't cached.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._failed = False
+
+    def get(self, key, algorithm):
+        """
+        :param key: (device, inode, size, mtime_ns), see get_key()
+        :return: hex digest or None
+        """
+        connection = self._connect()
+        if connection is None:
+            return None
+        device, inode, size, mtime_ns = key
+        try:
+            row = connection.execute(
+                'SELECT digest FROM hashes WHERE device = ? AND inode = ? AND algorithm = ? '
+                'AND size = ? AND mtime_ns = ?', (device, inode, algorithm, size, mtime_ns)).fetchone()
+        except sqlite3.Error:
+            self._disable()
+            return None
+        return None if row is None else row[0]
+
+    def put(self, key, algorithm, digest):
+        connection = self._connect()
+        if connection is None:
+            return
+        device, inode, size, mtime_ns = key
+        try:
+            with connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO hashes (device, inode, algorithm, size, mtime_ns, digest) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (device, inode, algorithm, size, mtime_ns, digest))
+        except sqlite3.Error:
+            self._disable()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _connect(self):
+        if self._connection is not None or self._failed:
+            return self._connection
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                self._failed = True
+                return None
+        try:
+            connection = sqlite3.connect(self.path)
+            # the cache can be rebuilt, it isn't worth fsync on every digest
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS hashes (device INTEGER, inode INTEGER, algorithm TEXT, '
+                'size INTEGER, mtime_ns INTEGER, digest TEXT, PRIMARY KEY (device, inode, algorithm))')
+        except sqlite3.Error:
+            self._failed = True
+            return None
+        self._connection = connection
+        return connection
+
+    def _disable(self):
+        self.close()
+        self._failed = True
+
+
+class ContentHashes(object):
+    """
+    Digests of the files of one scan of the files table.
+    """
+
+    def __init__(self, cache=None):
+        """
+        :type cache: HashCache
+        """
+        self._cache = cache
+        self._digests = {}  # (key, algorithm) -> digest computed by prefetch()
+
+    def get(self, stat, algorithm):
+        """
+        :type stat: lsql.ast.Stat
+        :return: hex digest of the content of the file
+        """
+        key = get_key(stat.get_lstat())
+        digest = self._digests.pop((key, algorithm), None)
+        if digest is not None:
+            return digest
+        if self._cache is not None:
+            digest = self._cache.get(key, algorithm)
+            if digest is not None:
+                return digest
+        with ast.FileContent(stat.path) as content:
+            digest = hash_chunks(content.iter_chunks(READ_SIZE), [algorithm])[0]
+        self._put(key, algorithm, digest)
+        return digest
+
+    def prefetch(self, stats_, algorithms):
+        """
+        Hash big files that aren't in the cache on the worker threads, get() returns their digests
+        without reading them.
+
+        :param stats_: list of Stat of regular files
+        """
+        pending = []  # (path, key, algorithms)
+        for stat in stats_:
+            lstat = stat.get_lstat()
+            if lstat.st_size < THREAD_MIN_SIZE:
+                continue
+            key = get_key(lstat)
+            missing = []
+            for algorithm in algorithms:
+                digest = None if self._cache is None else self._cache.get(key, algorithm)
+                if digest is None:
+                    missing.append(algorithm)
+                else:
+                    # so get() doesn't look it up again
+                    self._digests[key, algorithm] = digest
+            if missing:
+                pending.append((stat.path, key, missing))
+        if not pending:
+            return
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(NUM_WORKERS, len(pending)))
+        try:
+            results = pool.map(_hash_file, [(path, missing) for path, _, missing in pending])
+        finally:
+            pool.close()
+            pool.join()
+        # stats and the cache aren't thread-safe, they're updated by the calling thread
+        for (path, key, missing), (digests, num_read) in zip(pending, results):
+            stats.count('open')
+            ast.report_file_read(path, num_read)
+            for algorithm, digest in zip(missing, digests):
+                self._digests[key, algorithm] = digest
+                self._put(key, algorithm, digest)
+
+    def close(self):
+        if self._cache is not None:
+            self._cache.close()
+
+    def _put(self, key, algorithm, digest):
+        if self._cache is not None:
+            self._cache.put(key, algorithm, digest)
+
+
+def get_key(lstat):
+    """
+    :param lstat: os.stat_result
+    :return: (device, inode, size, mtime_ns)
+    """
+    # there's no st_mtime_ns in python 2, float mtime has microsecond precision
+    return lstat.st_dev, lstat.st_ino, lstat.st_size, int(round(lstat.st_mtime * 10 ** 9))
+
+
+def hash_chunks(chunks, algorithms):
+    """
+    :return: list of hex digests, one for every algorithm
+    """
+    hashers = [hashlib.new(algorithm) for algorithm in algorithms]
+    for chunk in chunks:
+        for hasher in hashers:
+            hasher.update(chunk)
+    return [hasher.hexdigest().decode('ascii') for hasher in hashers]
+
+
+def _hash_file(args):
+    """
+    Worker of ContentHashes.prefetch().
+
+    :return: (list of hex digests, number of bytes read)
+    """
+    path, algorithms = args
+    sizes = []
+
+    def iter_chunks(fileobj):
+        for chunk in iter(lambda: fileobj.read(READ_SIZE), b''):
+            sizes.append(len(chunk))
+            yield chunk
+
+    with open(path, 'rb') as fileobj:
+        digests = hash_chunks(iter_chunks(fileobj), algorithms)
+    return digests, sum(sizes)
+
+
+def get_default_cache():
+    return HashCache(os.path.expanduser(DEFAULT_CACHE_PATH))
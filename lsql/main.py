@@ -6,13 +6,18 @@ import os
 import textwrap
 import sys
 
-from colorama import Fore
-
-from lsql.ast import BUILTIN_CONTEXT, Context, CombinedContext, TaggedStr
-from lsql.parser import parse, tokenize
+from lsql.ast import TaggedStr
+from lsql.prepared import prepare
 from lsql import ast
 from lsql import get_version
+from lsql import output
 from lsql import parser
+from lsql import stats
+from lsql import tracing
+
+# Startup time matters: lsql is called from shell scripts thousands of times. Modules that are
+# needed only by some options (colorama, cProfile, json, lsql.profiling, lsql.progress) are
+# imported when these options are used. See tests/test_startup.py
 
 FORE_BROWN = '\x1b[33m'
 
@@ -22,6 +27,13 @@ COLOR_ARG_CHOICES = (
     'auto',  # Color stdout only if it's a tty. Always color stderr
 )
 
+FORMAT_ARG_CHOICES = tuple(output.FORMATS)
+
+STATS_FORMAT_ARG_CHOICES = (
+    'text',
+    'json',
+)
+
 GITHUB = 'https://github.com/alexandershov/lsql'
 GITHUB_ISSUES = '{}/issues'.format(GITHUB)
 GITHUB_README = '{}/blob/master/README.md'.format(GITHUB)
@@ -34,6 +46,9 @@ FAILURE_CODE = 1
 
 # TODO: split this class into 2. One should be about errors/warnings/messages, another - about colored_column()
 class Printer(object):
+    # if it's False, then colored_column() returns the value as is
+    colors_columns = False
+
     def __init__(self, width=WIDTH):
         self._width = width
 
@@ -66,59 +81,134 @@ class Printer(object):
 
 
 class ColoredPrinter(Printer):
+    colors_columns = True
+
     def __init__(self, tag_colors, width=WIDTH):
         super(ColoredPrinter, self).__init__(width)
         self._tag_colors = tag_colors
+        self._colors_by_tags = {}  # frozenset of tags -> color or None
 
     def colored(self, color, text, start=0, end=None):
         assert isinstance(text, unicode)
         if end is None:
             end = len(text)
-        return text[:start] + color + text[start:end] + Fore.RESET + text[end:]
+        return text[:start] + color + text[start:end] + _get_fore().RESET + text[end:]
 
     def warning(self, text, start=0, end=None):
-        return self.colored(color=Fore.RESET, text=text, start=start, end=end)
+        return self.colored(color=_get_fore().RESET, text=text, start=start, end=end)
 
     def error(self, text, start=0, end=None):
-        return self.colored(color=Fore.RED, text=text, start=start, end=end)
+        return self.colored(color=_get_fore().RED, text=text, start=start, end=end)
 
     def colored_column(self, column_value):
         # TODO: how to do it without isinstance?
         if isinstance(column_value, TaggedStr):
-            for tag, color in self._tag_colors.viewitems():
-                if tag in column_value.tags:
-                    # TODO: don't hardcode utf-8, figure out encodings
-                    return self.colored(color, column_value.decode('utf-8'))
+            color = self._get_color(column_value.tags)
+            if color is not None:
+                # TODO: don't hardcode utf-8, figure out encodings
+                return self.colored(color, column_value.decode('utf-8'))
         return column_value
 
+    def _get_color(self, tags):
+        # there are just a few combinations of tags, so colors are cached
+        key = frozenset(tags)
+        try:
+            return self._colors_by_tags[key]
+        except KeyError:
+            color = next((color for tag, color in self._tag_colors.viewitems() if tag in key), None)
+            self._colors_by_tags[key] = color
+            return color
+
 
 # TODO: what? NoColored is inherited from Colored?
 class NoColoredColumnPrinter(ColoredPrinter):
+    colors_columns = False
+
     def colored_column(self, column_value):
         return column_value
 
 
 def _get_printer(stdout, color):
-    tag_colors = parse_lscolors(os.getenv('LSCOLORS') or '')
     if color == 'always':
-        return ColoredPrinter(tag_colors)
+        return ColoredPrinter(_get_tag_colors())
     elif color == 'never':
         return Printer()
     elif color == 'auto':
         if stdout.isatty():
-            return ColoredPrinter(tag_colors)
+            return ColoredPrinter(_get_tag_colors())
         else:
-            return NoColoredColumnPrinter(tag_colors)
+            # columns aren't colored, so there's no need to parse $LSCOLORS
+            return NoColoredColumnPrinter(OrderedDict())
     else:
         raise ValueError("Oops, bad color value '{}', should be one of {!r}".format(color, COLOR_ARG_CHOICES))
 
 
 def main(argv=None):
     args = _get_args_parser().parse_args(argv)
+    if args.profile_output is not None:
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(_main_with_tracing, args)
+        finally:
+            profile.dump_stats(args.profile_output)
+    return _main_with_tracing(args)
+
+
+def _main_with_tracing(args):
+    tracers = []
+    chrome_tracer = None
+    if args.trace is not None:
+        chrome_tracer = tracing.ChromeTracer()
+        tracers.append(chrome_tracer)
+    if args.progress_file is not None or args.progress:
+        from lsql import progress
+    if args.progress_file is not None:
+        tracers.append(progress.ProgressReporter(
+            progress.status_file_writer(args.progress_file), history=progress.get_default_history()))
+    elif args.progress:
+        tracers.append(progress.ProgressReporter(_show_progress, history=progress.get_default_history()))
+    if not tracers:
+        return _main(args)
+    tracer = tracers[0] if len(tracers) == 1 else tracing.TracerGroup(tracers)
+    try:
+        with tracing.installed(tracer):
+            return _main(args)
+    finally:
+        if chrome_tracer is not None:
+            chrome_tracer.save(args.trace)
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('should be at least 1: {}'.format(value))
+    return number
+
+
+def _show_progress(line):
+    print(line, file=sys.stderr)
+
+
+def _main(args):
     printer = _get_printer(sys.stdout, args.color)
     try:
-        table = run_query(args.query_string, args.directory)
-        _show_table(table, args.with_header, printer)
+        profiler = None
+        if args.profile:
+            from lsql import profiling
+            profiler = profiling.Profiler()
+        table = run_query(args.query_string, args.directory, collect_stats=args.stats, profiler=profiler,
+                          batch_size=args.batch_size)
+        try:
+            _show_table(table, args.with_header, printer, args.format)
+        except output.OutputClosedError:
+            # e.g `lsql ... | head`, it's not an error
+            _close_stdout()
+        if args.stats:
+            _show_stats(table.stats, args.stats_format)
+        if profiler is not None:
+            for line in profiling.format_report(profiler):
+                print(line, file=sys.stderr)
         return SUCCESS_CODE
     except parser.CantTokenizeError as exc:
         if args.query_string[exc.pos] == "'":
@@ -166,6 +256,18 @@ def main(argv=None):
         # TODO: handle it better: tell what's expected.
         printer.show_message('Unexpected end of query.')
         suggest_to_create_issue_or_pull_request(printer)
+    except ast.UnknownFunctionError as exc:
+        printer.show_error('Unknown function `{}`.'.format(exc.function_name))
+    except ast.WrongNumberOfArgumentsError as exc:
+        printer.show_error('Function `{}` expects {:d} argument(s), but got {:d}.'.format(
+            exc.function_name, exc.expected, exc.actual))
+    except ast.InvalidPatternError as exc:
+        printer.show_error('Invalid pattern {!r}: {}'.format(exc.pattern, exc.reason))
+    except ast.IllegalSubqueryError as exc:
+        printer.show_error('Illegal subquery: {}.'.format(exc.message))
+    except ast.MissingParameterError as exc:
+        printer.show_error('No value for parameter `:{}`, parameters can be used only in prepared queries.'.format(
+            exc.name))
     except ast.DirectoryDoesNotExistError as exc:
         printer.show_error("directory '{}' doesn't exist".format(exc.path))
     return FAILURE_CODE
@@ -211,7 +313,54 @@ def _get_args_parser():
             "colorize output. The possible values of this option are: 'never', 'always', and 'auto'"
         )
     )
+    output_options.add_argument(
+        '--format',
+        choices=FORMAT_ARG_CHOICES,
+        default='tsv',
+        help=(
+            "format of the rows. The possible values of this option are: "
+            "'tsv' (default), 'csv', 'jsonl' (JSON Lines) and 'nul' (rows terminated by NUL, for xargs -0)"
+        ),
+    )
+    output_options.add_argument(
+        '--stats', action='store_true',
+        help='print execution summary (files visited, syscalls, bytes read, timings) to stderr',
+    )
+    output_options.add_argument(
+        '--stats-format',
+        choices=STATS_FORMAT_ARG_CHOICES,
+        default='text',
+        help="format of the --stats summary. The possible values of this option are: 'text' and 'json'",
+    )
+    output_options.add_argument(
+        '--trace',
+        help='write trace of the query execution in Chrome trace event format to this file',
+        metavar='path',
+    )
+    output_options.add_argument(
+        '--progress', action='store_true',
+        help='periodically print progress of the scan (throughput, current directory, ETA) to stderr',
+    )
+    output_options.add_argument(
+        '--progress-file',
+        help='periodically write progress of the scan to this file instead of stderr',
+        metavar='path',
+    )
+    output_options.add_argument(
+        '--profile', action='store_true',
+        help='print time and number of calls of every column, function and operator to stderr',
+    )
+    output_options.add_argument(
+        '--profile-output',
+        help='run query under cProfile and write its stats to this file (see pstats module)',
+        metavar='path',
+    )
 
+    arg_parser.add_argument(
+        '--batch-size', type=_positive_int,
+        help='evaluate WHERE and aggregates for batches of this many rows (e.g 4096), with numpy if installed',
+        metavar='rows',
+    )
     arg_parser.add_argument(
         '--version', action='version', version='%(prog)s version {}'.format(get_version())
     )
@@ -235,14 +384,30 @@ def _get_args_parser():
     return arg_parser
 
 
-def run_query(query_string, directory):
+def run_query(query_string, directory, collect_stats=False, profiler=None, batch_size=None):
     assert isinstance(query_string, unicode)
-    tokens = tokenize(query_string)
     # TODO(aershov182): check that user hasn't passed both FROM and directory
-    # TODO: b'.'? Handle TaggedStr issues inside of the ast.DirectoryWalker
-    cwd_context = Context({'cwd': (directory or b'.')})
-    query = parse(tokens)
-    return query.get_value(CombinedContext(cwd_context, BUILTIN_CONTEXT))
+    return prepare(query_string).execute(directory, collect_stats=collect_stats, profiler=profiler,
+                                         batch_size=batch_size)
+
+
+def _show_stats(query_stats, stats_format):
+    summary = query_stats.summary()
+    if stats_format == 'json':
+        import json
+        text = json.dumps(summary)
+    else:
+        text = stats.format_summary(summary)
+    print(text, file=sys.stderr)
+
+
+def _get_fore():
+    from colorama import Fore
+    return Fore
+
+
+def _get_tag_colors():
+    return parse_lscolors(os.getenv('LSCOLORS') or '')
 
 
 # TODO: respect background, executable, bold.
@@ -251,6 +416,7 @@ def parse_lscolors(lscolors):
     :param lscolors: value of $LSCOLORS env var
     :return: dictionary {tag -> color}
     """
+    Fore = _get_fore()
     if not lscolors:
         return OrderedDict.fromkeys(
             ['dir', 'link', 'exec', 'file'],
@@ -265,6 +431,7 @@ def parse_lscolors(lscolors):
 
 
 def lscolor_to_termcolor(lscolor):
+    Fore = _get_fore()
     color_mapping = {
         'a': Fore.BLACK,
         'b': Fore.RED,
@@ -278,23 +445,18 @@ def lscolor_to_termcolor(lscolor):
     return color_mapping.get(lscolor, Fore.RESET)
 
 
-def _show_table(table, with_header, colorizer):
-    if with_header:
-        print_row(table.row_type)
-    for row in table:
-        colored_row = [colorizer.colored_column(column) for column in row]
-        print_row(colored_row)
-
-
-def print_row(row):
-    # we need b'\t' so resulting string will not be unicode
-    print(b'\t'.join(_printable_unicode(column) for column in row))
+def _show_table(table, with_header, colorizer, format_name='tsv'):
+    if not colorizer.colors_columns:
+        colorizer = None
+    writer = output.get_writer(format_name, sys.stdout, colorizer=colorizer)
+    output.write_table(writer, table, with_header)
 
 
-def _printable_unicode(x):
-    if not isinstance(x, unicode):
-        x = unicode(x)
-    return x.encode('utf-8')
+def _close_stdout():
+    # otherwise python complains about the failed flush of stdout at exit
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,200 @@
+"""
+Writers of query results: rows are formatted to bytes and written to the stream in big chunks.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+import errno
+
+from lsql.ast import Null, Timestamp
+
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+
+class OutputClosedError(Exception):
+    """Reader of the output has gone, e.g `lsql ... | head`."""
+
+
+class Writer(object):
+    """
+    Base class of the writers. Formatted rows are accumulated in the buffer and written to the stream
+    when the buffer is bigger than `buffer_size`.
+    """
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param stream: file-like object that accepts bytes
+        """
+        self._stream = stream
+        self._buffer_size = buffer_size
+        self._chunks = []
+        self._num_buffered = 0
+
+    def begin(self, row_type, with_header=False):
+        """Start writing rows of the `row_type`: list of the names of the columns."""
+        if with_header:
+            self.write_header(row_type)
+
+    def write_header(self, row_type):
+        self.write_row(row_type)
+
+    def write_row(self, row):
+        data = self.format_row(row)
+        self._chunks.append(data)
+        self._num_buffered += len(data)
+        if self._num_buffered >= self._buffer_size:
+            self._write_buffered()
+
+    def format_row(self, row):
+        """:return: bytes, the row with the row terminator."""
+        raise NotImplementedError
+
+    def flush(self):
+        self._write_buffered()
+        try:
+            self._stream.flush()
+        except IOError as exc:
+            if exc.errno == errno.EPIPE:
+                raise OutputClosedError()
+            raise
+
+    def _write_buffered(self):
+        if not self._chunks:
+            return
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._num_buffered = 0
+        try:
+            self._stream.write(data)
+        except IOError as exc:
+            if exc.errno == errno.EPIPE:
+                raise OutputClosedError()
+            raise
+
+
+class TsvWriter(Writer):
+    """Columns are separated by tabs, rows by newlines. The default human-readable output."""
+
+    COLUMN_SEPARATOR = b'\t'
+    ROW_TERMINATOR = b'\n'
+
+    def __init__(self, stream, colorizer=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        :param colorizer: object with method colored_column(value), e.g main.ColoredPrinter
+        """
+        super(TsvWriter, self).__init__(stream, buffer_size)
+        self._colorizer = colorizer
+
+    def write_header(self, row_type):
+        # names of columns aren't colored
+        self._write_formatted(row_type)
+
+    def write_row(self, row):
+        if self._colorizer is not None:
+            row = [self._colorizer.colored_column(column) for column in row]
+        self._write_formatted(row)
+
+    def _write_formatted(self, row):
+        super(TsvWriter, self).write_row(row)
+
+    def format_row(self, row):
+        return self.COLUMN_SEPARATOR.join(to_bytes(column) for column in row) + self.ROW_TERMINATOR
+
+
+class NulWriter(TsvWriter):
+    """Rows are terminated by NUL bytes, so output can be piped to `xargs -0`."""
+
+    ROW_TERMINATOR = b'\0'
+
+
+class CsvWriter(Writer):
+    """RFC 4180 CSV."""
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE):
+        import csv
+        super(CsvWriter, self).__init__(stream, buffer_size)
+        self._pending = []
+        # csv.writer writes to the object with the method write(), it's the formatted row
+        self._csv_writer = csv.writer(self, lineterminator=b'\r\n')
+
+    def write(self, data):
+        self._pending.append(data)
+
+    def format_row(self, row):
+        self._csv_writer.writerow([to_bytes(column) for column in row])
+        data = b''.join(self._pending)
+        self._pending = []
+        return data
+
+
+class JsonLinesWriter(Writer):
+    """
+    One JSON object per row, keys are the names of the columns. Numbers are written as numbers,
+    NULL as null, everything else (including times) as strings.
+    """
+
+    def __init__(self, stream, buffer_size=DEFAULT_BUFFER_SIZE):
+        import json
+        super(JsonLinesWriter, self).__init__(stream, buffer_size)
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(', ', ': '))
+        self._row_type = None
+
+    def begin(self, row_type, with_header=False):
+        # names of the columns are in every row, so there's no header
+        self._row_type = row_type
+
+    def format_row(self, row):
+        obj = OrderedDict(
+            (name, _to_json_value(column)) for name, column in zip(self._row_type, row))
+        return self._encoder.encode(obj).encode('utf-8') + b'\n'
+
+
+FORMATS = OrderedDict([
+    ('tsv', TsvWriter),
+    ('csv', CsvWriter),
+    ('jsonl', JsonLinesWriter),
+    ('nul', NulWriter),
+])
+
+
+def get_writer(format_name, stream, colorizer=None):
+    """
+    :param colorizer: it's used only by the human-readable 'tsv' format
+    """
+    writer_class = FORMATS[format_name]
+    if writer_class is TsvWriter:
+        return writer_class(stream, colorizer=colorizer)
+    return writer_class(stream)
+
+
+def write_table(writer, table, with_header=False):
+    """
+    Write rows of the `table` and flush the writer.
+
+    :raise OutputClosedError: if reader of the output has gone.
+    """
+    writer.begin(list(table.row_type), with_header)
+    # iter_rows(), not the table: the table wraps every row into the namedtuple
+    for row in table.iter_rows():
+        writer.write_row(row)
+    writer.flush()
+
+
+def to_bytes(value):
+    """:return: utf-8 encoded text of the value, byte strings (e.g paths) are returned as is."""
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return value.encode('utf-8')
+
+
+def _to_json_value(value):
+    if isinstance(value, Null):
+        return None
+    if isinstance(value, bool) or (isinstance(value, (int, long, float)) and not isinstance(value, Timestamp)):
+        return value
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return unicode(value)
+
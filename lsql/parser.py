@@ -5,6 +5,7 @@ import logging
 import re
 
 from lsql import ast
+from lsql import explain
 from lsql.errors import LsqlError
 
 logger = logging.getLogger(__name__)
@@ -155,6 +156,13 @@ class Parser(object):
         return self._tokens[self._index]
 
     def parse(self):
+        query_node = self._get_clause(ExplainToken)
+        if query_node is None:
+            query_node = self.parse_query()
+        self.expect(EndQueryToken)
+        return query_node
+
+    def parse_query(self):
         # order of _get_clause calls is important, because order of clauses is important in SQL
         select_node = self._get_clause(SelectToken)
         from_node = self._get_clause(FromToken)
@@ -165,8 +173,6 @@ class Parser(object):
         limit_node = self._get_clause(LimitToken)
         offset_node = self._get_clause(OffsetToken)
 
-        self.expect(EndQueryToken)
-
         return ast.QueryNode.create(
             select_node=select_node,
             from_node=from_node,
@@ -350,6 +356,10 @@ class KeywordToken(Token):
         return cls.keyword
 
 
+class AnalyzeToken(KeywordToken):
+    keyword = 'analyze'
+
+
 class AsToken(NotImplementedToken, KeywordToken):
     keyword = 'as'
 
@@ -420,6 +430,16 @@ class ExistsToken(NotImplementedToken, KeywordToken):
     keyword = 'exists'
 
 
+class ExplainToken(KeywordToken):
+    keyword = 'explain'
+
+    def clause(self, parser):
+        analyze = isinstance(parser.token, AnalyzeToken)
+        if analyze:
+            parser.advance()
+        return explain.ExplainNode.create(parser.parse_query(), analyze=analyze)
+
+
 class FromToken(KeywordToken):
     keyword = 'from'
 
@@ -462,14 +482,25 @@ class AndToken(KeywordToken):
     keyword = 'and'
 
     def suffix(self, left, parser):
-        return ast.AndNode.create(left, parser.expr(self.right_bp))
+        return ast.AndNode.create(_parse_chain(self, left, parser))
 
 
 class OrToken(KeywordToken):
     keyword = 'or'
 
     def suffix(self, left, parser):
-        return ast.OrNode.create(left, parser.expr(self.right_bp))
+        return ast.OrNode.create(_parse_chain(self, left, parser))
+
+
+def _parse_chain(token, left, parser):
+    """
+    Parse `left <token> x <token> y ...` into the list [left, x, y, ...]
+    """
+    nodes = [left, parser.expr(token.right_bp)]
+    while isinstance(parser.token, token.__class__):
+        parser.advance()
+        nodes.append(parser.expr(token.right_bp))
+    return nodes
 
 
 class OperatorToken(Token):
@@ -486,26 +517,32 @@ class InToken(OperatorToken, KeywordToken):
 
     def suffix(self, left, parser):
         parser.skip(OpeningParenToken)
-        nodes = parser.parse_delimited_exprs(CommaToken)
+        if isinstance(parser.token, SelectToken):
+            right = ast.SubqueryNode.create(parser.parse_query())
+        else:
+            right = ast.ArrayNode.create(parser.parse_delimited_exprs(CommaToken))
         parser.skip(ClosingParenToken)
-        return ast.FunctionNode.create(self.operator_name, [left, ast.ArrayNode.create(nodes)])
+        return ast.FunctionNode.create(self.operator_name, [left, right])
 
 
-class LikeToken(NotImplementedToken, OperatorToken, KeywordToken):
+class LikeToken(OperatorToken, KeywordToken):
     keyword = 'like'
+    operator_name = 'like'
 
 
 # alias for rlike
-class LikeRegexToken(NotImplementedToken, OperatorToken, KeywordToken):
+class LikeRegexToken(OperatorToken, KeywordToken):
     keyword = 'like_regex'
+    operator_name = 'rlike'
 
 
 class IcontainsToken(NotImplementedToken, OperatorToken, KeywordToken):
     keyword = 'icontains'
 
 
-class IlikeToken(NotImplementedToken, OperatorToken, KeywordToken):
+class IlikeToken(OperatorToken, KeywordToken):
     keyword = 'ilike'
+    operator_name = 'ilike'
 
 
 class LimitToken(KeywordToken):
@@ -563,13 +600,14 @@ class OuterToken(NotImplementedToken, KeywordToken):
     keyword = 'outer'
 
 
-# TODO: maybe should be OperatorToken?
-class RlikeToken(NotImplementedToken, KeywordToken):
+class RlikeToken(OperatorToken, KeywordToken):
     keyword = 'rlike'
+    operator_name = 'rlike'
 
 
-class RilikeToken(NotImplementedToken, KeywordToken):
+class RilikeToken(OperatorToken, KeywordToken):
     keyword = 'rilike'
+    operator_name = 'rilike'
 
 
 class SelectToken(KeywordToken):
@@ -641,6 +679,13 @@ class NameToken(Token):
         return ast.NameNode.create(self.text)
 
 
+class ParamToken(Token):
+    """Parameter placeholder `:name` of a prepared query."""
+
+    def prefix(self, parser):
+        return ast.ParamNode.create(self.match.group('name'), location=location_from_match(self.match))
+
+
 class EqToken(OperatorToken):
     operator_name = '='
 
@@ -753,30 +798,63 @@ class EndQueryToken(Token):
 
 
 class Lexer(object):
+    """
+    Rules are combined into one alternation regex, so every token costs a single regex match
+    no matter how many rules there are. Alternatives are tried in order, so the first added rule
+    that matches wins, exactly as if the rules were tried one by one.
+    """
+
     def __init__(self):
-        self._rules = []  # [(regex, token_class), ...]
+        self._rules = []  # [(regex, token_class, keywords), ...]
+        self._master_regex = None
+        self._rule_by_group = None  # group name -> (regex, token_class, keywords)
 
-    def add(self, regex, token_class):
-        self._rules.append((regex, token_class))
+    def add(self, regex, token_class, keywords=None):
+        """
+        :param regex: Compiled regex, flags other than re.UNICODE are not supported.
+        :param token_class: Class of tokens matched by the regex.
+        :param keywords: Optional dict: lowercase text -> token class. Matches with such text
+                         produce the keyword's token class instead of token_class.
+        """
+        if regex.flags & ~re.UNICODE:
+            raise ValueError('regex {!r} has unsupported flags'.format(regex.pattern))
+        self._rules.append((regex, token_class, keywords or {}))
+        self._master_regex = None
+
+    def _compile(self):
+        alternatives = []
+        self._rule_by_group = {}
+        for index, rule in enumerate(self._rules):
+            group = '_{:d}'.format(index)
+            regex = rule[0]
+            alternatives.append('(?P<{}>{})'.format(group, _uncapture(regex.pattern)))
+            self._rule_by_group[group] = rule
+        self._master_regex = _regex('|'.join(alternatives))
 
     def tokenize_with_whitespaces(self, string):
+        if self._master_regex is None:
+            self._compile()
+        master_match = self._master_regex.match
+        rule_by_group = self._rule_by_group
+        debug = logger.isEnabledFor(logging.DEBUG)
         start = 0
-        while start < len(string):
-            for regex, token_class in self._rules:
-                logger.debug('matching regex {!r} with string {!r} at position {:d}'.format(
-                    regex.pattern, string, start))
-                match = regex.match(string, start)
-                if not match:
-                    logger.debug('failed')
-                    continue
-                logger.debug('success!')
-                yield token_class(match)
-                start = match.end()
-                break
-            else:
+        length = len(string)
+        while start < length:
+            match = master_match(string, start)
+            if match is None:
                 raise CantTokenizeError(string, start)
-        end_re = _regex('$')
-        yield EndQueryToken(end_re.match(string, pos=start))
+            regex, token_class, keywords = rule_by_group[match.lastgroup]
+            if keywords:
+                token_class = keywords.get(match.group().lower(), token_class)
+            if regex.groupindex:
+                # groups of the rule are not captured by the master regex (their names clash
+                # between rules), so match the rule itself to give the token its groups
+                match = regex.match(string, start)
+            if debug:
+                logger.debug('matched %s at position %d: %r', token_class.__name__, start, match.group())
+            yield token_class(match)
+            start = match.end()
+        yield EndQueryToken(_END_REGEX.match(string, start))
 
     def tokenize(self, string):
         assert isinstance(string, unicode)
@@ -785,18 +863,22 @@ class Lexer(object):
                 yield token
 
 
-def _keyword(s):
-    return _regex(r'{}\b'.format(re.escape(s)), re.I)
-
-
 def _regex(pattern, extra_flags=0):
     return re.compile(pattern, re.UNICODE | extra_flags)
 
 
+_END_REGEX = _regex('$')
+
+
+def _uncapture(pattern):
+    """Replace named groups with non-capturing ones: `(?P<name>x)` -> `(?:x)`."""
+    return re.sub(r'(?<!\\)\(\?P<\w+>', '(?:', pattern)
+
+
 def _make_default_lexer():
     lexer = Lexer()
-    _add_keywords(lexer)
     _add_names(lexer)
+    _add_params(lexer)
     _add_operators(lexer)
     _add_string_literals(lexer)
     _add_number_literals(lexer)
@@ -819,8 +901,9 @@ def _add_special(lexer):
         lexer.add(_regex(pattern), special_class)
 
 
-def _add_keywords(lexer):
+def _add_names(lexer):
     keyword_token_classes = [
+        AnalyzeToken,
         AndToken,
         AsToken,
         AscToken,
@@ -835,6 +918,7 @@ def _add_keywords(lexer):
         ElseToken,
         EndToken,
         ExistsToken,
+        ExplainToken,
         FromToken,
         GroupToken,
         HavingToken,
@@ -862,12 +946,13 @@ def _add_keywords(lexer):
         UpdateToken,
         WhereToken,
     ]
-    for keyword_class in keyword_token_classes:
-        lexer.add(_keyword(keyword_class.keyword), keyword_class)
+    # keywords are names with special meaning: `like_regex` is one keyword, `selection` is a name
+    keywords = {keyword_class.keyword: keyword_class for keyword_class in keyword_token_classes}
+    lexer.add(_regex(r'[^\W\d]\w*'), NameToken, keywords=keywords)
 
 
-def _add_names(lexer):
-    lexer.add(_regex(r'[^\W\d]\w*'), NameToken)
+def _add_params(lexer):
+    lexer.add(_regex(r':(?P<name>[^\W\d]\w*)'), ParamToken)
 
 
 _OPERATOR_CHARS = set()  # populated in _add_operators
@@ -904,14 +989,14 @@ def _add_number_literals(lexer):
     # TODO: check that regexes are in sync with NumberToken
     number_patterns = [
         # [2].3[e[+-]5][years]
-        r'(?P<int>\d*)\.(?P<float>\d+)(?:e(?P<exp>[+-]?\d+))?(?P<suffix>[^\W\d]+)?\b',
+        r'(?P<int>\d*)\.(?P<float>\d+)(?:[eE](?P<exp>[+-]?\d+))?(?P<suffix>[^\W\d]+)?\b',
         # 2.[e[+-]5][years]
-        r'(?P<int>\d+)\.(?P<float>)(?:(?:e(?P<exp>[+-]?\d+))?(?P<suffix>[^\W\d]+)?\b)?',
+        r'(?P<int>\d+)\.(?P<float>)(?:(?:[eE](?P<exp>[+-]?\d+))?(?P<suffix>[^\W\d]+)?\b)?',
         # 2[e[+-]5][years]
-        r'(?P<int>\d+)(?P<float>)(?:e(?P<exp>[+-]?\d+))?(?P<suffix>[^\W\d]+)?\b',
+        r'(?P<int>\d+)(?P<float>)(?:[eE](?P<exp>[+-]?\d+))?(?P<suffix>[^\W\d]+)?\b',
     ]
     for pattern in number_patterns:
-        lexer.add(_regex(pattern, extra_flags=re.IGNORECASE), NumberToken)
+        lexer.add(_regex(pattern), NumberToken)
 
 
 def _add_whitespace(lexer):
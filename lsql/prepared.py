@@ -0,0 +1,237 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from timeit import default_timer
+import threading
+
+from lsql import ast
+from lsql import parser
+from lsql import stats
+from lsql import tracing
+
+DEFAULT_PLAN_CACHE_SIZE = 256
+
+
+class PreparedQuery(object):
+    """
+    Query that was tokenized, parsed and planned once and can be executed many times
+    with different directories and parameters. Plan is never modified during execution,
+    so it's safe to execute one PreparedQuery from many threads at once.
+    """
+
+    def __init__(self, query_string, query_node):
+        """
+        :type query_string: unicode or None if query is loaded from the serialized plan
+        :type query_node: lsql.ast.QueryNode
+        """
+        self.query_string = query_string
+        self.query_node = query_node
+        self.param_names = frozenset(
+            ast.Namespace.prepare_key(node.name) for node in query_node.iter_subtree()
+            if isinstance(node, ast.ParamNode)
+        )
+
+    def execute(self, directory=None, params=None, collect_stats=False, profiler=None, batch_size=None):
+        """
+        :param directory: Directory to query, current directory by default.
+        :param params: Dictionary unicode -> value, values of the parameter placeholders.
+        :param collect_stats: If True, then QueryStats of the execution are available as `stats`
+          attribute of the result. It adds some overhead on every row.
+        :param profiler: lsql.profiling.Profiler that will get time of every column and function.
+        :param batch_size: If it's not None, then conditions and aggregates are evaluated for batches
+          of this many rows, with numpy if it's installed (see lsql.batch). It's ignored when profiling:
+          profiler measures row by row evaluation.
+        :rtype: lsql.ast.Table
+        :raise lsql.ast.InvalidBatchSizeError: if batch_size is less than 1
+        """
+        if batch_size is not None and batch_size < 1:
+            raise ast.InvalidBatchSizeError(batch_size)
+        params_context = self._get_params_context(params or {})
+        # TODO: b'.'? Handle TaggedStr issues inside of the ast.DirectoryWalker
+        cwd_context = ast.Context({'cwd': (directory or b'.')})
+        query_stats = stats.QueryStats() if collect_stats else None
+        if profiler is not None:
+            batch_size = None
+        execution_context = ast.ExecutionContext(ast.ExecutionState(stats=query_stats, batch_size=batch_size))
+        context = ast.CombinedContext(execution_context, cwd_context, params_context, ast.BUILTIN_CONTEXT)
+        tracer = tracing.get_tracer()
+        if tracer is None:
+            return self._execute(context, query_stats, profiler)
+        tracer.query_started(self, directory)
+        try:
+            table = self._execute(context, query_stats, profiler)
+        except Exception as exc:
+            tracer.error(self.query_string, exc)
+            tracer.query_finished(self, None)
+            raise
+        tracer.query_finished(self, table)
+        return table
+
+    def _execute(self, context, query_stats, profiler):
+        if profiler is not None:
+            query_node = profiler.instrument(self.query_node)
+            with profiler.profiling():
+                return self._evaluate(query_node, context, query_stats)
+        return self._evaluate(self.query_node, context, query_stats)
+
+    @staticmethod
+    def _evaluate(query_node, context, query_stats):
+        if query_stats is None:
+            return query_node.get_value(context)
+        with query_stats.collecting():
+            table = query_node.get_value(context)
+        table.stats = query_stats
+        return table
+
+    def dumps(self):
+        """
+        :return: serialized plan, that can be executed by another process (see PreparedQuery.loads)
+        :rtype: bytes
+        """
+        from lsql import serialization
+        return serialization.dumps(self.query_node)
+
+    @classmethod
+    def loads(cls, data):
+        """
+        :param data: result of PreparedQuery.dumps()
+        :rtype: PreparedQuery
+        """
+        from lsql import serialization
+        return cls(None, serialization.loads(data))
+
+    def _get_params_context(self, params):
+        names = set()
+        for name in params:
+            name = ast.Namespace.prepare_key(name)
+            if name not in self.param_names:
+                raise ast.UnknownParameterError(name)
+            names.add(name)
+        missing = self.param_names - names
+        if missing:
+            raise ast.MissingParameterError(min(missing))
+        return ast.Context({ast.get_param_key(name): value for name, value in params.viewitems()})
+
+    def __repr__(self):
+        return 'PreparedQuery(query_string={!r})'.format(self.query_string)
+
+
+class PlanCache(object):
+    """
+    Thread-safe LRU cache: normalized query text (see normalize) -> PreparedQuery.
+
+    Query texts that were already seen are mapped to their normalized texts by a separate LRU
+    of aliases, so they aren't tokenized again and don't take places of the plans.
+    """
+
+    def __init__(self, max_size=DEFAULT_PLAN_CACHE_SIZE, max_aliases=None):
+        """
+        :param max_size: maximum number of plans
+        :param max_aliases: maximum number of query texts mapped to plans, `max_size` by default
+        """
+        self.max_size = max_size
+        self.max_aliases = max_size if max_aliases is None else max_aliases
+        self._items = OrderedDict()
+        self._aliases = OrderedDict()  # query text -> key of the plan
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return _get_recent(self._items, key)
+
+    def put(self, key, value):
+        with self._lock:
+            _put_recent(self._items, key, value, self.max_size)
+
+    def get_alias(self, query_string):
+        """:return: key of the plan of the `query_string` or None"""
+        with self._lock:
+            return _get_recent(self._aliases, query_string)
+
+    def put_alias(self, query_string, key):
+        with self._lock:
+            _put_recent(self._aliases, query_string, key, self.max_aliases)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._aliases.clear()
+
+    def __len__(self):
+        """:return: number of plans"""
+        return len(self._items)
+
+
+def _get_recent(items, key):
+    try:
+        value = items.pop(key)
+    except KeyError:
+        return None
+    # reinserting makes it the most recently used item
+    items[key] = value
+    return value
+
+
+def _put_recent(items, key, value, max_size):
+    items.pop(key, None)
+    items[key] = value
+    while len(items) > max_size:
+        items.popitem(last=False)
+
+
+PLAN_CACHE = PlanCache()
+
+
+def prepare(query_string, plan_cache=PLAN_CACHE):
+    """
+    Return PreparedQuery for the `query_string`. Queries that differ only in whitespace and
+    case of keywords share the same plan.
+
+    :type query_string: unicode
+    :type plan_cache: PlanCache
+    :rtype: PreparedQuery
+    """
+    assert isinstance(query_string, unicode)
+    key = plan_cache.get_alias(query_string)
+    if key is not None:
+        prepared = plan_cache.get(key)
+        if prepared is not None:
+            return prepared
+    tracer = tracing.get_tracer()
+    if tracer is None:
+        return _prepare(query_string, plan_cache, None)
+    try:
+        return _prepare(query_string, plan_cache, tracer)
+    except Exception as exc:
+        tracer.error(query_string, exc)
+        raise
+
+
+def _prepare(query_string, plan_cache, tracer):
+    start = default_timer()
+    tokens = list(parser.tokenize(query_string))
+    key = normalize(tokens)
+    prepared = plan_cache.get(key)
+    if prepared is None:
+        prepared = PreparedQuery(query_string, parser.parse(tokens))
+        plan_cache.put(key, prepared)
+        if tracer is not None:
+            tracer.plan_built(query_string, default_timer() - start)
+    # next time the same text will be found without tokenizing it
+    plan_cache.put_alias(query_string, key)
+    return prepared
+
+
+def normalize(tokens):
+    """
+    :return: Text of the query with single spaces between tokens and lowercase keywords.
+    """
+    texts = []
+    for token in tokens:
+        if isinstance(token, parser.EndQueryToken):
+            continue
+        if isinstance(token, parser.KeywordToken):
+            texts.append(token.text.lower())
+        else:
+            texts.append(token.text)
+    return ' '.join(texts)
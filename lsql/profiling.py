@@ -0,0 +1,182 @@
+"""
+Profiling of queries in terms of SQL: time and number of calls of every column, function and operator.
+
+Profiler evaluates an instrumented copy of the plan, so queries that aren't profiled
+don't pay for it.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+import threading
+
+from lsql import ast
+from lsql import serialization
+from lsql.explain import format_seconds
+
+_local = threading.local()
+
+_PROFILED_CLASSES = {}  # node class -> its profiled subclass
+
+# functions that are shown as operators
+_OPERATORS = frozenset(['||', '+', '-', '*', '/', '^', '%', '>', '>=', '<', '<=', '=', '<>',
+                        'negate', 'in', 'like', 'ilike', 'rlike', 'rilike'])
+
+
+class ProfileEntry(object):
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.calls = 0
+        # time of the evaluation including the evaluation of the arguments
+        self.cumulative_seconds = 0.0
+        # time of the evaluation without the evaluation of the profiled arguments
+        self.own_seconds = 0.0
+
+
+class Profiler(object):
+    """
+    Profiler of the queries that run in one thread.
+    """
+
+    def __init__(self, clock=default_timer):
+        self._clock = clock
+        self._entries = OrderedDict()  # (kind, name) -> ProfileEntry
+        self._node_entries = {}  # id(node) -> ProfileEntry
+        self._nodes = []  # instrumented nodes, so their ids stay valid
+        self._stack = []  # [entry, time of the children] of the active evaluations
+        self.total_seconds = 0.0
+
+    def instrument(self, query_node):
+        """
+        :return: copy of the `query_node` that reports its evaluation to this profiler.
+        Files table functions aren't instrumented: their rows are produced lazily.
+        """
+        copy = serialization.loads(serialization.dumps(query_node))
+        for node in copy.iter_subtree():
+            if isinstance(node, ast.QueryNode):
+                # columns are evaluated where they're used, not all at once after WHERE
+                node.data = node.data._replace(projected_name_nodes=None)
+        from_nodes = [node.from_node for node in copy.iter_subtree() if isinstance(node, ast.QueryNode)]
+        skipped = {id(node) for from_node in from_nodes for node in from_node.iter_subtree()}
+        for node in copy.iter_subtree():
+            label = _get_label(node)
+            if label is None or id(node) in skipped:
+                continue
+            node.__class__ = _get_profiled_class(type(node))
+            entry = self._entries.get(label)
+            if entry is None:
+                entry = self._entries[label] = ProfileEntry(*label)
+            self._node_entries[id(node)] = entry
+            self._nodes.append(node)
+        return copy
+
+    @contextmanager
+    def profiling(self):
+        """
+        Activate this Profiler in the current thread and add time of the block to `total_seconds`.
+        """
+        previous = get_active()
+        _local.profiler = self
+        start = self._clock()
+        try:
+            yield self
+        finally:
+            self.total_seconds += self._clock() - start
+            _local.profiler = previous
+
+    def evaluate(self, node, get_value, context):
+        entry = self._node_entries[id(node)]
+        entry.calls += 1
+        # time of the nested evaluations of the same entry (e.g nested ANDs) is already counted
+        is_nested = any(active_entry is entry for active_entry, _ in self._stack)
+        frame = [entry, 0.0]
+        self._stack.append(frame)
+        start = self._clock()
+        try:
+            return get_value(node, context)
+        finally:
+            seconds = self._clock() - start
+            self._stack.pop()
+            if not is_nested:
+                entry.cumulative_seconds += seconds
+            entry.own_seconds += seconds - frame[1]
+            if self._stack:
+                self._stack[-1][1] += seconds
+
+    def get_entries(self):
+        """:return: list of ProfileEntry that were called, the most expensive first."""
+        entries = [entry for entry in self._entries.viewvalues() if entry.calls]
+        entries.sort(key=lambda entry: entry.cumulative_seconds, reverse=True)
+        return entries
+
+
+def get_active():
+    """:return: Profiler active in the current thread or None."""
+    return getattr(_local, 'profiler', None)
+
+
+def _get_label(node):
+    """:return: (kind, name) of the node or None if node isn't profiled."""
+    if isinstance(node, ast.NameNode):
+        name = ast.Namespace.prepare_key(node.name)
+        name = ast.Stat.ATTR_ALIASES.get(name, name)
+        if name in ast.Stat.ATTRS:
+            return 'column', name
+        return 'name', name
+    if isinstance(node, ast.AggFunctionNode):
+        return 'aggregate', node.function_name.lower()
+    if isinstance(node, ast.FunctionNode):
+        name = node.function_name.lower()
+        return ('operator' if name in _OPERATORS else 'function'), name
+    if isinstance(node, ast.AndNode):
+        return 'operator', 'and'
+    if isinstance(node, ast.OrNode):
+        return 'operator', 'or'
+    if isinstance(node, ast.BetweenNode):
+        return 'operator', 'between'
+    if isinstance(node, ast.SubqueryNode):
+        return 'subquery', 'subquery'
+    return None
+
+
+def _get_profiled_class(node_class):
+    profiled_class = _PROFILED_CLASSES.get(node_class)
+    if profiled_class is None:
+        base_get_value = node_class.get_value.im_func
+
+        def get_value(self, context):
+            profiler = get_active()
+            if profiler is None:
+                return base_get_value(self, context)
+            return profiler.evaluate(self, base_get_value, context)
+
+        profiled_class = type(str('Profiled{}'.format(node_class.__name__)), (node_class,), {
+            '__slots__': (),
+            'get_value': get_value,
+        })
+        _PROFILED_CLASSES[node_class] = profiled_class
+    return profiled_class
+
+
+def format_report(profiler):
+    """
+    :type profiler: Profiler
+    :return: list of lines
+    """
+    total = profiler.total_seconds
+    rows = [('kind', 'name', 'calls', 'cumulative', 'own', '%')]
+    for entry in profiler.get_entries():
+        share = 100 * entry.cumulative_seconds / total if total else 0.0
+        rows.append((entry.kind, entry.name, '{:d}'.format(entry.calls),
+                     format_seconds(entry.cumulative_seconds), format_seconds(entry.own_seconds),
+                     '{:.1f}'.format(share)))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ['Total: {}'.format(format_seconds(total))]
+    for row in rows:
+        # names are aligned to the left, numbers to the right
+        lines.append('  '.join(
+            value.ljust(width) if i < 2 else value.rjust(width)
+            for i, (value, width) in enumerate(zip(row, widths))).rstrip())
+    return lines
@@ -0,0 +1,196 @@
+"""
+Progress of long scans: periodic reports with throughput, current directory and ETA.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from timeit import default_timer
+import errno
+import json
+import os
+
+from lsql import tracing
+
+DEFAULT_INTERVAL = 1.0  # seconds between reports
+
+DEFAULT_HISTORY_PATH = os.path.join('~', '.cache', 'lsql', 'progress.json')
+
+
+class ProgressReporter(tracing.Tracer):
+    """
+    Tracer that reports progress of the query every `interval` seconds.
+
+    Clock is checked only on directory listings and on batches of scanned rows, so reporting
+    doesn't slow down the scan.
+    """
+
+    def __init__(self, write, history=None, interval=DEFAULT_INTERVAL, clock=default_timer):
+        """
+        :param write: function that gets a line of the report
+        :param history: ProgressHistory with totals of the previous runs, it's used to estimate ETA.
+        """
+        self._write = write
+        self._history = history
+        self._interval = interval
+        self._clock = clock
+        self._query_node = None
+        self._root = None
+        self._expected_entries = None
+        self._start = None
+        self._last_report = None
+        self.num_directories = 0
+        self.num_entries = 0
+        self.num_matched = 0
+        self.bytes_read = 0
+        self.current_directory = None
+        self._last_num_directories = 0
+        self._last_num_entries = 0
+
+    def query_started(self, prepared_query, directory):
+        self._query_node = prepared_query.query_node
+        self._start = self._last_report = self._clock()
+
+    def scan_started(self, query_node, root):
+        # history is kept by the directory the query scans, subqueries scan other trees
+        if query_node is not self._query_node or self._root is not None:
+            return
+        self._root = _to_unicode(os.path.abspath(root))
+        if self._history is not None:
+            totals = self._history.get(self._root)
+            if totals is not None:
+                self._expected_entries = totals['entries']
+
+    def query_finished(self, prepared_query, table):
+        self._report(self._clock(), done=True)
+        if table is not None and self._history is not None and self._root is not None:
+            self._history.put(self._root, {
+                'directories': self.num_directories,
+                'entries': self.num_entries,
+            })
+
+    def directory_scanned(self, query_node, path, num_entries):
+        # e.g listings of the `size` of directories aren't the entries of the query
+        if query_node is self._query_node:
+            self.num_directories += 1
+            self.num_entries += num_entries
+
+    def directory_listed(self, path, num_entries, seconds):
+        self.current_directory = path
+        self._maybe_report()
+
+    def file_read(self, path, num_bytes):
+        self.bytes_read += num_bytes
+
+    def rows_produced(self, query_node, stage, num_rows):
+        # rows matched by subqueries aren't the rows of the result
+        if stage == 'filter' and query_node is self._query_node:
+            self.num_matched += num_rows
+        self._maybe_report()
+
+    def _maybe_report(self):
+        if self._start is None:
+            return
+        now = self._clock()
+        if now - self._last_report >= self._interval:
+            self._report(now)
+
+    def _report(self, now, done=False):
+        if done:
+            # average rates of the whole scan
+            self._last_report = self._start
+            self._last_num_directories = self._last_num_entries = 0
+        elapsed = now - self._last_report
+        directories_per_second = _get_rate(self.num_directories - self._last_num_directories, elapsed)
+        entries_per_second = _get_rate(self.num_entries - self._last_num_entries, elapsed)
+        parts = [
+            '{}: {:.1f}s'.format('done' if done else 'progress', now - self._start),
+            'dirs={:d} ({:.0f}/s)'.format(self.num_directories, directories_per_second),
+            'files={:d} ({:.0f}/s)'.format(self.num_entries, entries_per_second),
+            'rows_matched={:d}'.format(self.num_matched),
+            'bytes_read={:d}'.format(self.bytes_read),
+        ]
+        if not done:
+            parts.append('eta={}'.format(self._format_eta(entries_per_second)))
+            if self.current_directory is not None:
+                parts.append('current={}'.format(_to_unicode(self.current_directory)))
+        self._write(' '.join(parts))
+        self._last_report = now
+        self._last_num_directories = self.num_directories
+        self._last_num_entries = self.num_entries
+
+    def _format_eta(self, entries_per_second):
+        if self._expected_entries is None or not entries_per_second:
+            return '?'
+        remaining = self._expected_entries - self.num_entries
+        if remaining < 0:
+            return '?'
+        return '{:.0f}s'.format(remaining / entries_per_second)
+
+
+class ProgressHistory(object):
+    """
+    Totals (number of directories and files) of the previous runs by the root directory.
+    It's a JSON file, so it can be shared between versions.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, root):
+        """:return: dictionary with keys 'directories' and 'entries' or None."""
+        return self._load().get(root)
+
+    def put(self, root, totals):
+        """
+        Save `totals` of the `root`. History is best effort: it's not saved if file isn't writable.
+        """
+        history = self._load()
+        history[root] = totals
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                return
+        try:
+            _write_atomically(self.path, json.dumps(history, sort_keys=True))
+        except (IOError, OSError):
+            pass
+
+    def _load(self):
+        try:
+            with open(self.path) as fileobj:
+                history = json.load(fileobj)
+        except (IOError, ValueError):
+            return {}
+        return history if isinstance(history, dict) else {}
+
+
+def get_default_history():
+    return ProgressHistory(os.path.expanduser(DEFAULT_HISTORY_PATH))
+
+
+def status_file_writer(path):
+    """
+    :return: function that replaces content of the file `path` with the last line of the report.
+    """
+    def write(line):
+        _write_atomically(path, line + '\n')
+    return write
+
+
+def _write_atomically(path, text):
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as fileobj:
+        fileobj.write(text.encode('utf-8'))
+    os.rename(tmp_path, path)
+
+
+def _get_rate(count, seconds):
+    if seconds <= 0:
+        return 0.0
+    return count / seconds
+
+
+def _to_unicode(path):
+    if isinstance(path, bytes):
+        return path.decode('utf-8', 'replace')
+    return path
@@ -0,0 +1,220 @@
+"""
+Compact serialization of query plans, so planned queries can be shipped to worker processes
+without tokenizing and parsing them again.
+
+Format: header (magic + format version) followed by zlib-compressed marshalled pair
+(structure, constants). `structure` is a bytestring with a node code, a varint number of
+children and, for nodes with data, a varint index in `constants` for every node of the plan
+in pre-order. `constants` is a list of distinct node data: names and function names repeat a lot
+in machine-generated queries. Function objects and other derived data are not serialized:
+they're restored from the function registry on load.
+
+Plans are loaded with marshal, so load only plans from trusted sources.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple
+import marshal
+import struct
+import zlib
+
+from lsql import ast
+from lsql import explain
+from lsql.errors import LsqlError
+
+MAGIC = b'LSQP'
+# increment when the format or the list of node classes changes
+FORMAT_VERSION = 3
+_MARSHAL_VERSION = 2
+# fastest compression level: most of the redundancy is in the repeated type codes and lengths
+_COMPRESSION_LEVEL = 1
+_HEADER = struct.Struct(b'<4sH')
+
+
+class SerializationError(LsqlError):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def _encode_data(node):
+    return node.data
+
+
+def _decode_data(node_class, payload, children):
+    return node_class(data=payload, children=children)
+
+
+def _decode_null(node_class, payload, children):
+    # NULL is a singleton that marshal doesn't know about, so it has its own code
+    return node_class(data=ast.NULL, children=children)
+
+
+def _decode_query(node_class, payload, children):
+    return node_class.from_children(children)
+
+
+def _encode_function_name(node):
+    return node.function_name
+
+
+def _decode_function(node_class, function_name, children):
+    function = ast.FUNCTIONS.resolve(function_name, len(children))
+    data = ast.FunctionData(function_name=function_name, function=function)
+    return node_class(data=data, children=children)
+
+
+def _decode_bound_function(node_class, function_name, children):
+    function = ast.FUNCTIONS.resolve(function_name, len(children))
+    bound = function.bind_constant(ast.get_constant_value(children[1]))
+    data = ast.BoundFunctionData(function_name=function_name, function=function, bound=bound)
+    return node_class(data=data, children=children)
+
+
+def _decode_agg_function(node_class, function_name, children):
+    aggregate_class = ast.FUNCTIONS.resolve(function_name, len(children))
+    data = ast.AggFunctionData(function_name=function_name, aggregate_class=aggregate_class)
+    return node_class(data=data, children=children)
+
+
+# encode is None for nodes without data
+NodeCodec = namedtuple('NodeCodec', ['node_class', 'encode', 'decode'])
+
+# index in this list is the code of the node class,
+# so append new classes to the end and increment FORMAT_VERSION
+_CODECS = [
+    NodeCodec(ast.QueryNode, None, _decode_query),
+    NodeCodec(ast.SelectNode, None, _decode_data),
+    NodeCodec(ast.SelectStarNode, None, _decode_data),
+    NodeCodec(ast.FromNode, None, _decode_data),
+    NodeCodec(ast.GroupNode, None, _decode_data),
+    NodeCodec(ast.FakeGroupNode, None, _decode_data),
+    NodeCodec(ast.HavingNode, None, _decode_data),
+    NodeCodec(ast.OrderNode, None, _decode_data),
+    NodeCodec(ast.OrderByPartNode, _encode_data, _decode_data),
+    NodeCodec(ast.NullNode, None, _decode_data),
+    NodeCodec(ast.NameNode, _encode_data, _decode_data),
+    NodeCodec(ast.ParamNode, _encode_data, _decode_data),
+    NodeCodec(ast.ValueNode, _encode_data, _decode_data),
+    NodeCodec(ast.ArrayNode, None, _decode_data),
+    NodeCodec(ast.SubqueryNode, None, _decode_data),
+    NodeCodec(ast.BetweenNode, None, _decode_data),
+    NodeCodec(ast.AndNode, None, _decode_data),
+    NodeCodec(ast.OrNode, None, _decode_data),
+    NodeCodec(ast.FunctionNode, _encode_function_name, _decode_function),
+    NodeCodec(ast.UnaryFunctionNode, _encode_function_name, _decode_function),
+    NodeCodec(ast.BinaryFunctionNode, _encode_function_name, _decode_function),
+    NodeCodec(ast.BoundFunctionNode, _encode_function_name, _decode_bound_function),
+    NodeCodec(ast.AggFunctionNode, _encode_function_name, _decode_agg_function),
+    NodeCodec(ast.ValueNode, None, _decode_null),
+    NodeCodec(explain.ExplainNode, _encode_data, _decode_data),
+    NodeCodec(ast.ContentMatchNode, _encode_function_name, _decode_bound_function),
+]
+_CODES = {codec.node_class: code for code, codec in enumerate(_CODECS) if codec.decode is not _decode_null}
+_NULL_CODE = [codec.decode for codec in _CODECS].index(_decode_null)
+
+
+def dumps(query_node):
+    """
+    :type query_node: lsql.ast.QueryNode or lsql.explain.ExplainNode
+    :rtype: bytes
+    """
+    structure = bytearray()
+    constants = []
+    constant_indexes = {}  # (type, constant) -> index in constants
+    for node in query_node.iter_subtree():
+        if isinstance(node, ast.ValueNode) and node.value is ast.NULL:
+            code = _NULL_CODE
+        else:
+            try:
+                code = _CODES[type(node)]
+            except KeyError:
+                raise SerializationError("can't serialize {}".format(type(node).__name__))
+        codec = _CODECS[code]
+        structure.append(code)
+        _append_varint(structure, len(node.children))
+        if codec.encode is not None:
+            constant = codec.encode(node)
+            # type is a part of the key, because 1 == 1.0 == True
+            key = (type(constant), constant)
+            index = constant_indexes.get(key)
+            if index is None:
+                index = constant_indexes[key] = len(constants)
+                constants.append(constant)
+            _append_varint(structure, index)
+    try:
+        body = marshal.dumps((bytes(structure), constants), _MARSHAL_VERSION)
+    except ValueError as exc:
+        raise SerializationError("can't serialize plan: {}".format(exc))
+    return _HEADER.pack(MAGIC, FORMAT_VERSION) + zlib.compress(body, _COMPRESSION_LEVEL)
+
+
+def loads(data):
+    """
+    :type data: bytes
+    :rtype: lsql.ast.QueryNode
+    """
+    if len(data) < _HEADER.size:
+        raise SerializationError('data is too short')
+    magic, version = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SerializationError('not a serialized plan')
+    if version != FORMAT_VERSION:
+        raise SerializationError('unsupported plan format version {:d}, expected {:d}'.format(
+            version, FORMAT_VERSION))
+    try:
+        structure, constants = marshal.loads(zlib.decompress(data[_HEADER.size:]))
+        entries = _read_entries(bytearray(structure), constants)
+    except (zlib.error, ValueError, EOFError, TypeError, IndexError):
+        raise SerializationError('corrupted plan')
+    # nodes are built from the end of pre-order, so children are built before their parents
+    stack = []
+    for codec, num_children, payload in reversed(entries):
+        if num_children:
+            children = stack[:-num_children - 1:-1]
+            del stack[-num_children:]
+        else:
+            children = []
+        stack.append(codec.decode(codec.node_class, payload, children))
+    if len(stack) != 1 or not isinstance(stack[0], (ast.QueryNode, explain.ExplainNode)):
+        raise SerializationError('corrupted plan')
+    query_node = stack[0]
+    query_node.link_parents()
+    return query_node
+
+
+def _read_entries(structure, constants):
+    """:return: list of (codec, num_children, payload) in pre-order."""
+    entries = []
+    pos = 0
+    while pos < len(structure):
+        codec = _CODECS[structure[pos]]
+        num_children, pos = _read_varint(structure, pos + 1)
+        payload = None
+        if codec.encode is not None:
+            index, pos = _read_varint(structure, pos)
+            payload = constants[index]
+        entries.append((codec, num_children, payload))
+    return entries
+
+
+def _append_varint(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def _read_varint(buf, pos):
+    """:return: (value, position after the value)"""
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
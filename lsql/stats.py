@@ -0,0 +1,236 @@
+"""
+Execution statistics: filesystem calls and per-stage rows and timings of a query.
+
+Filesystem calls are counted by the code that makes them (see `count`) into the QueryStats
+that is active in the current thread, so rows, walkers and functions don't need a reference
+to the running query.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+import sys
+import threading
+
+_local = threading.local()
+
+
+class StageStats(object):
+    """
+    Stats of one stage (scan, filter, sort etc) of a query. Time and syscalls are exclusive:
+    time spent in nested stages (e.g in a subquery) isn't counted twice.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.rows_out = 0
+        self.seconds = 0.0
+        self.syscalls = OrderedDict()  # syscall name -> count
+
+
+class QueryStats(object):
+    def __init__(self, clock=default_timer):
+        self._clock = clock
+        self.syscalls = OrderedDict()  # syscall name -> count
+        self.bytes_read = 0
+        self.entries_seen = 0
+        self.forbidden_paths = []
+        self.total_seconds = 0.0
+        self._stages = {}  # key -> StageStats
+        self._stack = []  # active stages, innermost is the last
+        self._last_time = None
+
+    def get_stage(self, key, name):
+        """
+        :param key: hashable key of the stage, e.g (id(query_node), name)
+        :rtype: StageStats
+        """
+        stage = self._stages.get(key)
+        if stage is None:
+            stage = self._stages[key] = StageStats(name)
+        return stage
+
+    def find_stage(self, key):
+        """:return: StageStats or None if stage wasn't executed."""
+        return self._stages.get(key)
+
+    def enter(self, stage):
+        self._charge_time()
+        stage.calls += 1
+        self._stack.append(stage)
+
+    def exit(self):
+        self._charge_time()
+        self._stack.pop()
+
+    def run(self, stage, fn, *args):
+        """
+        Call `fn(*args)` as a `stage`.
+        """
+        self.enter(stage)
+        try:
+            return fn(*args)
+        finally:
+            self.exit()
+
+    def iterate(self, stage, iterable):
+        """
+        Iterate over `iterable`, time spent in producing items is charged to the `stage`.
+        """
+        iterator = iter(iterable)
+        while True:
+            self.enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.exit()
+            stage.rows_out += 1
+            yield item
+
+    @contextmanager
+    def collecting(self):
+        """
+        Activate this QueryStats for the duration of the block and add its time to `total_seconds`.
+        """
+        start = self._clock()
+        try:
+            with activated(self):
+                yield self
+        finally:
+            self.total_seconds += self._clock() - start
+
+    def get_stage_totals(self):
+        """
+        :return: OrderedDict stage name -> StageStats summed over all queries and subqueries.
+        """
+        totals = OrderedDict()
+        for stage in self._stages.viewvalues():
+            total = totals.get(stage.name)
+            if total is None:
+                total = totals[stage.name] = StageStats(stage.name)
+            total.calls += stage.calls
+            total.rows_out += stage.rows_out
+            total.seconds += stage.seconds
+            for name, num in stage.syscalls.viewitems():
+                total.syscalls[name] = total.syscalls.get(name, 0) + num
+        return totals
+
+    def summary(self):
+        """
+        :return: OrderedDict with the execution summary, values are numbers and lists of paths.
+        """
+        totals = self.get_stage_totals()
+
+        def rows(name):
+            return totals[name].rows_out if name in totals else 0
+
+        def seconds(name):
+            return totals[name].seconds if name in totals else 0.0
+
+        return OrderedDict([
+            ('directories_listed', self.syscalls.get('listdir', 0)),
+            ('entries_seen', self.entries_seen),
+            ('lstat_calls', self.syscalls.get('lstat', 0)),
+            ('files_opened', self.syscalls.get('open', 0)),
+            ('bytes_read', self.bytes_read),
+            ('rows_scanned', rows('scan')),
+            ('rows_filtered', rows('scan') - rows('filter')),
+            ('scan_seconds', seconds('scan')),
+            ('filter_seconds', seconds('filter')),
+            ('group_seconds', seconds('group')),
+            ('sort_seconds', seconds('sort')),
+            ('total_seconds', self.total_seconds),
+            ('peak_rss_bytes', get_peak_rss()),
+            ('forbidden_paths', list(self.forbidden_paths)),
+        ])
+
+    def count_syscall(self, name, num=1):
+        self.syscalls[name] = self.syscalls.get(name, 0) + num
+        if self._stack:
+            stage_syscalls = self._stack[-1].syscalls
+            stage_syscalls[name] = stage_syscalls.get(name, 0) + num
+
+    def _charge_time(self):
+        now = self._clock()
+        if self._stack:
+            self._stack[-1].seconds += now - self._last_time
+        self._last_time = now
+
+
+def get_active():
+    """:return: QueryStats active in the current thread or None."""
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def activated(stats):
+    """
+    Make `stats` active in the current thread: filesystem calls will be counted into it.
+    """
+    previous = get_active()
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+
+def count(syscall, num=1):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.count_syscall(syscall, num)
+
+
+def count_entries(num):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.entries_seen += num
+
+
+def add_forbidden_path(path):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.forbidden_paths.append(path)
+
+
+def get_peak_rss():
+    """
+    :return: peak resident set size of the process in bytes or None if it's unknown.
+    """
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # it's in bytes on macOS and in kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return max_rss
+    return max_rss * 1024
+
+
+def format_summary(summary):
+    """
+    :param summary: result of QueryStats.summary()
+    :return: one line summary
+    """
+    parts = []
+    for key, value in summary.viewitems():
+        if key == 'forbidden_paths':
+            value = len(value)
+        elif key.endswith('_seconds'):
+            value = '{:.3f}ms'.format(value * 1000)
+        elif value is None:
+            value = '?'
+        parts.append('{}={}'.format(key, value))
+    return ' '.join(parts)
+
+
+def count_read(num_bytes):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.count_syscall('read')
+        stats.bytes_read += num_bytes
@@ -0,0 +1,227 @@
+"""
+Instrumentation hooks: install a Tracer to get callbacks about planning and execution of queries,
+e.g to report timings to your metrics system.
+
+Only one tracer is installed at a time, it gets callbacks from all threads. When no tracer is
+installed the overhead is one global lookup per query stage and per directory listing.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import contextmanager
+from timeit import default_timer
+import os
+import threading
+
+# rows produced by the scan are reported in batches of this size
+SCAN_BATCH_SIZE = 1024
+
+_tracer = None
+
+
+class Tracer(object):
+    """
+    Base class of tracers. All callbacks do nothing, override the ones you need.
+    Callbacks are called in the thread that runs the query.
+    """
+
+    def plan_built(self, query_string, seconds):
+        """
+        Query was tokenized and parsed (queries found in the plan cache don't trigger it).
+        """
+
+    def query_started(self, prepared_query, directory):
+        """
+        :type prepared_query: lsql.prepared.PreparedQuery
+        """
+
+    def query_finished(self, prepared_query, table):
+        """
+        :type table: lsql.ast.Table or None if the query failed (see `error`)
+        """
+
+    def error(self, query_string, exc):
+        """
+        Planning or execution of the query failed with `exc`. It's reraised after this call.
+        """
+
+    def directory_listed(self, path, num_entries, seconds):
+        """
+        Directory was listed during the scan or during the computation of a directory size.
+        """
+
+    def scan_started(self, query_node, root):
+        """
+        Query started the scan of the files table under the `root` directory.
+
+        :type query_node: lsql.ast.QueryNode
+        """
+
+    def directory_scanned(self, query_node, path, num_entries):
+        """
+        Directory was listed by the scan of the files table of `query_node`. It's called before
+        `directory_listed` of the same listing.
+        """
+
+    def file_read(self, path, num_bytes):
+        """
+        File was read (e.g for the `text` column).
+        """
+
+    def stage_started(self, query_node, stage):
+        """
+        :type query_node: lsql.ast.QueryNode
+        :param stage: one of filter, group, project, sort, limit
+        """
+
+    def stage_finished(self, query_node, stage, num_rows):
+        """
+        :param num_rows: number of rows produced by the stage
+        """
+
+    def rows_produced(self, query_node, stage, num_rows):
+        """
+        Scan (`stage` is 'scan') produced `num_rows` more rows or filter (`stage` is 'filter')
+        matched `num_rows` more rows. Scan is lazy: its rows are produced while the filter
+        stage consumes them, so both are reported after every batch of scanned rows.
+        """
+
+
+def get_tracer():
+    """:return: installed Tracer or None."""
+    return _tracer
+
+
+def install(tracer):
+    """
+    Install `tracer` (None uninstalls the current one).
+
+    :return: previously installed Tracer or None
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = tracer
+    return previous
+
+
+@contextmanager
+def installed(tracer):
+    previous = install(tracer)
+    try:
+        yield tracer
+    finally:
+        install(previous)
+
+
+class TracerGroup(Tracer):
+    """
+    Tracer that passes all callbacks to several tracers.
+    """
+
+    def __init__(self, tracers):
+        self.tracers = list(tracers)
+
+
+def _make_group_callback(name):
+    def callback(self, *args):
+        for tracer in self.tracers:
+            getattr(tracer, name)(*args)
+    callback.__name__ = str(name)
+    return callback
+
+
+for _name in ['plan_built', 'query_started', 'query_finished', 'error', 'directory_listed', 'scan_started',
+              'directory_scanned', 'file_read', 'stage_started', 'stage_finished', 'rows_produced']:
+    setattr(TracerGroup, _name, _make_group_callback(_name))
+del _name
+
+
+class ChromeTracer(Tracer):
+    """
+    Tracer that collects events in the Chrome trace event format. Dump them with `dump`
+    and open the file in chrome://tracing or https://ui.perfetto.dev
+    """
+
+    def __init__(self, clock=default_timer):
+        self._clock = clock
+        self._start = clock()
+        self._pid = os.getpid()
+        # list.append is atomic, so events can be added from many threads without a lock
+        self.events = []
+        self._rows = {}  # (id(query_node), stage) -> rows produced so far
+
+    def plan_built(self, query_string, seconds):
+        self._add_complete('plan', 'plan', seconds, query=query_string)
+
+    def query_started(self, prepared_query, directory):
+        self._add('B', 'query', 'query', query=prepared_query.query_string, directory=directory)
+
+    def query_finished(self, prepared_query, table):
+        if table is None:
+            self._add('E', 'query', 'query')
+        else:
+            self._add('E', 'query', 'query', rows=len(table))
+
+    def error(self, query_string, exc):
+        self._add('i', 'error', 'query', scope='t', error=repr(exc))
+
+    def directory_listed(self, path, num_entries, seconds):
+        self._add_complete('listdir', 'fs', seconds, path=path, entries=num_entries)
+
+    def stage_started(self, query_node, stage):
+        self._add('B', stage, 'stage')
+
+    def stage_finished(self, query_node, stage, num_rows):
+        self._add('E', stage, 'stage', rows=num_rows)
+
+    def rows_produced(self, query_node, stage, num_rows):
+        key = (id(query_node), stage)
+        total = self._rows[key] = self._rows.get(key, 0) + num_rows
+        self._add('C', '{} rows'.format(stage), 'stage', rows=total)
+
+    def dump(self, fileobj):
+        import json
+        json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, fileobj)
+
+    def save(self, path):
+        with open(path, 'w') as fileobj:
+            self.dump(fileobj)
+
+    def _add(self, phase, name, category, scope=None, **args):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': phase,
+            'ts': self._get_timestamp(self._clock()),
+            'pid': self._pid,
+            'tid': threading.current_thread().ident,
+            'args': _get_json_args(args),
+        }
+        if scope is not None:
+            event['s'] = scope
+        self.events.append(event)
+
+    def _add_complete(self, name, category, seconds, **args):
+        now = self._clock()
+        self.events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': self._get_timestamp(now - seconds),
+            'dur': seconds * 1e6,
+            'pid': self._pid,
+            'tid': threading.current_thread().ident,
+            'args': _get_json_args(args),
+        })
+
+    def _get_timestamp(self, time):
+        """:return: microseconds since the creation of the tracer."""
+        return (time - self._start) * 1e6
+
+
+def _get_json_args(args):
+    json_args = {}
+    for name, value in args.viewitems():
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        json_args[name] = value
+    return json_args
@@ -1,6 +1,16 @@
+import io
+import os
+import re
+
 from setuptools import find_packages, setup
 
-import lsql
+
+def get_version():
+    # importing lsql would require its dependencies to be installed before setup.py is run
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lsql', '__init__.py')
+    with io.open(path, encoding='utf-8') as fileobj:
+        return re.search(r"^__version__ = '([^']+)'", fileobj.read(), re.M).group(1)
+
 
 setup(
     name='lsql',
@@ -8,12 +18,16 @@ setup(
         'colorama',
         'pyparsing',
     ],
-    version=lsql.get_version(),
+    extras_require={
+        # Table.to_numpy()
+        'numpy': ['numpy'],
+    },
+    version=get_version(),
     entry_points={
         'console_scripts': [
             'lsql = lsql.main:main'
         ],
     },
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     author='Alexander Ershov',
 )
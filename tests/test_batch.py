@@ -0,0 +1,125 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from lsql import ast
+from lsql import batch
+from lsql import main
+from lsql import prepared
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+QUERIES = [
+    "select name where size > 15",
+    "select name where size > 15 and mtime > 0",
+    "select name where size >= 19 or name = 'LICENSE'",
+    "select name where size = 13.0",
+    "select name where size <> 13",
+    "select name where size between 13 and 19",
+    "select name where size in (13, 81)",
+    "select name where size in (19, 'x')",
+    "select name where ext in ('py', 'md')",
+    "select name where size - 1 > 12 and -size < -14",
+    "select name where size * 2.5 > 40",
+    # results overflow int64
+    "select name where size + 9223372036854775800 > 9223372036854775807",
+    "select name where 0 - size - 9223372036854775800 < -9223372036854775807",
+    "select name where -(size - 9223372036854775807 - 100) > 0",
+    "select name where size / 2 = 6",
+    "select name where size % 2 = 1",
+    "select name where name like '%.py' or depth = 1",
+    "select name where text like '%License%' or size > 80",
+    "select name where name in (select name where size > 15)",
+    "select name where size > :min_size",
+    "select name where null",
+    "select name where size > 100",
+    "select name where 1",
+    "select name where text like '%a%' and size < 20",
+    "select name where hardlinks > 0 and inode > 0 and device >= 0 and atime > 0 and ctime > 0",
+    "select count(*), sum(size), max(size), min(mtime), avg(size)",
+    "select count(*), max(mtime), min(mtime) where type = 'dir'",
+    "select count(*), sum(size) where size > 100",
+    "select sum(size > 15), count(name), max(name), avg(depth)",
+    "select count(*), max(size + 1) order by count(*)",
+    "select type, count(*) group by type",
+    "select name, size order by size desc limit 2",
+]
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(batch, 'numpy', None)
+    return request.param
+
+
+def execute(query, **kwargs):
+    query = prepared.prepare(query, prepared.PlanCache())
+    params = {'min_size': 15} if query.param_names else None
+    table = query.execute(BASE_DIR, params=params, **kwargs)
+    return [[(type(value), value) for value in row] for row in table.rows]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+@pytest.mark.parametrize('batch_size', [1, 3, batch.DEFAULT_BATCH_SIZE])
+def test_batch_is_the_same_as_row_by_row(backend, query, batch_size):
+    expected = execute(query)
+    actual = execute(query, batch_size=batch_size)
+    assert sorted(actual) == sorted(expected)
+
+
+def test_and_evaluates_only_matching_rows(backend):
+    query = prepared.prepare("select name where ext = 'py' and text like '%import%'", prepared.PlanCache())
+    table = query.execute(BASE_DIR, collect_stats=True, batch_size=batch.DEFAULT_BATCH_SIZE)
+    assert table.stats.summary()['files_opened'] == 1
+
+
+def test_numeric_columns_are_arrays():
+    numpy = pytest.importorskip('numpy')
+    rows = list(ast.FUNCTIONS['files'](BASE_DIR))
+    record_batch = batch.RecordBatch(rows)
+    assert isinstance(record_batch.get_column('size'), numpy.ndarray)
+    assert record_batch.get_column('mtime').dtype == numpy.int64
+    assert isinstance(record_batch.get_column('name'), list)
+    evaluate = batch.compile_node(ast.FunctionNode.create('>', [ast.NameNode.create('size'), ast.ValueNode.create(15)]))
+    assert isinstance(evaluate(record_batch, ast.BUILTIN_CONTEXT), numpy.ndarray)
+
+
+@pytest.mark.parametrize('query', ['select sum(size)', "select sum(size), max(mtime) where name <> 'x'"])
+def test_aggregates_of_projected_rows_use_arrays(monkeypatch, query):
+    pytest.importorskip('numpy')
+    arrays = []
+    original = ast.SumAggregate.add_array
+
+    def add_array(self, array, wrap=None):
+        arrays.append(array)
+        return original(self, array, wrap)
+
+    monkeypatch.setattr(ast.SumAggregate, 'add_array', add_array)
+    assert execute(query, batch_size=batch.DEFAULT_BATCH_SIZE) == execute(query)
+    assert len(arrays) == 1
+
+
+@pytest.mark.parametrize('batch_size', [0, -1])
+def test_invalid_batch_size(batch_size):
+    with pytest.raises(ast.InvalidBatchSizeError):
+        execute('select name', batch_size=batch_size)
+
+
+@pytest.mark.parametrize('batch_size', ['0', '-1', 'x'])
+def test_invalid_batch_size_argument(capsys, batch_size):
+    with pytest.raises(SystemExit):
+        main.main(['--batch-size', batch_size, 'select name', BASE_DIR])
+    assert '--batch-size' in capsys.readouterr()[1]
+
+
+def test_take():
+    rows = list(ast.FUNCTIONS['files'](BASE_DIR))
+    record_batch = batch.RecordBatch(rows)
+    sizes = list(record_batch.get_column('size'))
+    taken = record_batch.take([2, 0])
+    assert taken.rows == [rows[2], rows[0]]
+    assert list(taken.get_column('size')) == [sizes[2], sizes[0]]
+    assert len(record_batch.take([])) == 0
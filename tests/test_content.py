@@ -0,0 +1,178 @@
+# coding: utf-8
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+import pytest
+
+from lsql import ast
+from lsql import main
+from lsql import parser
+from lsql import stats
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+CHUNK_SIZE = ast.CONTENT_CHUNK_SIZE
+
+
+@pytest.fixture
+def big_file(tmpdir):
+    """File of 3 chunks, 'Needle' crosses the border of the first two chunks."""
+    data = (b'first line\n' + b'x' * (CHUNK_SIZE - 14) + b'Needle\n' + b'y' * (2 * CHUNK_SIZE - 10) +
+            b'last line')
+    path = tmpdir.join('big.log')
+    path.write_binary(data)
+    return str(path), data
+
+
+@pytest.mark.parametrize('function_name, pattern', [
+    ('like', '%Needle%'),
+    ('like', '%needle%'),
+    ('ilike', '%needle%'),
+    ('like', '%absent%'),
+    ('like', 'first line%'),
+    ('like', 'second line%'),
+    ('like', '%last line'),
+    ('ilike', '%LAST LINE'),
+    ('like', '%line'),
+    ('like', 'first line'),
+    ('like', '%Needle_%'),
+    ('rlike', '.*Needle.*last line'),
+    ('rilike', 'FIRST.*'),
+    ('rlike', 'y+'),
+])
+def test_file_is_matched_like_text(big_file, function_name, pattern):
+    path, data = big_file
+    matcher = ast.FUNCTIONS[function_name].bind_constant(pattern)
+    assert matcher.match_file(path) == matcher(data)
+
+
+@pytest.mark.parametrize('function_name, pattern, matches', [
+    ('ilike', '%ärger%', True),
+    ('ilike', 'first ärger%', True),
+    ('ilike', '%ÄRGER LAST', True),
+    ('rilike', '.*ärger.*', True),
+    ('ilike', '%ärgerz%', False),
+])
+def test_big_file_is_matched_ignoring_case_of_non_ascii(tmpdir, function_name, pattern, matches):
+    # 'Ä' crosses the border of the chunks
+    data = ('First Ärger' + 'x' * (CHUNK_SIZE - 13) + 'Ärger' + 'y' * CHUNK_SIZE + 'Ärger last').encode('utf-8')
+    path = tmpdir.join('big.txt')
+    path.write_binary(data)
+    matcher = ast.FUNCTIONS[function_name].bind_constant(pattern)
+    assert matcher.match_file(str(path)) is matches
+    assert matcher(data) is matches
+
+
+def test_small_file_is_matched_like_text():
+    path = os.path.join(BASE_DIR, 'small.py')
+    matcher = ast.compile_like('%division%')
+    assert matcher.match_file(path) is True
+
+
+def test_reading_stops_at_match(big_file):
+    path, data = big_file
+    query_stats = stats.QueryStats()
+    with stats.activated(query_stats):
+        assert ast.compile_like('%first%').match_file(path)
+        assert ast.compile_like('%line').match_file(path)
+    assert query_stats.bytes_read == CHUNK_SIZE + len('line')
+
+
+@pytest.mark.parametrize('query, node_class', [
+    ("select name where text like '%License%'", ast.ContentMatchNode),
+    ("select name where TEXT rlike 'Some.*'", ast.ContentMatchNode),
+    ("select name where lines like '%License%'", ast.ContentMatchNode),
+    # a line can't be matched without splitting the text into lines
+    ("select name where lines like 'Some%'", ast.BoundFunctionNode),
+    ("select name where name like '%License%'", ast.BoundFunctionNode),
+])
+def test_content_match_node(query, node_class):
+    assert type(parser.parse(parser.tokenize(query)).where_node) is node_class
+
+
+@pytest.mark.parametrize('query, expected_results', [
+    ("select name where text like '%License%'", [('LICENSE',)]),
+    ("select name where text ilike '%LICENSE%' order by name", [('LICENSE',)]),
+    ("select name where lines like '%return%'", [('small.py',)]),
+    ("select name where text rlike '.*return x.*'", [('small.py',)]),
+    # directories have no text
+    ("select name, text like '%' where type = 'dir'", [('small', ast.NULL)]),
+    ("select name, text like '%License%' order by name limit 1", [('LICENSE', True)]),
+    ("select name, text like '%License%' where type = 'file' order by name", [
+        ('LICENSE', True), ('README.md', False), ('small.py', False)]),
+    ("select text, text like '%License%' where name = 'LICENSE'", [(b'Some License\n', True)]),
+    ("select count(*), text like '%License%' group by text like '%License%' order by 2",
+     [(1, ast.NULL), (1, True), (2, False)]),
+])
+def test_content_queries(query, expected_results):
+    assert list(main.run_query(query, str(BASE_DIR))) == expected_results
+
+
+def test_selected_content_match_streams_the_file(big_file):
+    path, data = big_file
+    query_string = "select name, text like '%first%'"
+    analysis = parser.parse(parser.tokenize(query_string)).analysis
+    assert [node.name for node in analysis.projected_name_nodes] == ['name']
+    assert analysis.deferred_name_nodes == []
+    assert [type(node) for node in analysis.content_match_nodes] == [ast.ContentMatchNode]
+    table = main.run_query(query_string, os.path.dirname(path), collect_stats=True)
+    assert list(table) == [('big.log', True)]
+    assert table.stats.bytes_read == CHUNK_SIZE
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'one',
+    b'one\n',
+    b'one\ntwo',
+    b'\n\n',
+    b'one\r\ntwo\rthree\n\rfour\r',
+    b'\r\n\r\n\r',
+])
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, ast.CONTENT_CHUNK_SIZE])
+def test_count_lines(tmpdir, data, chunk_size):
+    path = tmpdir.join('file')
+    path.write_binary(data)
+    with ast.FileContent(str(path)) as content:
+        assert content.count_lines(chunk_size) == len(data.splitlines())
+
+
+@pytest.mark.parametrize('data', [b'', b'one', b'one\r\ntwo\rthree\n\rfour\r\n', b'\n\n'])
+def test_lazy_lines(tmpdir, data):
+    path = tmpdir.join('file')
+    path.write_binary(data)
+    expected = data.splitlines()
+    lines = ast.LazyLines(str(path))
+    assert len(lines) == len(expected)
+    assert list(lines) == expected
+    assert lines == expected
+    assert [lines[i] for i in range(-len(expected), len(expected))] == expected * 2
+    assert lines[1:] == expected[1:]
+    with pytest.raises(IndexError):
+        lines[len(expected)]
+    assert unicode(lines) == unicode(expected)
+
+
+def test_length_of_lines_doesnt_read_text(big_file):
+    path, data = big_file
+    lines = ast.LazyLines(path)
+    assert len(lines) == len(data.splitlines())
+    assert lines._text is None
+
+
+@pytest.mark.parametrize('query, expected_results', [
+    ('select name, line_count, length(lines) order by name', [
+        ('LICENSE', 1, 1),
+        ('README.md', 1, 1),
+        ('small', ast.NULL, ast.NULL),
+        ('small.py', 4, 4),
+    ]),
+    ("select lines where name = 'small.py'", [
+        ([b'from __future__ import division, print_function', b'', b'def add(x, y):', b'    return x + y'],),
+    ]),
+    ('select sum(line_count)', [(6,)]),
+])
+def test_lines_columns(query, expected_results):
+    assert list(main.run_query(query, str(BASE_DIR))) == expected_results
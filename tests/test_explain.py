@@ -0,0 +1,124 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import re
+
+import pytest
+
+from lsql import ast
+from lsql import explain
+from lsql import main
+from lsql import parser
+from lsql import serialization
+from lsql import stats
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+def get_plan(query):
+    return [row.plan for row in main.run_query(query, BASE_DIR)]
+
+
+def test_explain():
+    assert get_plan("explain select name, size where name like '%.py' order by size desc limit 2") == [
+        'Project: name, size',
+        '  Limit: offset=0 limit=2',
+        '    Sort: size DESC',
+        "      Filter: (name like '%.py') [endswith]",
+        '        Scan: files(cwd)',
+    ]
+
+
+def test_explain_deferred_columns():
+    plan = get_plan('explain select name, owner, text order by name limit 1')
+    assert plan[0] == 'Project: name, owner, text [deferred: owner, text]'
+    # without LIMIT all rows are projected anyway
+    assert get_plan('explain select name, owner order by name')[0] == 'Project: name, owner'
+    # rows keep their files for the content match, so owner is deferred too
+    assert get_plan("explain select owner, text like '%x%'")[0] == (
+        "Project: owner, (text like '%x%') [contains, streamed] [deferred: owner]")
+
+
+def test_explain_group_by():
+    # aggregates in SELECT and in HAVING are computed separately
+    assert get_plan('explain select ext, count(*) group by ext having count(*) > 1') == [
+        'Limit: offset=0 limit=inf',
+        '  Sort: (none)',
+        '    Group: keys=ext aggregates=count(1), count(1) having=(count(1) > 1) columns=ext, count(1)',
+        '      Filter: true',
+        '        Scan: files(cwd)',
+    ]
+
+
+def test_explain_subquery():
+    plan = get_plan('explain select name where name in (select name where size > 13)')
+    assert plan[3] == '      Filter: (name in (SubPlan 1, materialized once))'
+    assert plan[5:] == [
+        'SubPlan 1',
+        '  Project: name',
+        '    Limit: offset=0 limit=inf',
+        '      Sort: (none)',
+        '        Filter: (size > 13)',
+        '          Scan: files(cwd)',
+    ]
+
+
+@pytest.mark.parametrize('condition, operator', [
+    ("name like 'small%'", 'startswith'),
+    ("name ilike '%ALL%'", 'contains'),
+    ("name like 's_all'", 'regex'),
+    ("name rlike 's.*'", 'regex'),
+    ("ext in ('py', 'md')", 'hash set of 2 values'),
+    ('ext in (name, dir)', 'linear scan'),
+    ('name like :pattern', 'pattern compiled per row'),
+])
+def test_explain_shows_chosen_operators(condition, operator):
+    query_node = parser.parse(parser.tokenize('explain select name where ' + condition))
+    plan = [row[0] for row in query_node.get_value(ast.BUILTIN_CONTEXT).rows]
+    assert plan[3].endswith('[{}]'.format(operator))
+
+
+def test_explain_analyze():
+    plan = get_plan("explain analyze select name where text like '%License%'")
+    stages = [line.split(':')[0].strip() for line in plan]
+    assert stages == ['Project', 'Limit', 'Sort', 'Filter', 'Scan', 'Total']
+    assert 'rows_in=4 rows_out=1' in plan[3]
+    # 3 files are read, directory `small` has no text
+    assert 'open=3' in plan[3]
+    assert 'rows_out=4' in plan[4]
+    assert 'listdir=2' in plan[4]
+    assert plan[5].startswith('Total: rows=1 time=')
+
+
+def test_explain_analyze_times_are_exclusive():
+    plan = get_plan('explain analyze select name where name in (select name where size > 13)')
+    total = _parse_ms(plan[-1])
+    stages = sum(_parse_ms(line) for line in plan[:-1] if 'time=' in line)
+    assert stages <= total
+
+
+def _parse_ms(line):
+    return float(re.search(r'time=([\d.]+)ms', line).group(1))
+
+
+def test_never_executed_subquery():
+    plan = get_plan('explain analyze select name where size > 1000 and name in (select name)')
+    assert plan[-2].endswith('(never executed)')
+
+
+def test_syscalls_are_counted_only_in_active_stats():
+    query_stats = stats.QueryStats()
+    with stats.activated(query_stats):
+        assert list(main.run_query('select name', BASE_DIR))
+    assert query_stats.syscalls['listdir'] == 2
+    assert query_stats.syscalls['lstat'] >= 4
+    assert stats.get_active() is None
+    stats.count('lstat')
+    assert query_stats.syscalls['lstat'] < 100
+
+
+def test_explain_node_is_serializable():
+    query_node = parser.parse(parser.tokenize('explain analyze select name'))
+    loaded = serialization.loads(serialization.dumps(query_node))
+    assert isinstance(loaded, explain.ExplainNode)
+    assert loaded.analyze
+    assert loaded == query_node
@@ -0,0 +1,141 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gc
+import hashlib
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from lsql import ast
+from lsql import hashes
+from lsql import main
+from lsql import stats
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+@pytest.fixture(autouse=True)
+def cache_path(tmpdir, monkeypatch):
+    path = str(tmpdir.join('cache', 'hashes.sqlite'))
+    monkeypatch.setattr(hashes, 'DEFAULT_CACHE_PATH', path)
+    return path
+
+
+def run_query(query, directory=BASE_DIR):
+    query_stats = stats.QueryStats()
+    with stats.activated(query_stats):
+        results = list(main.run_query(query, str(directory)))
+    return results, query_stats
+
+
+def get_digest(path, algorithm):
+    with open(path, 'rb') as fileobj:
+        return hashlib.new(algorithm, fileobj.read()).hexdigest()
+
+
+@pytest.mark.parametrize('thread_min_size', [0, hashes.THREAD_MIN_SIZE])
+def test_hash_columns(monkeypatch, thread_min_size):
+    monkeypatch.setattr(hashes, 'THREAD_MIN_SIZE', thread_min_size)
+    results, _ = run_query('select name, fullpath, md5, sha1, sha256 order by name')
+    assert [row.name for row in results] == ['LICENSE', 'README.md', 'small', 'small.py']
+    for row in results:
+        path = row.fullpath
+        if os.path.isdir(path):
+            assert (row.md5, row.sha1, row.sha256) == (ast.NULL, ast.NULL, ast.NULL)
+        else:
+            assert (row.md5, row.sha1, row.sha256) == tuple(
+                get_digest(path, algorithm) for algorithm in ['md5', 'sha1', 'sha256'])
+
+
+def test_unchanged_files_are_not_read_again():
+    expected, first_stats = run_query('select name, sha256 order by name')
+    assert first_stats.syscalls['open'] == 3
+    results, second_stats = run_query('select name, sha256 order by name')
+    assert results == expected
+    assert second_stats.syscalls.get('open', 0) == 0
+
+
+def test_changed_file_is_hashed_again(tmpdir):
+    path = tmpdir.join('tree', 'file.txt')
+    path.write_binary(b'old content', ensure=True)
+    directory = tmpdir.join('tree')
+    assert run_query('select md5', directory)[0] == [(get_digest(str(path), 'md5'),)]
+    path.write_binary(b'new content')
+    os.utime(str(path), (0, 0))
+    results, query_stats = run_query('select md5', directory)
+    assert results == [(get_digest(str(path), 'md5'),)]
+    assert query_stats.syscalls['open'] == 1
+
+
+def test_hashes_are_filtered():
+    digest = get_digest(os.path.join(BASE_DIR, 'small.py'), 'sha1')
+    results, _ = run_query("select name where sha1 = '{}'".format(digest))
+    assert results == [('small.py',)]
+
+
+@pytest.mark.parametrize('query, num_digests', [
+    # digests are computed after the scan is over
+    ('select name, md5 order by name limit 2', 2),
+    ("select name where md5 = ''", 3),
+    ('select md5, count(*) group by md5', 3),
+])
+def test_cache_is_closed_after_query(cache_path, monkeypatch, query, num_digests):
+    caches = []
+
+    def get_default_cache():
+        caches.append(hashes.HashCache(cache_path))
+        return caches[-1]
+
+    monkeypatch.setattr(hashes, 'get_default_cache', get_default_cache)
+    gc.disable()
+    try:
+        run_query(query)
+        # `caches` keeps the cache alive, so only the query could close it
+        assert len(caches) == 1 and caches[0]._connection is None
+        connection = sqlite3.connect(cache_path)
+        try:
+            assert connection.execute('SELECT COUNT(*) FROM hashes').fetchone()[0] == num_digests
+        finally:
+            connection.close()
+    finally:
+        gc.enable()
+
+
+def test_prefetch_looks_up_cache_once(monkeypatch):
+    monkeypatch.setattr(hashes, 'THREAD_MIN_SIZE', 0)
+    num_threads = threading.active_count()
+    expected, _ = run_query('select name, md5 order by name')
+    # worker threads are joined
+    assert threading.active_count() == num_threads
+    lookups = []
+    get = hashes.HashCache.get
+
+    def counting_get(self, key, algorithm):
+        lookups.append(key)
+        return get(self, key, algorithm)
+
+    monkeypatch.setattr(hashes.HashCache, 'get', counting_get)
+    results, query_stats = run_query('select name, md5 order by name')
+    assert results == expected
+    assert query_stats.syscalls.get('open', 0) == 0
+    assert len(lookups) == 3
+
+
+def test_cache_is_optional(tmpdir, monkeypatch):
+    not_a_directory = tmpdir.join('file')
+    not_a_directory.write('')
+    monkeypatch.setattr(hashes, 'DEFAULT_CACHE_PATH', str(not_a_directory.join('hashes.sqlite')))
+    results, _ = run_query("select md5 where name = 'LICENSE'")
+    assert results == [(get_digest(os.path.join(BASE_DIR, 'small', 'LICENSE'), 'md5'),)]
+
+
+def test_cache_keeps_one_digest_per_file(cache_path):
+    cache = hashes.HashCache(cache_path)
+    cache.put((1, 2, 3, 4), 'md5', 'old')
+    cache.put((1, 2, 5, 6), 'md5', 'new')
+    assert cache.get((1, 2, 3, 4), 'md5') is None
+    assert cache.get((1, 2, 5, 6), 'md5') == 'new'
+    assert cache.get((1, 2, 5, 6), 'sha1') is None
+    cache.close()
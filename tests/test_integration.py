@@ -17,6 +17,8 @@ NON_ASCII_PATHS_DIR = pytest.get_fixture_dir('non-ascii-paths')
     'select 1',
     "select fullpath || 'oops' where size > 0kb and ext != 'py'",
     'select name group by name',
+    'explain select name',
+    "explain analyze select name where name in (select name where ext = 'py')",
 ])
 def test_good_select(query):
     assert run_query(query) == 0
@@ -43,6 +45,16 @@ def test_good_select(query):
     'select 3 + from',
     # UnexpectedEndError
     'select 3 +',
+    # UnknownFunctionError
+    'select unknown_function(name)',
+    # WrongNumberOfArgumentsError
+    'select length(name, name)',
+    # InvalidPatternError
+    "where name rlike '('",
+    # IllegalSubqueryError
+    'where name in (select name, size)',
+    # MissingParameterError: parameters are for prepared queries
+    'where size > :min_size',
 ])
 def test_bad_select(query):
     assert run_query(query) == 1
@@ -8,7 +8,7 @@ os.environ['LSCOLORS'] = ''
 from colorama import Fore
 import pytest
 
-import lsql
+from lsql import legacy as lsql
 
 DIR = os.path.join(os.path.dirname(__file__), 'data', 'base')
 
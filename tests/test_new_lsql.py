@@ -3,11 +3,14 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 # TODO(aershov182): when done, replace test_lsql with this file
+import os
+
 import pytest
 
 from lsql import ast
 from lsql import main
 from lsql import parser
+from lsql import stats
 
 BASE_DIR = pytest.get_fixture_dir('base')
 
@@ -197,7 +200,11 @@ def test_group_by_order_by(query, expected_results):
         ('small.py',),
         ('README.md',),
     ]),
+    # sizes are equal, rows keep the order of the scan
     ('select name order by size limit 1', [
+        ('small',)
+    ]),
+    ('select name order by size, name limit 1', [
         ('LICENSE',)
     ]),
     ('select name order by length(lines) DESC, name ASC', [
@@ -234,6 +241,224 @@ def test_illegal_group_by(query):
         get_results(query)
 
 
+@pytest.mark.parametrize('query, expected_results', [
+    ("select name where name like 'small%'", [('small',), ('small.py',)]),
+    ("select name where name like '%.py'", [('small.py',)]),
+    ("select name where name like '%a%'", [('small',), ('small.py',)]),
+    ("select name where name like 'LICENSE'", [('LICENSE',)]),
+    ("select name where name like 'sm_ll'", [('small',)]),
+    ("select name where name like 'SMALL%'", []),
+    ("select name where name ilike 'SMALL%'", [('small',), ('small.py',)]),
+    ("select name where name ilike '%.PY'", [('small.py',)]),
+    ("select name where name rlike 'sm.ll'", [('small',)]),
+    ("select name where name rlike 'sm'", []),
+    ("select name where name like_regex '.*md'", [('README.md',)]),
+    ("select name where name rilike 'R.*MD'", [('README.md',)]),
+    ("select name where text like '%nice!%'", [('README.md',)]),
+    ("select name where lines like '%return x + y'", [('small.py',)]),
+    # pattern is not a constant
+    ("select name where name like no_ext || '%'", [
+        ('small',), ('small.py',), ('LICENSE',), ('README.md',),
+    ]),
+    # LIKE with NULL is NULL
+    ("select name where text like '%'", [('small.py',), ('LICENSE',), ('README.md',)]),
+    ("select name where name like NULL", []),
+], ids=idfn)
+def test_like(query, expected_results):
+    assert_same_items(
+        get_results(query),
+        expected_results,
+    )
+
+
+@pytest.mark.parametrize('condition, matches', [
+    ("name like 'Är%'", True),
+    ("name ilike 'är%'", True),
+    ("name ilike '%RGER.TXT'", True),
+    ("name ilike 'ärger.txt'", True),
+    ("name ilike '_rger.txt'", True),
+    ("name rilike 'är.*'", True),
+    ("name like 'är%'", False),
+])
+def test_like_non_ascii_names(tmpdir, condition, matches):
+    # file system encoding of the tests isn't known, so the name is created as UTF-8 bytes
+    open(os.path.join(str(tmpdir), 'Ärger.txt'.encode('utf-8')), 'w').close()
+    results = list(main.run_query('select name where {}'.format(condition), str(tmpdir)))
+    assert results == ([('Ärger.txt'.encode('utf-8'),)] if matches else [])
+
+
+@pytest.mark.parametrize('pattern, method', [
+    ('foo%', 'startswith'),
+    ('%.log', 'endswith'),
+    ('%x%', 'contains'),
+    ('foo', 'equals'),
+])
+def test_like_fast_paths(pattern, method):
+    matcher = ast.compile_like(pattern)
+    assert isinstance(matcher, ast.SubstringMatcher)
+    assert matcher.method == method
+
+
+@pytest.mark.parametrize('pattern', [
+    'f_o%',
+    '%foo%bar%',
+    'foo%bar',
+])
+def test_like_regex_path(pattern):
+    assert isinstance(ast.compile_like(pattern), ast.RegexMatcher)
+
+
+def test_like_pattern_is_compiled_at_plan_time():
+    query = parser.parse(parser.tokenize("select name where name like '%.py'"))
+    assert isinstance(query.where_node, ast.BoundFunctionNode)
+    assert query.where_node.bound == ast.compile_like('%.py')
+
+
+@pytest.mark.parametrize('query, expected_results', [
+    ("select name where ext in ('py', 'md', 'txt')", [('small.py',), ('README.md',)]),
+    ("select name where name in ('тест.txt')", []),
+    ("select name where size in (NULL)", []),
+    ('select name where depth in (1)', [('LICENSE',)]),
+    ("select name where name in (select name where type = 'dir')", [('small',)]),
+    ("select name where name in (select no_ext || '.py' where type = 'dir')", [('small.py',)]),
+    ('select name where name in (select name where depth > 100)', []),
+    ("select name where no_ext in (select name from '{}')".format(BASE_DIR), [
+        ('LICENSE',), ('small',), ('small.py',),
+    ]),
+], ids=idfn)
+def test_in(query, expected_results):
+    assert_same_items(
+        get_results(query),
+        expected_results,
+    )
+
+
+def test_non_ascii_in():
+    assert get_results("select name where name in ('тест.txt')",
+                       directory=pytest.get_fixture_dir('non-ascii-paths')) == [(b'тест.txt',)]
+
+
+def test_constant_in_list_is_hashed_at_plan_time():
+    query = parser.parse(parser.tokenize("select name where ext in ('py', 'md')"))
+    assert isinstance(query.where_node, ast.BoundFunctionNode)
+    assert query.where_node.bound == ast.ValueSet(['py', 'md'])
+
+
+def test_huge_or_query():
+    query = _parse_repeated("select name where name = 'small.py'", " or name = 'LICENSE'", '', 5000)
+    # chain of ORs is a single node, so there's no deep recursion during planning and evaluation
+    assert len(query.where_node.children) == 5001
+    assert_same_items(_execute(query), [('small.py',), ('LICENSE',)])
+
+
+def test_huge_in_query():
+    query = _parse_repeated("select name where name in ('small.py'", ", 'LICENSE'", ')', 5000)
+    assert len(query.where_node.children[1].children) == 5001
+    assert_same_items(_execute(query), [('small.py',), ('LICENSE',)])
+
+
+def _parse_repeated(prefix, repeated, suffix, times):
+    """Parse query `prefix + repeated * times + suffix`."""
+    return parser.parse(parser.tokenize(prefix + repeated * times + suffix))
+
+
+def _execute(query):
+    return query.get_value(ast.CombinedContext(ast.Context({'cwd': str(BASE_DIR)}), ast.BUILTIN_CONTEXT))
+
+
+def test_function_names_are_case_insensitive():
+    assert get_results('select SUM(LENGTH(lines)), Count(*)') == [(6, 4)]
+
+
+@pytest.mark.parametrize('query, exc_class', [
+    ('select unknown_function(name)', ast.UnknownFunctionError),
+    ('select length(name, name)', ast.WrongNumberOfArgumentsError),
+    ('select sum(size, size)', ast.WrongNumberOfArgumentsError),
+])
+def test_functions_are_resolved_at_parse_time(query, exc_class):
+    # error is raised before any file is visited
+    with pytest.raises(exc_class):
+        parser.parse(parser.tokenize(query))
+
+
+def test_projected_columns():
+    query = parser.parse(parser.tokenize(
+        'select name, count(*) where depth = 0 group by name, ext having max(size) > 0 order by count(*)'))
+    # `depth` is used only in WHERE, `name` is projected once
+    assert [node.name for node in query.analysis.projected_name_nodes] == ['name', 'ext', 'size']
+
+
+@pytest.mark.parametrize('query, expected_results', [
+    ("select ext, sum(size) where type = 'file' group by ext order by ext", [('', 13), ('md', 19), ('py', 81)]),
+    ("select extension, size where size > 15 order by EXT desc", [('py', 81), ('md', 19)]),
+    ('select count(*) where size > 15', [(2,)]),
+    ('select name where name in (select name where depth = 1) order by size', [('LICENSE',)]),
+])
+def test_projected_rows(query, expected_results):
+    assert get_results(query) == expected_results
+
+
+def test_deferred_columns():
+    query = parser.parse(parser.tokenize('select name, owner, text, size order by size limit 1'))
+    assert [node.name for node in query.analysis.projected_name_nodes] == ['name', 'size']
+    assert [node.name for node in query.analysis.deferred_name_nodes] == ['owner', 'text']
+    grouped = parser.parse(parser.tokenize('select owner, count(*) group by owner limit 1'))
+    assert grouped.analysis.deferred_name_nodes == []
+
+
+@pytest.mark.parametrize('query, num_opened', [
+    ('select name, text order by name limit 1', 1),
+    ('select name, text order by name', 3),
+])
+def test_deferred_columns_are_evaluated_after_limit(query, num_opened):
+    query_stats = stats.QueryStats()
+    with stats.activated(query_stats):
+        results = get_results(query)
+    assert results[0] == ('LICENSE', 'Some License\n')
+    assert query_stats.syscalls['open'] == num_opened
+
+
+def test_owner_names_are_cached():
+    query_stats = stats.QueryStats()
+    with stats.activated(query_stats):
+        results = get_results('select owner order by name desc limit 3')
+    assert len(results) == 3
+    assert query_stats.syscalls['getpwuid'] == 1
+
+
+def test_order_by_parts_are_hashable():
+    parts = parser.parse(parser.tokenize('select name order by size desc, size, size desc')).order_node.children
+    assert hash(parts[0]) == hash(parts[2])
+    assert parts[0] == parts[2] and parts[0] != parts[1]
+    assert len(set(parts)) == 2
+
+
+def test_rows_have_no_dict():
+    stat = ast.Stat.from_path(BASE_DIR, 0)
+    assert not hasattr(stat, '__dict__')
+    assert not hasattr(stat.name, '__dict__')
+    assert not hasattr(ast.OrderByKey([1], [ast.NameNode.create('size')]), '__dict__')
+
+
+def test_rows_share_directories():
+    rows = list(ast._files_table_function(str(BASE_DIR)))
+    assert len(rows) == 4
+    by_name = {row.name: row for row in rows}
+    assert by_name['README.md'].dir is by_name['small.py'].dir
+    assert by_name['README.md'].fulldir is by_name['small'].fulldir
+    assert by_name['LICENSE'].dir == os.path.join(by_name['small'].dir, 'small')
+    assert by_name['LICENSE'].path == os.path.join(by_name['small'].dir, 'small', 'LICENSE')
+    assert by_name['LICENSE'].fullpath == os.path.join(by_name['small'].fulldir, 'small', 'LICENSE')
+
+
+def test_tagged_str():
+    tagged = ast.TaggedStr(b'small', {'dir', 'exec'})
+    assert isinstance(tagged, ast.TaggedStr)
+    assert (tagged, tagged.tags) == (b'small', frozenset(['dir', 'exec']))
+    # tags are shared
+    assert type(ast.TaggedStr(b'other', ['exec', 'dir'])) is type(tagged)
+
+
 def assert_same_items(seq_x, seq_y):
     assert sorted(seq_x) == sorted(seq_y)
 
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+import errno
+import io
+import subprocess
+import sys
+
+import pytest
+
+from lsql import ast
+from lsql import output
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+ROW_TYPE = OrderedDict([('name', unicode), ('size', int), ('mtime', int), ('owner', unicode)])
+
+ROWS = [
+    (ast.TaggedStr(b'a b.py', {'file'}), 10, ast.Timestamp(0), ast.NULL),
+    (ast.TaggedStr(b'tab\t"quoted",', {'file'}), 0, ast.Timestamp(0), 'root'),
+    (ast.TaggedStr('я'.encode('utf-8'), {'dir'}), 2.5, ast.Timestamp(0), 'root'),
+]
+
+TIME = str(ast.Timestamp(0))
+
+
+class BrokenStream(object):
+    def write(self, data):
+        raise IOError(errno.EPIPE, 'Broken pipe')
+
+    def flush(self):
+        pass
+
+
+def write(format_name, rows=ROWS, with_header=True, **kwargs):
+    stream = io.BytesIO()
+    writer = output.get_writer(format_name, stream, **kwargs)
+    output.write_table(writer, ast.Table(ROW_TYPE, rows), with_header)
+    return stream.getvalue()
+
+
+def test_tsv():
+    assert write('tsv') == (
+        b'name\tsize\tmtime\towner\n'
+        b'a b.py\t10\t' + TIME + b'\tNULL\n'
+        b'tab\t"quoted",\t0\t' + TIME + b'\troot\n'
+        b'\xd1\x8f\t2.5\t' + TIME + b'\troot\n'
+    )
+
+
+def test_nul():
+    assert write('nul', with_header=False) == (
+        b'a b.py\t10\t' + TIME + b'\tNULL\0'
+        b'tab\t"quoted",\t0\t' + TIME + b'\troot\0'
+        b'\xd1\x8f\t2.5\t' + TIME + b'\troot\0'
+    )
+
+
+def test_csv():
+    assert write('csv') == (
+        b'name,size,mtime,owner\r\n'
+        b'a b.py,10,' + TIME + b',NULL\r\n'
+        b'"tab\t""quoted"",",0,' + TIME + b',root\r\n'
+        b'\xd1\x8f,2.5,' + TIME + b',root\r\n'
+    )
+
+
+def test_jsonl():
+    assert write('jsonl').decode('utf-8').splitlines() == [
+        '{"name": "a b.py", "size": 10, "mtime": "' + TIME + '", "owner": null}',
+        '{"name": "tab\\t\\"quoted\\",", "size": 0, "mtime": "' + TIME + '", "owner": "root"}',
+        '{"name": "я", "size": 2.5, "mtime": "' + TIME + '", "owner": "root"}',
+    ]
+
+
+def test_colorizer():
+    class Colorizer(object):
+        def colored_column(self, value):
+            return '<{}>'.format(value) if isinstance(value, ast.TaggedStr) else value
+
+    assert write('tsv', rows=ROWS[:1], with_header=True, colorizer=Colorizer()) == (
+        b'name\tsize\tmtime\towner\n<a b.py>\t10\t' + TIME + b'\tNULL\n')
+
+
+def test_buffering():
+    stream = io.BytesIO()
+    writer = output.TsvWriter(stream, buffer_size=10)
+    writer.begin(list(ROW_TYPE))
+    writer.write_row(['a'])
+    assert stream.getvalue() == b''
+    writer.write_row(['b' * 10])
+    assert stream.getvalue() == b'a\n' + b'b' * 10 + b'\n'
+    writer.write_row(['c'])
+    writer.flush()
+    assert stream.getvalue().endswith(b'\nc\n')
+
+
+def test_broken_pipe():
+    writer = output.TsvWriter(BrokenStream())
+    with pytest.raises(output.OutputClosedError):
+        output.write_table(writer, ast.Table(ROW_TYPE, ROWS))
+
+
+def test_closed_stdout():
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'lsql.main', 'select name', BASE_DIR],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    # nobody reads the output, so writing to stdout fails with EPIPE
+    process.stdout.close()
+    err = process.stderr.read()
+    assert (process.wait(), err) == (0, b'')
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 from collections import namedtuple
+import re
 
 import pytest
 
@@ -34,6 +35,7 @@ def add_end_query_token(token_classes):
 # TODO: uncomment make_test_case's when corresponding tokens are implemented
 
 @pytest.mark.parametrize('string, tokens', [
+    make_test_case('analyze', parser.AnalyzeToken),
     make_test_case('and', parser.AndToken),
     # make_test_case('as', parser.AsToken),
     make_test_case('asc', parser.AscToken),
@@ -47,18 +49,19 @@ def add_end_query_token(token_classes):
     # make_test_case('else', parser.ElseToken),
     # make_test_case('end', parser.EndToken),
     # make_test_case('exists', parser.ExistsToken),
+    make_test_case('explain', parser.ExplainToken),
     make_test_case('from', parser.FromToken),
     # make_test_case('group', parser.GroupToken),
     # make_test_case('having', parser.HavingToken),
     # make_test_case('icontains', parser.IcontainsToken),
-    # make_test_case('ilike', parser.IlikeToken),
+    make_test_case('ilike', parser.IlikeToken),
     make_test_case('in', parser.InToken),
     # make_test_case('is', parser.IsToken),
     # make_test_case('isnull', parser.IsNullToken),
     # make_test_case('join', parser.JoinToken),
     # make_test_case('left', parser.LeftToken),
-    # make_test_case('like', parser.LikeToken),
-    # make_test_case('like_regex', parser.LikeRegexToken),
+    make_test_case('like', parser.LikeToken),
+    make_test_case('like_regex', parser.LikeRegexToken),
     make_test_case('limit', parser.LimitToken),
     # make_test_case('not', parser.NotToken),
     # make_test_case('notnull', parser.NotNullToken),
@@ -67,8 +70,8 @@ def add_end_query_token(token_classes):
     make_test_case('or', parser.OrToken),
     make_test_case('order', parser.OrderToken),
     # make_test_case('outer', parser.OuterToken),
-    # make_test_case('rilike', parser.RilikeToken),
-    # make_test_case('rlike', parser.RlikeToken),
+    make_test_case('rilike', parser.RilikeToken),
+    make_test_case('rlike', parser.RlikeToken),
     make_test_case('select', parser.SelectToken),
     # make_test_case('then', parser.ThenToken),
     # make_test_case('update', parser.UpdateToken),
@@ -222,6 +225,46 @@ def test_bad_queries(string):
         list(parser.tokenize(string))
 
 
+@pytest.mark.parametrize('string, expected_token_classes', [
+    # keywords are case-insensitive
+    ('SeLeCt', add_end_query_token([parser.SelectToken])),
+    # names that start with a keyword
+    ('selection order_by like_regexp', add_end_query_token([parser.NameToken] * 3)),
+    ('like_regex', add_end_query_token([parser.LikeRegexToken])),
+    # '.2' is a number, not a period
+    ('in(.2)', add_end_query_token([parser.InToken, parser.OpeningParenToken, parser.NumberToken,
+                                    parser.ClosingParenToken])),
+    ('a<=b<>c', add_end_query_token([parser.NameToken, parser.LteToken, parser.NameToken,
+                                     parser.NeToken, parser.NameToken])),
+])
+def test_rule_priorities(string, expected_token_classes):
+    assert_classes_equal(
+        list(parser.tokenize(string)),
+        expected_token_classes
+    )
+
+
+def test_token_groups():
+    string_token, number_token, _ = parser.tokenize("'it''s'2.5E1kb")
+    assert string_token.match.group('string') == "it''s"
+    assert number_token.value == 25 * 1024
+
+
+def test_huge_query():
+    condition = " or name = 'x' and size > 1.5kb"
+    query = 'select name where size = 0' + condition * 10000
+    tokens = list(parser.tokenize(query))
+    assert len(tokens) == 6 + 8 * 10000 + 1
+    assert isinstance(tokens[-1], parser.EndQueryToken)
+    assert tokens[-1].start == len(query)
+
+
+def test_lexer_rejects_unsupported_flags():
+    lexer = parser.Lexer()
+    with pytest.raises(ValueError):
+        lexer.add(re.compile('x', re.IGNORECASE), parser.NameToken)
+
+
 def assert_tokenizes_to(string, expected_tokens):
     actual_tokens = list(parser.tokenize(string))
     assert len(actual_tokens) == len(expected_tokens)
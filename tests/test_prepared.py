@@ -0,0 +1,158 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+
+import pytest
+
+import lsql
+from lsql import ast
+from lsql import parser
+from lsql import prepared
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+@pytest.fixture
+def plan_cache():
+    return prepared.PlanCache(max_size=10)
+
+
+def test_prepare_is_exported(plan_cache):
+    query = lsql.prepare("select name where ext = 'py'", plan_cache)
+    assert query is prepared.prepare("select name where ext = 'py'", plan_cache)
+    assert lsql.prepare('select name') is prepared.prepare('select name')
+
+
+def test_execute(plan_cache):
+    query = prepared.prepare("select name where ext = 'py'", plan_cache)
+    assert list(query.execute(BASE_DIR)) == [('small.py',)]
+    # plan can be executed many times
+    assert list(query.execute(BASE_DIR)) == [('small.py',)]
+
+
+def test_execute_aggregates_many_times(plan_cache):
+    query = prepared.prepare('select count(*), sum(size)', plan_cache)
+    assert list(query.execute(BASE_DIR)) == list(query.execute(BASE_DIR))
+
+
+@pytest.mark.parametrize('query_string', [
+    "select name where ext = 'py'",
+    "SELECT name WHERE ext = 'py'",
+    "select  name\n where ext='py'",
+])
+def test_normalized_queries_share_plan(plan_cache, query_string):
+    expected = prepared.prepare("select name where ext = 'py'", plan_cache)
+    assert prepared.prepare(query_string, plan_cache) is expected
+
+
+@pytest.mark.parametrize('query_string, other_query_string', [
+    # names and strings are not normalized: column name `NAME` is shown in the header
+    ('select name', 'select NAME'),
+    ("select name where ext = 'py'", "select name where ext = 'PY'"),
+])
+def test_different_queries_have_different_plans(plan_cache, query_string, other_query_string):
+    query = prepared.prepare(query_string, plan_cache)
+    assert prepared.prepare(other_query_string, plan_cache) is not query
+
+
+def test_cached_query_is_not_parsed(plan_cache, monkeypatch):
+    prepared.prepare('select name', plan_cache)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('cached query was tokenized or parsed')
+
+    monkeypatch.setattr(parser, 'tokenize', fail)
+    monkeypatch.setattr(parser, 'parse', fail)
+    prepared.prepare('select name', plan_cache)
+
+
+def test_plan_cache_evicts_least_recently_used():
+    cache = prepared.PlanCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert len(cache) == 2
+
+
+def test_query_texts_dont_evict_plans(monkeypatch):
+    cache = prepared.PlanCache(max_size=2)
+    parse = parser.parse
+    parsed = []
+
+    def counting_parse(tokens):
+        parsed.append(tokens)
+        return parse(tokens)
+
+    monkeypatch.setattr(parser, 'parse', counting_parse)
+    # queries differ only in spacing, e.g generated ones
+    for num_spaces in range(1, 6):
+        for query_string in ['select{}name', 'select{}size']:
+            prepared.prepare(query_string.format(' ' * num_spaces), cache)
+    assert len(parsed) == 2
+    assert len(cache) == 2
+
+
+@pytest.mark.parametrize('query_string, params, expected', [
+    ('select name where size > :min_size', {'min_size': 13}, [('README.md',), ('small.py',)]),
+    ('select name where name like :pattern', {'pattern': '%.py'}, [('small.py',)]),
+    ('select name where ext in (:x, :y)', {'x': 'py', 'y': 'md'}, [('README.md',), ('small.py',)]),
+    ('select name order by name limit :n', {'n': 1}, [('LICENSE',)]),
+    ('select name from :dir where depth = 0', {'dir': BASE_DIR + '/small'}, [('LICENSE',)]),
+    # parameter names are case-insensitive
+    ('select :Value', {'VALUE': 'x'}, [('x',)] * 4),
+])
+def test_params(plan_cache, query_string, params, expected):
+    query = prepared.prepare(query_string, plan_cache)
+    assert sorted(query.execute(BASE_DIR, params)) == expected
+
+
+def test_params_dont_require_replanning(plan_cache):
+    query = prepared.prepare('select name where ext = :ext', plan_cache)
+    assert list(query.execute(BASE_DIR, {'ext': 'py'})) == [('small.py',)]
+    assert list(query.execute(BASE_DIR, {'ext': 'md'})) == [('README.md',)]
+
+
+def test_missing_param(plan_cache):
+    query = prepared.prepare('select name where size > :min_size', plan_cache)
+    with pytest.raises(ast.MissingParameterError):
+        query.execute(BASE_DIR)
+
+
+def test_unknown_param(plan_cache):
+    query = prepared.prepare('select name', plan_cache)
+    with pytest.raises(ast.UnknownParameterError):
+        query.execute(BASE_DIR, {'min_size': 1})
+
+
+@pytest.mark.parametrize('query_string', [
+    'select ext, count(*), sum(size), max(name) group by ext',
+    "select name where ext in (select ext where size > 13) order by name",
+])
+def test_concurrent_executions(plan_cache, query_string):
+    query = prepared.prepare(query_string, plan_cache)
+    expected = sorted(query.execute(BASE_DIR))
+    results = []
+
+    def execute_many():
+        for _ in range(20):
+            results.append(sorted(query.execute(BASE_DIR)))
+
+    threads = [threading.Thread(target=execute_many) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [expected] * 160
+
+
+def test_nested_executions(plan_cache):
+    query = prepared.prepare('select count(*), sum(size)', plan_cache)
+    agg_node = query.query_node.analysis.agg_function_nodes[0]
+    outer = ast.ExecutionState()
+    outer.get_aggregate(agg_node).add(1)
+    # execution with another state doesn't see the aggregate of the outer one
+    assert list(query.execute(BASE_DIR)) == [(4, 126)]
+    assert outer.get_aggregate(agg_node).value == 1
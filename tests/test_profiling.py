@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pstats
+
+import pytest
+
+from lsql import main
+from lsql import prepared
+from lsql import profiling
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+def profile(query):
+    profiler = profiling.Profiler()
+    table = prepared.prepare(query, prepared.PlanCache()).execute(BASE_DIR, profiler=profiler)
+    return table, profiler
+
+
+def get_calls(profiler):
+    return {(entry.kind, entry.name): entry.calls for entry in profiler.get_entries()}
+
+
+def test_calls():
+    table, profiler = profile("select name, length(ext) where size > 1 and name like '%.py'")
+    assert [row.name for row in table] == ['small.py']
+    assert get_calls(profiler) == {
+        ('operator', 'and'): 4,
+        ('operator', '>'): 4,
+        ('column', 'size'): 4,
+        ('operator', 'like'): 4,
+        ('column', 'name'): 5,
+        ('function', 'length'): 1,
+        ('column', 'extension'): 1,
+    }
+
+
+def test_aggregates_and_subqueries():
+    _, profiler = profile('select count(*) where name in (select name where depth = 0)')
+    calls = get_calls(profiler)
+    assert calls[('aggregate', 'count')] == 3
+    assert calls[('subquery', 'subquery')] == 4
+    assert calls[('column', 'depth')] == 4
+
+
+def test_times():
+    _, profiler = profile("select name where owner = 'nobody' or size > 1")
+    entries = {entry.name: entry for entry in profiler.get_entries()}
+    assert profiler.total_seconds >= entries['or'].cumulative_seconds
+    assert entries['or'].cumulative_seconds >= entries['='].cumulative_seconds
+    assert entries['='].cumulative_seconds >= entries['owner'].cumulative_seconds
+    for entry in entries.viewvalues():
+        assert 0 <= entry.own_seconds <= entry.cumulative_seconds + 1e-9
+
+
+def test_plan_isnt_modified():
+    query = prepared.prepare('select name where size > 1', prepared.PlanCache())
+    nodes = list(query.query_node.iter_subtree())
+    classes = [type(node) for node in nodes]
+    query.execute(BASE_DIR, profiler=profiling.Profiler())
+    assert [type(node) for node in query.query_node.iter_subtree()] == classes
+    assert list(query.execute(BASE_DIR)) == list(query.execute(BASE_DIR, profiler=profiling.Profiler()))
+
+
+def test_format_report():
+    _, profiler = profile('select name where size > 1')
+    lines = profiling.format_report(profiler)
+    assert lines[0].startswith('Total: ')
+    assert lines[1].split() == ['kind', 'name', 'calls', 'cumulative', 'own', '%']
+    assert {tuple(line.split()[:3]) for line in lines[2:]} == {
+        ('operator', '>', '4'),
+        ('column', 'size', '4'),
+        ('column', 'name', '4'),
+    }
+
+
+def test_main_profile(capsys, tmpdir):
+    path = str(tmpdir.join('query.pstats'))
+    argv = ['--profile', '--profile-output', path, 'select owner', BASE_DIR]
+    assert main.main(argv) == main.SUCCESS_CODE
+    _, err = capsys.readouterr()
+    assert err.splitlines()[2].split()[:3] == ['column', 'owner', '4']
+    function_names = {name for _, _, name in pstats.Stats(path).stats}
+    assert 'run_query' in function_names
@@ -0,0 +1,92 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+
+import pytest
+
+from lsql import main
+from lsql import prepared
+from lsql import progress
+from lsql import tracing
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        # every look at the clock takes a second
+        self.now += 1.0
+        return self.now
+
+
+def run_with_progress(query, history=None):
+    lines = []
+    reporter = progress.ProgressReporter(lines.append, history=history, interval=1.5, clock=FakeClock())
+    with tracing.installed(reporter):
+        prepared.prepare(query, prepared.PlanCache()).execute(BASE_DIR)
+    return reporter, lines
+
+
+def test_progress():
+    reporter, lines = run_with_progress("select name where name like '%.py'")
+    assert (reporter.num_directories, reporter.num_entries, reporter.num_matched) == (2, 4, 1)
+    # clock: start=1, listdirs=2, 3 (report), scanned rows=4, matched rows=5 (report), done=6
+    current = os.path.join(BASE_DIR, 'small')
+    assert lines == [
+        'progress: 2.0s dirs=2 (1/s) files=4 (2/s) rows_matched=0 bytes_read=0 eta=? current=' + current,
+        'progress: 4.0s dirs=2 (0/s) files=4 (0/s) rows_matched=1 bytes_read=0 eta=? current=' + current,
+        'done: 5.0s dirs=2 (0/s) files=4 (1/s) rows_matched=1 bytes_read=0',
+    ]
+
+
+def test_bytes_read():
+    reporter, _ = run_with_progress("select name where text like '%'")
+    assert reporter.bytes_read == 13 + 19 + 81
+
+
+def test_eta(tmpdir):
+    history = progress.ProgressHistory(str(tmpdir.join('cache', 'progress.json')))
+    run_with_progress('select name', history)
+    assert history.get(os.path.abspath(BASE_DIR)) == {'directories': 2, 'entries': 4}
+    history.put(os.path.abspath(BASE_DIR), {'directories': 2, 'entries': 8})
+    _, lines = run_with_progress('select name', history)
+    assert ' eta=2s ' in lines[0]
+
+
+def test_history_is_kept_by_scanned_directory(tmpdir):
+    history = progress.ProgressHistory(str(tmpdir.join('progress.json')))
+    small_dir = os.path.join(BASE_DIR, 'small')
+    run_with_progress("select name from '{}'".format(small_dir), history)
+    assert history.get(os.path.abspath(small_dir)) == {'directories': 1, 'entries': 1}
+    assert history.get(os.path.abspath(BASE_DIR)) is None
+
+
+@pytest.mark.parametrize('query', [
+    'select name, size',
+    "select name where name in (select name from '{}')".format(os.path.join(BASE_DIR, 'small')),
+    "select name where name in (select name)",
+])
+def test_only_scan_of_query_is_counted(tmpdir, query):
+    history = progress.ProgressHistory(str(tmpdir.join('progress.json')))
+    reporter, _ = run_with_progress(query, history)
+    assert (reporter.num_directories, reporter.num_entries) == (2, 4)
+    assert history.get(os.path.abspath(BASE_DIR)) == {'directories': 2, 'entries': 4}
+
+
+def test_broken_history(tmpdir):
+    path = tmpdir.join('progress.json')
+    path.write('[')
+    history = progress.ProgressHistory(str(path))
+    assert history.get('/') is None
+    history.put('/', {'directories': 1, 'entries': 2})
+    assert history.get('/') == {'directories': 1, 'entries': 2}
+
+
+def test_main_progress_file(tmpdir, monkeypatch):
+    monkeypatch.setattr(progress, 'DEFAULT_HISTORY_PATH', str(tmpdir.join('progress.json')))
+    path = tmpdir.join('status')
+    assert main.main(['--progress-file', str(path), 'select name', BASE_DIR]) == main.SUCCESS_CODE
+    assert path.read().startswith('done: ')
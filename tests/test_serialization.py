@@ -0,0 +1,83 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from datetime import datetime
+import struct
+
+import pytest
+
+from lsql import ast
+from lsql import parser
+from lsql import prepared
+from lsql import serialization
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+@pytest.mark.parametrize('query_string', [
+    '',
+    'select *',
+    'select name, size * 2, -size where size > 10',
+    "select name where name like '%.py' or name rlike 'R.*' order by name desc limit 2 offset 1",
+    "select name where ext in ('py', 'md') and size between 1 and 100kb",
+    'select ext, count(*), avg(size) group by ext having count(*) > 1 order by ext',
+    'select name where ext in (select ext where size > 13)',
+    'select name where size > :min_size and ext = null',
+    "select 1, 1.0, 'one', 1e100, 2days",
+    "select name where text like '%License%' or lines ilike '%def%'",
+])
+def test_roundtrip(query_string):
+    query_node = parser.parse(parser.tokenize(query_string))
+    loaded = serialization.loads(serialization.dumps(query_node))
+    assert loaded == query_node
+    assert [type(node) for node in loaded.iter_subtree()] == [type(node) for node in query_node.iter_subtree()]
+    # parent links are restored
+    for node in loaded.iter_subtree():
+        for child in node.children:
+            assert child.parent is node
+
+
+@pytest.mark.parametrize('query_string, params', [
+    ("select name where name like '%.py'", {}),
+    ('select ext, count(*), sum(size) group by ext', {}),
+    ('select name where ext in (select ext where size > 13)', {}),
+    ('select name where size > :min_size', {'min_size': 13}),
+])
+def test_loaded_query_has_same_results(query_string, params):
+    query = prepared.prepare(query_string, prepared.PlanCache())
+    loaded = prepared.PreparedQuery.loads(query.dumps())
+    assert sorted(loaded.execute(BASE_DIR, params)) == sorted(query.execute(BASE_DIR, params))
+
+
+def test_null_and_numbers_are_preserved():
+    query_node = parser.parse(parser.tokenize('select null, 1, 1.0, 1 = 1'))
+    loaded = serialization.loads(serialization.dumps(query_node))
+    values = [node.value for node in loaded.iter_subtree() if isinstance(node, ast.ValueNode)]
+    assert values[:3] == [ast.NULL, 1, 1.0]
+    assert [type(value) for value in values[1:3]] == [int, float]
+
+
+def test_huge_query_is_smaller_than_text():
+    query_string = 'select name where ' + ' or '.join("name = 'x{:d}'".format(i) for i in range(3000))
+    query_node = parser.parse(parser.tokenize(query_string))
+    data = serialization.dumps(query_node)
+    assert len(data) < len(query_string.encode('utf-8'))
+    assert serialization.loads(data) == query_node
+
+
+def test_unserializable_value():
+    query_node = parser.parse(parser.tokenize('select 1'))
+    query_node.select_node.children[0].data = datetime.now()
+    with pytest.raises(serialization.SerializationError):
+        serialization.dumps(query_node)
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'LSQ',
+    b'not a plan',
+    serialization.MAGIC + struct.pack(b'<H', serialization.FORMAT_VERSION + 1),
+    serialization.MAGIC + struct.pack(b'<H', serialization.FORMAT_VERSION) + b'garbage',
+])
+def test_bad_data(data):
+    with pytest.raises(serialization.SerializationError):
+        serialization.loads(data)
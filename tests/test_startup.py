@@ -0,0 +1,78 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from timeit import default_timer
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+BASE_DIR = pytest.get_fixture_dir('base')
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that are needed only by some options or by the legacy engine
+LAZY_MODULES = [
+    'pyparsing', 'colorama', 'lsql.legacy', 'cProfile', 'json', 'resource',
+    'lsql.profiling', 'lsql.progress', 'lsql.serialization', 'lsql.hashes', 'sqlite3',
+]
+
+# extra time of `import lsql.main` over the bare interpreter startup, it's generous:
+# the test is about catching eager imports of heavy modules, not about noise
+IMPORT_TIME_BUDGET = 0.25
+
+REPORT_MODULES = 'import sys, json; print(json.dumps(sorted(sys.modules)), file=sys.stderr)'
+
+
+def run_python(code):
+    """:return: stderr of the code."""
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'from __future__ import print_function\n' + code],
+        cwd=PACKAGE_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    _, err = process.communicate()
+    assert process.returncode == 0, err
+    return err
+
+
+def get_loaded_modules(code):
+    # json is imported after the code for reporting, so it's imported only if the code did it
+    code = '{}\nimport sys\n_modules = list(sys.modules)\n{}'.format(
+        code, REPORT_MODULES.replace('sorted(sys.modules)', 'sorted(_modules)'))
+    return set(json.loads(run_python(code).splitlines()[-1]))
+
+
+def test_import_is_lazy():
+    loaded = get_loaded_modules('import lsql.main')
+    assert 'lsql.main' in loaded
+    assert loaded.isdisjoint(LAZY_MODULES), sorted(loaded.intersection(LAZY_MODULES))
+
+
+def test_package_import_is_lazy():
+    loaded = get_loaded_modules('import lsql')
+    assert loaded.isdisjoint(['lsql.prepared', 'lsql.ast', 'lsql.parser']), sorted(loaded)
+
+
+def test_query_is_lazy():
+    code = "import lsql.main\nlsql.main.main(['--color', 'auto', 'select name where size > 1', {!r}])".format(
+        str(BASE_DIR))
+    loaded = get_loaded_modules(code)
+    assert 'lsql.ast' in loaded
+    assert loaded.isdisjoint(LAZY_MODULES), sorted(loaded.intersection(LAZY_MODULES))
+
+
+def test_import_time():
+    def best_time(code, repeat=5):
+        best = float('inf')
+        for _ in range(repeat):
+            start = default_timer()
+            run_python(code)
+            best = min(best, default_timer() - start)
+        return best
+
+    assert best_time('import lsql.main') - best_time('pass') < IMPORT_TIME_BUDGET
+
+
+def test_legacy_is_importable():
+    from lsql import legacy
+    assert legacy.run_query
@@ -0,0 +1,80 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import errno
+import json
+import os
+
+import pytest
+
+from lsql import main
+from lsql import stats
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+def get_summary(query, directory=BASE_DIR):
+    table = main.run_query(query, directory, collect_stats=True)
+    return table.stats.summary()
+
+
+def test_no_stats_by_default():
+    assert main.run_query('select name', BASE_DIR).stats is None
+
+
+def test_summary():
+    summary = get_summary("select name where name like '%.py'")
+    assert summary['directories_listed'] == 2
+    assert summary['entries_seen'] == 4
+    assert summary['rows_scanned'] == 4
+    assert summary['rows_filtered'] == 3
+    assert summary['files_opened'] == 0
+    assert summary['bytes_read'] == 0
+    assert summary['forbidden_paths'] == []
+    assert summary['total_seconds'] >= summary['scan_seconds'] + summary['filter_seconds']
+
+
+def test_summary_bytes_read():
+    summary = get_summary("select name where text like '%'")
+    assert summary['files_opened'] == 3
+    assert summary['bytes_read'] == 13 + 19 + 81
+
+
+def test_summary_subquery():
+    summary = get_summary("select name where name in (select name where extension = '.py')")
+    assert summary['directories_listed'] == 4
+    assert summary['rows_scanned'] == 8
+
+
+def test_forbidden_paths(monkeypatch):
+    listdir = os.listdir
+    forbidden = os.path.join(BASE_DIR, 'small')
+
+    def fake_listdir(path):
+        if path == forbidden:
+            raise OSError(errno.EACCES, 'Permission denied')
+        return listdir(path)
+
+    monkeypatch.setattr(os, 'listdir', fake_listdir)
+    table = main.run_query('select name', BASE_DIR, collect_stats=True)
+    assert sorted(row.name for row in table) == ['README.md', 'small', 'small.py']
+    assert table.stats.summary()['forbidden_paths'] == [forbidden]
+
+
+def test_format_summary():
+    summary = get_summary('select name')
+    line = stats.format_summary(summary)
+    assert '\n' not in line
+    assert 'directories_listed=2 entries_seen=4 ' in line
+    assert 'forbidden_paths=0' in line
+
+
+@pytest.mark.parametrize('format_args', [['--stats-format', 'json'], []])
+def test_main_stats(capsys, format_args):
+    argv = ['--stats'] + format_args + ['select name', BASE_DIR]
+    assert main.main(argv) == main.SUCCESS_CODE
+    out, err = capsys.readouterr()
+    assert len(out.splitlines()) == 4
+    if format_args:
+        assert json.loads(err)['entries_seen'] == 4
+    else:
+        assert err.startswith('directories_listed=2 ')
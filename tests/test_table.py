@@ -0,0 +1,100 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from array import array
+from collections import OrderedDict
+
+import pytest
+
+from lsql import ast
+from lsql import prepared
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+ROW_TYPE = OrderedDict([('name', unicode), ('size', int), ('mtime', int), ('ratio', float)])
+
+ROWS = [
+    ['a', 1, ast.Timestamp(100), 0.5],
+    ['b', 2 ** 40, ast.Timestamp(200), 1.5],
+    ['c', 3, ast.Timestamp(300), 2.0],
+]
+
+
+def make_table(rows=ROWS):
+    return ast.Table(ROW_TYPE, rows)
+
+
+def test_columns_are_arrays():
+    table = make_table()
+    assert len(table) == 3
+    assert [isinstance(values, array) for values, _ in table._columns] == [False, True, True, True]
+
+
+def test_rows():
+    table = make_table()
+    assert table.rows == ROWS
+    assert list(table.iter_rows()) == [tuple(row) for row in ROWS]
+    assert [type(row.mtime) for row in table] == [ast.Timestamp] * 3
+    assert [row.name for row in table] == ['a', 'b', 'c']
+
+
+@pytest.mark.parametrize('values', [
+    [1, ast.NULL, 3],
+    [1, 2.5, 3],
+    [2 ** 70, 1, 2],
+])
+def test_mixed_columns_are_lists(values):
+    table = ast.Table(OrderedDict([('x', int)]), [[value] for value in values])
+    assert isinstance(table._columns[0][0], list)
+    assert list(table.get_column('x')) == values
+
+
+def test_get_column():
+    table = make_table()
+    assert list(table.get_column(0)) == ['a', 'b', 'c']
+    assert list(table.get_column('size')) == [1, 2 ** 40, 3]
+
+
+def test_iter_batches():
+    batches = list(make_table().iter_batches(batch_size=2))
+    assert [list(batch) for batch in batches] == [list(ROW_TYPE)] * 2
+    assert [batch['size'] for batch in batches] == [[1, 2 ** 40], [3]]
+    assert [type(value) for value in batches[1]['mtime']] == [ast.Timestamp]
+
+
+def test_empty_table():
+    table = ast.Table(ROW_TYPE, [])
+    assert (len(table), table.rows, list(table.iter_batches())) == (0, [], [])
+
+
+def test_query_result():
+    table = prepared.prepare('select name, size order by name').execute(BASE_DIR)
+    assert isinstance(table._columns[1][0], array)
+    assert table.rows == [['LICENSE', 13], ['README.md', 19], ['small', 13], ['small.py', 81]]
+
+
+def test_to_numpy():
+    numpy = pytest.importorskip('numpy')
+    table = make_table()
+    arrays = table.to_numpy()
+    assert list(arrays) == list(ROW_TYPE)
+    assert arrays['size'].tolist() == [1, 2 ** 40, 3]
+    assert arrays['mtime'].dtype == numpy.dtype('datetime64[s]')
+    assert arrays['mtime'].astype('int64').tolist() == [100, 200, 300]
+    assert arrays['ratio'].tolist() == [0.5, 1.5, 2.0]
+    assert arrays['name'].tolist() == ['a', 'b', 'c']
+    # numeric columns aren't copied
+    assert not arrays['size'].flags.owndata
+
+
+def test_to_numpy_structured():
+    pytest.importorskip('numpy')
+    result = make_table().to_numpy(structured=True)
+    assert result.dtype.names == tuple(str(name) for name in ROW_TYPE)
+    assert result['size'].tolist() == [1, 2 ** 40, 3]
+    assert result[1]['name'] == 'b'
+
+
+def test_to_numpy_empty():
+    pytest.importorskip('numpy')
+    arrays = ast.Table(ROW_TYPE, []).to_numpy()
+    assert [len(values) for values in arrays.values()] == [0] * 4
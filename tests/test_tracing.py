@@ -0,0 +1,145 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+
+import pytest
+
+from lsql import ast
+from lsql import main
+from lsql import parser
+from lsql import prepared
+from lsql import tracing
+
+BASE_DIR = pytest.get_fixture_dir('base')
+
+
+class RecordingTracer(tracing.Tracer):
+    def __init__(self):
+        self.calls = []
+
+    def plan_built(self, query_string, seconds):
+        self.calls.append(('plan_built', query_string))
+
+    def query_started(self, prepared_query, directory):
+        self.calls.append(('query_started', prepared_query.query_string))
+
+    def query_finished(self, prepared_query, table):
+        self.calls.append(('query_finished', None if table is None else len(table.rows)))
+
+    def error(self, query_string, exc):
+        self.calls.append(('error', type(exc)))
+
+    def directory_listed(self, path, num_entries, seconds):
+        self.calls.append(('directory_listed', num_entries))
+
+    def file_read(self, path, num_bytes):
+        self.calls.append(('file_read', num_bytes))
+
+    def stage_started(self, query_node, stage):
+        self.calls.append(('stage_started', stage))
+
+    def stage_finished(self, query_node, stage, num_rows):
+        self.calls.append(('stage_finished', stage, num_rows))
+
+    def rows_produced(self, query_node, stage, num_rows):
+        self.calls.append(('rows_produced', stage, num_rows))
+
+
+def run_traced(query, plan_cache=None):
+    if plan_cache is None:
+        plan_cache = prepared.PlanCache()
+    tracer = RecordingTracer()
+    with tracing.installed(tracer):
+        prepared.prepare(query, plan_cache).execute(BASE_DIR)
+    return tracer.calls
+
+
+def test_callbacks():
+    query = "select name where name like '%.py' order by name"
+    assert run_traced(query) == [
+        ('plan_built', query),
+        ('query_started', query),
+        ('stage_started', 'filter'),
+        ('directory_listed', 3),
+        ('directory_listed', 1),
+        ('rows_produced', 'scan', 4),
+        ('rows_produced', 'filter', 1),
+        ('stage_finished', 'filter', 1),
+        ('stage_started', 'sort'),
+        ('stage_finished', 'sort', 1),
+        ('stage_started', 'limit'),
+        ('stage_finished', 'limit', 1),
+        ('stage_started', 'project'),
+        ('stage_finished', 'project', 1),
+        ('query_finished', 1),
+    ]
+
+
+def test_scan_batches(monkeypatch):
+    monkeypatch.setattr(tracing, 'SCAN_BATCH_SIZE', 3)
+    calls = run_traced('select name')
+    assert [call for call in calls if call[0] == 'rows_produced'] == [
+        ('rows_produced', 'scan', 3),
+        ('rows_produced', 'filter', 3),
+        ('rows_produced', 'scan', 1),
+        ('rows_produced', 'filter', 1),
+    ]
+
+
+def test_file_read():
+    calls = run_traced("select name where name = 'small.py' and text like '%'")
+    assert ('file_read', 81) in calls
+
+
+def test_tracer_group():
+    tracers = [RecordingTracer(), RecordingTracer()]
+    with tracing.installed(tracing.TracerGroup(tracers)):
+        prepared.prepare('select name', prepared.PlanCache()).execute(BASE_DIR)
+    assert tracers[0].calls == tracers[1].calls == run_traced('select name')
+
+
+def test_cached_plan():
+    plan_cache = prepared.PlanCache()
+    run_traced('select name', plan_cache)
+    assert ('plan_built', 'select name') not in run_traced('select name', plan_cache)
+
+
+def test_planning_error():
+    assert run_traced_error('select name where') == [('error', parser.UnexpectedEndError)]
+
+
+def test_execution_error():
+    calls = run_traced_error('select name', directory=os.path.join(BASE_DIR, 'missing'))
+    assert calls[-2:] == [('error', ast.DirectoryDoesNotExistError), ('query_finished', None)]
+
+
+def run_traced_error(query, directory=BASE_DIR):
+    tracer = RecordingTracer()
+    with tracing.installed(tracer):
+        with pytest.raises(Exception):
+            prepared.prepare(query, prepared.PlanCache()).execute(directory)
+    return tracer.calls
+
+
+def test_installed():
+    tracer = RecordingTracer()
+    with tracing.installed(tracer):
+        assert tracing.get_tracer() is tracer
+    assert tracing.get_tracer() is None
+
+
+def test_chrome_trace(tmpdir):
+    path = str(tmpdir.join('trace.json'))
+    assert main.main(['--trace', path, 'select name order by size', BASE_DIR]) == main.SUCCESS_CODE
+    with open(path) as fileobj:
+        events = json.load(fileobj)['traceEvents']
+    phases = [(event['ph'], event['name']) for event in events]
+    assert phases[:3] == [('X', 'plan'), ('B', 'query'), ('B', 'filter')]
+    assert phases[-1] == ('E', 'query')
+    assert ('C', 'scan rows') in phases
+    begins = sum(1 for phase, _ in phases if phase == 'B')
+    assert begins == sum(1 for phase, _ in phases if phase == 'E')
+    listdirs = [event for event in events if event['name'] == 'listdir']
+    assert listdirs[0]['args'] == {'path': BASE_DIR, 'entries': 3}
+    assert all(event['dur'] >= 0 for event in listdirs)